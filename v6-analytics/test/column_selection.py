@@ -0,0 +1,205 @@
+"""
+Check that the partial methods compute the same result when the data decorator only
+reads the columns that they declare (see `new_data_decorator`), as when the cohort
+file is read in full.
+
+For every partial method, a synthetic cohort file with the column types of the
+cohort files of the sessions algorithm is written to a temporary directory. The
+method is then run on the complete file and on the columns that its selector
+returns. A column that the method uses but that its selector leaves out shows up as
+a different result or error.
+
+Make sure to run the check in an environment where this package and its
+dependencies are installed, e.g. the algorithm image:
+
+    python test/column_selection.py
+"""
+import os
+import sys
+import json
+import inspect
+import tempfile
+import importlib
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from vantage6.algorithm.tools.decorators import RunMetaData
+
+# Without noise the event times, and thus the Kaplan-Meier results, are reproducible
+os.environ["KAPLAN_MEIER_TYPE_NOISE"] = "NONE"
+os.environ["KAPLAN_MEIER_EVENT_TIME_COLUMN"] = ".*"
+
+N_PATIENTS = 200
+
+FORMULA = "OUTCOME ~ AGE + BMI + STAGE"
+
+
+def main() -> int:
+    # The package name contains a hyphen, so it cannot be imported directly
+    analytics = importlib.import_module("v6-analytics")
+    decorator = importlib.import_module("v6-analytics.decorator")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "cohort_synthetic.parquet"
+        write_cohort(path, decorator.FEATURE_TYPES_KEY)
+
+        failures = []
+        for name, method, args, kwargs in partial_calls(analytics, path):
+            full, selected, result = compare(decorator, method, path, args, kwargs)
+            if result is not None:
+                failures.append(f"{name}: {result}")
+            print(f"{name:<24} {selected:>3} of {full} columns, {result or 'same'}")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    return 1 if failures else 0
+
+
+def write_cohort(path: Path, feature_types_key: bytes) -> None:
+    """
+    Write a synthetic cohort file, with the types and metadata key of the files that
+    the sessions algorithm extracts.
+    """
+    rng = np.random.default_rng(0)
+    age = rng.integers(20, 90, N_PATIENTS)
+    bmi = rng.normal(25, 4, N_PATIENTS)
+    bmi[rng.random(N_PATIENTS) < 0.05] = np.nan
+    stage = rng.choice(["I", "II", "III"], N_PATIENTS)
+    df = pd.DataFrame(
+        {
+            "PATIENT_ID": np.arange(1, N_PATIENTS + 1, dtype=np.int64),
+            "AGE": age,
+            "BMI": bmi,
+            "SEX": pd.Categorical(rng.choice(["F", "M"], N_PATIENTS)),
+            "STAGE": pd.Categorical(stage),
+            "STAGE_NUMBER": pd.Series(stage).map({"I": 1, "II": 2, "III": 3}),
+            "SURVIVAL_DAYS": rng.integers(1, 3650, N_PATIENTS),
+            "CENSOR": rng.integers(0, 2, N_PATIENTS).astype(np.int8),
+            "OUTCOME": 0.05 * age + rng.normal(0, 1, N_PATIENTS),
+            "DIAGNOSIS_DATE": pd.Timestamp("2020-01-01")
+            + pd.to_timedelta(rng.integers(0, 1000, N_PATIENTS), unit="D"),
+            "FOLLOW_UP": pd.to_timedelta(rng.integers(0, 1000, N_PATIENTS), unit="D"),
+        }
+    )
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), feature_types_key: b"{}"}
+    )
+    pq.write_table(table, path)
+
+
+def partial_calls(analytics, path: Path):
+    """
+    The partial methods with the data decorator, and the arguments to call them with.
+    """
+    meta = RunMetaData(
+        task_id=1,
+        node_id=1,
+        collaboration_id=1,
+        organization_id=1,
+        temporary_directory=Path(path).parent,
+        output_file=None,
+        input_file=None,
+        token_file=None,
+    )
+    yield "partial_crosstab", analytics.partial_crosstab, (), {
+        "results_col": "SEX",
+        "group_cols": ["STAGE"],
+    }
+    yield "compute_local_counts", analytics.compute_local_counts, (meta,), {}
+    yield "t_test_partial", analytics.t_test_partial, (), {}
+
+    km = {"time_column_name": "SURVIVAL_DAYS", "strata_column_name": "SEX"}
+    yield "get_unique_event_times", analytics.get_unique_event_times, (), km
+    unique_event_times = sorted(
+        pd.read_parquet(path, columns=["SURVIVAL_DAYS"])["SURVIVAL_DAYS"].unique()
+    )
+    yield "get_km_event_table", analytics.get_km_event_table, (), {
+        **km,
+        "censor_column_name": "CENSOR",
+        "unique_event_times": [int(time) for time in unique_event_times],
+    }
+
+    glm = {
+        "use_cohort_names": None,
+        "formula": FORMULA,
+        "family": "gaussian",
+        "categorical_predictors": ["STAGE_NUMBER"],
+    }
+    yield "compute_local_betas", analytics.compute_local_betas, (), {
+        **glm,
+        "is_first_iteration": True,
+    }
+    betas = first_iteration_betas(analytics, path, glm)
+    yield "compute_local_deviance", analytics.compute_local_deviance, (), {
+        **glm,
+        "is_first_iteration": True,
+        "global_average_outcome_var": {"cohort_0": 2.5},
+        "beta_coefficients": {"cohort_0": betas},
+    }
+
+
+def first_iteration_betas(analytics, path: Path, glm: dict) -> dict[str, float]:
+    """
+    Solve the beta coefficients of the first iteration of the GLM on the complete
+    cohort file, to compute the deviance with.
+    """
+    result = analytics.compute_local_betas(
+        mock_data=[pd.read_parquet(path)], is_first_iteration=True, **glm
+    )["cohort_0"]
+    XTX, XTz = pd.DataFrame(result["XTX"]), pd.DataFrame(result["XTz"])
+    betas = np.linalg.solve(XTX.values, XTz.loc[XTX.columns].values)
+    return dict(zip(XTX.columns, betas.ravel().tolist()))
+
+
+def compare(decorator, method, path: Path, args: tuple, kwargs: dict):
+    """
+    Run a partial method on the complete cohort file and on the columns its selector
+    returns.
+
+    Returns
+    -------
+    tuple[int, int, str | None]
+        The number of columns in the file, the number of selected columns and a
+        description of the difference, or None when the results are the same.
+    """
+    data_decorator = method
+    while not getattr(data_decorator, "wrapped_in_data_decorator", False):
+        data_decorator = data_decorator.__wrapped__
+    signature = inspect.signature(data_decorator.__wrapped__)
+    arguments = decorator._bind_arguments(signature, args, kwargs)
+    if arguments is None:
+        raise TypeError(f"Arguments {args} {kwargs} do not match {signature}")
+
+    schema = pq.read_schema(path)
+    full = pd.read_parquet(path)
+    selected = decorator._read_cohort(
+        path, schema, arguments, data_decorator.column_selector
+    )
+
+    expected = run(data_decorator, full, args, kwargs)
+    actual = run(data_decorator, selected, args, kwargs)
+    difference = None
+    if actual != expected:
+        difference = f"expected {expected[:200]}, got {actual[:200]}"
+    return len(full.columns), len(selected.columns), difference
+
+
+def run(data_decorator, df: pd.DataFrame, args: tuple, kwargs: dict) -> str:
+    """
+    Run a partial method and describe its result (or error) as comparable text.
+    """
+    try:
+        result = data_decorator(*args, mock_data=[df.copy()], **kwargs)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return json.dumps(result, sort_keys=True, default=str)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
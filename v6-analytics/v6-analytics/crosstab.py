@@ -19,7 +19,14 @@ from vantage6.algorithm.client import AlgorithmClient
 from .decorator import new_data_decorator
 
 
-@new_data_decorator
+def _crosstab_columns(arguments: dict, schema) -> list[str]:
+    """
+    The results column and the columns to group by.
+    """
+    return [arguments["results_col"], *arguments["group_cols"]]
+
+
+@new_data_decorator(columns=_crosstab_columns)
 def partial_crosstab(
     dfs: list[pd.DataFrame],
     cohort_names: list[str],
@@ -5,7 +5,7 @@ from scipy import stats
 from vantage6.algorithm.client import AlgorithmClient
 from vantage6.algorithm.tools.decorators import algorithm_client, metadata, RunMetaData
 
-from .decorator import new_data_decorator
+from .decorator import new_data_decorator, categorical_columns
 
 
 @algorithm_client
@@ -143,7 +143,7 @@ def combine_center_results(
 
 
 @metadata
-@new_data_decorator
+@new_data_decorator(columns=categorical_columns)
 def compute_local_counts(
     dfs: list[pd.DataFrame], cohort_names: list[str], meta: RunMetaData
 ) -> dict[str, list[dict[str, dict[str, int]]]]:
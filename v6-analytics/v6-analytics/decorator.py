@@ -1,18 +1,54 @@
+import inspect
+
 from functools import wraps
+from typing import Callable
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from vantage6.algorithm.tools.util import info
 from vantage6.algorithm.tools.decorators import _get_user_database_labels
 
+# Key in the Parquet metadata with the types of the columns. Cohort files that are
+# extracted by the sessions algorithm record these, so that their indicators are
+# already stored as 0/1 integers.
+FEATURE_TYPES_KEY = b"v6_feature_types"
+
+# Values of indicator columns in cohort files without recorded types
+INDICATOR_VALUES = {"0": 0, "1": 1, False: 0, True: 1, 0: 0, 1: 1}
 
-def new_data_decorator(func: callable, *args, **kwargs) -> callable:
+
+def new_data_decorator(
+    func: callable = None,
+    *,
+    columns: Callable[[dict, pa.Schema], list[str] | None] | None = None,
+) -> callable:
     """
     Decorator to add data to the function.
 
     This returns the function with the `data_frames` and `cohort_names` as the
     first two arguments.
+
+    The decorator can be told which columns the function needs, so that only these
+    are read from the cohort files:
+
+    >>> @new_data_decorator(columns=lambda arguments, schema: [arguments["col"]])
+    >>> def my_partial(dfs, cohort_names, col): ...
+
+    `columns` receives the arguments of the call by name (including defaults) and
+    the Arrow schema of the cohort file, and returns the columns to read, or None to
+    read all columns. The selector must include every column that the function
+    uses, see `test/column_selection.py`. Requested columns that are not in the file
+    are left out, so that the function can report them. Cohort files without
+    recorded column types are always read in full, as their columns are converted
+    after reading.
     """
+    if func is None:
+        return lambda func: new_data_decorator(func, columns=columns)
+
+    signature = inspect.signature(func)
 
     @wraps(func)
     def decorator(*args, mock_data: list[pd.DataFrame] = None, **kwargs) -> callable:
@@ -21,16 +57,100 @@ def new_data_decorator(func: callable, *args, **kwargs) -> callable:
             data_frames = mock_data
             cohort_names = [f"cohort_{i}" for i in range(len(mock_data))]
         else:
+            arguments = _bind_arguments(signature, args, kwargs)
             cohort_names = _get_user_database_labels()
             data_frames = []
             for cohort_name in cohort_names:
                 info(f"Loading data for cohort {cohort_name}")
 
-                df = pd.read_parquet(f"/mnt/data/{cohort_name}.parquet")
+                path = f"/mnt/data/{cohort_name}.parquet"
+                schema = pq.read_schema(path)
+                if FEATURE_TYPES_KEY not in (schema.metadata or {}):
+                    df = _convert_indicators(pd.read_parquet(path))
+                else:
+                    df = _read_cohort(path, schema, arguments, columns)
                 data_frames.append(df)
 
         args = (data_frames, cohort_names, *args)
         return func(*args, **kwargs)
 
     decorator.wrapped_in_data_decorator = True
+    decorator.column_selector = columns
     return decorator
+
+
+def numeric_columns(arguments: dict, schema: pa.Schema) -> list[str]:
+    """
+    Columns selector for `new_data_decorator` that reads the columns that pandas
+    considers numeric (integers, floats and durations, not booleans).
+    """
+    return [
+        field.name
+        for field in schema
+        if pa.types.is_integer(field.type)
+        or pa.types.is_floating(field.type)
+        or pa.types.is_duration(field.type)
+    ]
+
+
+def categorical_columns(arguments: dict, schema: pa.Schema) -> list[str]:
+    """
+    Columns selector for `new_data_decorator` that reads the categorical columns.
+    """
+    return [field.name for field in schema if pa.types.is_dictionary(field.type)]
+
+
+def _bind_arguments(signature: inspect.Signature, args: tuple, kwargs: dict) -> dict:
+    """
+    The arguments of a call of the decorated function by name, or None when they do
+    not match its signature (the call then fails with the usual error).
+    """
+    try:
+        bound = signature.bind(None, None, *args, **kwargs)
+    except TypeError:
+        return None
+    bound.apply_defaults()
+    return dict(bound.arguments)
+
+
+def _read_cohort(
+    path: str,
+    schema: pa.Schema,
+    arguments: dict | None,
+    columns: Callable[[dict, pa.Schema], list[str] | None] | None,
+) -> pd.DataFrame:
+    """
+    Read the columns of a cohort file that the decorated function needs.
+    """
+    read_columns = None
+    if arguments is not None and columns is not None:
+        read_columns = columns(arguments, schema)
+    if read_columns is not None:
+        read_columns = [
+            col for col in dict.fromkeys(read_columns) if col in schema.names
+        ]
+        info(f"Reading {len(read_columns)} of {len(schema.names)} columns")
+    return pd.read_parquet(path, columns=read_columns)
+
+
+def _convert_indicators(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the indicators of a cohort file that is extracted before the column
+    types were recorded (e.g. stored as booleans or as "0"/"1" categories) to 0/1
+    integers, as they are stored in newer cohort files.
+    """
+    for col in df.columns:
+        values = df[col]
+        if not (
+            pd.api.types.is_bool_dtype(values.dtype)
+            or isinstance(values.dtype, pd.CategoricalDtype)
+        ):
+            continue
+        unique = values.dropna().unique()
+        if len(unique) and all(value in INDICATOR_VALUES for value in unique):
+            converted = values.astype(object).map(INDICATOR_VALUES)
+            if converted.isna().any():
+                df[col] = converted.astype("Int8")
+            else:
+                df[col] = converted.astype(np.int8)
+    return df
@@ -51,19 +51,24 @@ DEFAULT_MINIMUM_ORGANIZATIONS = 1
 DEFAULT_MAX_PCT_PARAMS_VS_OBS = 100
 
 
-def _temp_fix_to_convert_vars_to_int(dfs: list[pd.DataFrame]) -> list[pd.DataFrame]:
+def _glm_columns(arguments: dict, schema) -> list[str] | None:
     """
-    This is a temporary fix to convert the variables to int.
+    The columns used by the model: the variables of the formula, the categorical
+    predictors and the survival sensor column. All columns are read when the formula
+    can not be parsed (e.g. when it uses `.` for all columns).
     """
-    for df in dfs:
-        for i in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]:
-            df[f"SURVIVAL_{i}YR"] = df[f"SURVIVAL_{i}YR"].astype(int)
-            df[f"DEATH_{i}YR"] = df[f"DEATH_{i}YR"].astype(int)
-
-    return dfs
-
-
-@new_data_decorator
+    try:
+        variables = Formula(arguments["formula"]).required_variables
+    except Exception:
+        return None
+    return [
+        *variables,
+        *(arguments["categorical_predictors"] or []),
+        *filter(None, [arguments["survival_sensor_column"]]),
+    ]
+
+
+@new_data_decorator(columns=_glm_columns)
 def compute_local_betas(
     dfs: list[pd.DataFrame],
     cohort_names: list[str],
@@ -86,8 +91,6 @@ def compute_local_betas(
             dfs, cohort_names, use_cohort_names
         )
 
-    dfs = _temp_fix_to_convert_vars_to_int(dfs)
-
     # in the first iteration, beta_coefficients is None
     if not beta_coefficients:
         beta_coefficients = {cohort_name: None for cohort_name in cohort_names}
@@ -112,7 +115,7 @@ def compute_local_betas(
     return local_betas
 
 
-@new_data_decorator
+@new_data_decorator(columns=_glm_columns)
 def compute_local_deviance(
     dfs: list[pd.DataFrame],
     cohort_names: list[str],
@@ -132,8 +135,6 @@ def compute_local_deviance(
             dfs, cohort_names, use_cohort_names
         )
 
-    dfs = _temp_fix_to_convert_vars_to_int(dfs)
-
     # in the first iteration, beta_coefficients_previous is None
     if not beta_coefficients_previous:
         beta_coefficients_previous = {cohort_name: None for cohort_name in cohort_names}
@@ -45,7 +45,19 @@ class NoiseType(str, Enum):
     POISSON = "POISSON"
 
 
-@new_data_decorator
+def _km_columns(arguments: dict, schema) -> list[str]:
+    """
+    The time, censor (for the event table) and strata columns.
+    """
+    columns = (
+        arguments["time_column_name"],
+        arguments.get("censor_column_name"),
+        arguments["strata_column_name"],
+    )
+    return [col for col in columns if col]
+
+
+@new_data_decorator(columns=_km_columns)
 def get_unique_event_times(
     dfs: list[pd.DataFrame],
     cohort_names: list[str],
@@ -63,7 +75,7 @@ def get_unique_event_times(
     return results
 
 
-@new_data_decorator
+@new_data_decorator(columns=_km_columns)
 def get_km_event_table(
     dfs: list[pd.DataFrame],
     cohort_names: list[str],
@@ -13,7 +13,7 @@ from vantage6.algorithm.tools.util import info, error, get_env_var
 from vantage6.algorithm.tools.decorators import data
 from vantage6.algorithm.tools.exceptions import InputError
 
-from .decorator import new_data_decorator
+from .decorator import new_data_decorator, numeric_columns
 
 T_TEST_MINIMUM_NUMBER_OF_RECORDS = 3
 
@@ -109,7 +109,7 @@ def t_test_central(
     return final_result
 
 
-@new_data_decorator
+@new_data_decorator(columns=numeric_columns)
 def t_test_partial(dfs: list[pd.DataFrame], cohort_names: list[str]) -> dict:
     results = {}
     for df, cohort_name in zip(dfs, cohort_names):
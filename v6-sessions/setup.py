@@ -25,6 +25,7 @@ setup(
         "vantage6-algorithm-tools==4.9.1",
         "pandas",
         "pyarrow",
+        "adbc-driver-postgresql",
         "parquet-tools",
         "rpy2",
         "numpy==1.26.4",
@@ -32,5 +33,5 @@ setup(
         "ohdsi-database-connector",
         "ohdsi-sqlrender",
     ],
-    package_data={"v6-sessions": ["sql/*.sql"]},
+    package_data={"v6-sessions": ["sql/*.sql", "sql/postgresql/*"]},
 )
@@ -0,0 +1,405 @@
+"""
+Benchmark of the cohort extraction on a synthetic OMOP CDM.
+
+For every size, a synthetic OMOP CDM with that number of patients is created in a
+PostgreSQL database (see `synthetic_cdm.sql`) and `create_cohort` is run end to end
+for a cohort that contains all patients (see `synthetic_cohort.json`). The benchmark
+reports the throughput (patients per second) and the peak memory of every run.
+
+The algorithm needs R with the OHDSI packages and writes the cohorts to /mnt/data,
+so run the benchmark in the algorithm image, against a local PostgreSQL database:
+
+    docker run --rm --network host -v /tmp/v6-bench:/mnt/data \\
+        harbor2.vantage6.ai/blueberry/sessions:latest \\
+        python /app/test/benchmark.py \\
+            --uri jdbc:postgresql://localhost:5432/postgres \\
+            --user postgres --password postgres
+
+The CDM and results schemas are dropped and recreated for every size, so do not
+point the benchmark at a schema that holds real data. To catch regressions, pass
+the results of an earlier run with `--baseline`; the benchmark then exits with an
+error when the throughput of a size dropped more than `--tolerance`.
+
+The batched engines ("stream", "andromeda" and "arrow") should write the cohort
+files in bounded memory. For these engines the benchmark also exits with an error
+when the peak memory of writing the file grows more than `--memory-tolerance` from
+the smallest to the largest size, or when the file is read back into memory as a
+whole to optimize its layout.
+
+Run `python benchmark.py --help` for all options.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import tempfile
+import importlib
+
+from pathlib import Path
+
+import pyarrow.parquet as pq
+
+from vantage6.algorithm.tools.decorators import (
+    RunMetaData,
+    _create_omop_database_connection,
+)
+
+from ohdsi import sqlrender
+from ohdsi import database_connector
+
+# get path of current directory
+current_path = Path(__file__).parent
+
+# Label of the benchmark database, as it would be configured at the node
+DATABASE_LABEL = "omop"
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+# Engines that should write the cohort files in memory bounded by the batch size
+BATCHED_ENGINES = ("stream", "andromeda", "arrow")
+
+# Stages in which the cohort files are written
+WRITE_STAGES = ("write", "optimize_layout")
+
+
+def main() -> int:
+    args = parse_args()
+    configure_database(args)
+
+    # The package name contains a hyphen, so it cannot be imported directly
+    sessions = importlib.import_module("v6-sessions")
+    cohort_definition = json.loads(
+        (current_path / "synthetic_cohort.json").read_text(encoding="utf-8")
+    )
+
+    results = []
+    for task_id, n_patients in enumerate(args.sizes, start=1):
+        print(f"Creating a synthetic CDM with {n_patients} patients")
+        cdm_seconds = create_synthetic_cdm(args, n_patients)
+
+        print(f"Extracting the cohort of {n_patients} patients")
+        result = run_extraction(sessions, args, cohort_definition, n_patients, task_id)
+        results.append({"patients": n_patients, "cdm_seconds": cdm_seconds, **result})
+        report(results[-1])
+
+    output = {
+        "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "engine": args.engine,
+        "noise_records": args.noise_records,
+        "index_cohort_table": args.index_cohort_table,
+        "generate_stats": args.generate_stats,
+        "feature_groups": args.feature_groups,
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(output, indent=2), encoding="utf-8")
+    print(f"Written the results to {args.output}")
+
+    failed = False
+    if args.engine in BATCHED_ENGINES:
+        violations = check_memory_bound(results, args.memory_tolerance)
+        for violation in violations:
+            print(f"MEMORY: {violation}")
+        failed = bool(violations)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = find_regressions(results, baseline["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions compared to {args.baseline}")
+    return 1 if failed else 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the cohort extraction on a synthetic OMOP CDM."
+    )
+    parser.add_argument(
+        "--uri",
+        required=True,
+        help="JDBC URI of the database, e.g. jdbc:postgresql://localhost:5432/postgres",
+    )
+    parser.add_argument("--user", required=True, help="Database user")
+    parser.add_argument("--password", required=True, help="Database password")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Numbers of patients to benchmark (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--noise-records",
+        type=int,
+        default=10,
+        help="Unrelated conditions and measurements per patient (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cdm-schema",
+        default="benchmark_cdm",
+        help="Schema for the synthetic CDM, dropped first (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--results-schema",
+        default="benchmark_results",
+        help="Schema for the cohort tables, dropped first (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--engine",
+        default="auto",
+        help="Extraction engine passed to create_cohort (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="Batch size passed to create_cohort (default: the algorithm default)",
+    )
+    parser.add_argument(
+        "--index-cohort-table",
+        action="store_true",
+        help="Index and analyze the cohort table before the extraction",
+    )
+    parser.add_argument(
+        "--generate-stats",
+        action="store_true",
+        help="Compute the inclusion rule statistics during the cohort generation",
+    )
+    parser.add_argument(
+        "--feature-groups",
+        nargs="+",
+        default=None,
+        help="Feature groups passed to create_cohort (default: all features)",
+    )
+    parser.add_argument(
+        "--output",
+        default="benchmark_results.json",
+        help="Location of the results (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="Results of an earlier run to compare the throughput with",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed relative drop of the throughput (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--memory-tolerance",
+        type=float,
+        default=64.0,
+        help=(
+            "Allowed growth in MB of the peak memory of writing the cohort file "
+            "for the batched engines (default: %(default)s)"
+        ),
+    )
+    return parser.parse_args()
+
+
+def configure_database(args: argparse.Namespace) -> None:
+    """
+    Set the environment variables that the node sets for an OMOP database, so that
+    `create_cohort` connects to the benchmark database.
+    """
+    label = DATABASE_LABEL.upper()
+    os.environ["USER_REQUESTED_DATABASE_LABELS"] = DATABASE_LABEL
+    os.environ[f"{label}_DATABASE_URI"] = args.uri
+    os.environ[f"{label}_DB_PARAM_DBMS"] = "postgresql"
+    os.environ[f"{label}_DB_PARAM_USER"] = args.user
+    os.environ[f"{label}_DB_PARAM_PASSWORD"] = args.password
+    os.environ[f"{label}_DB_PARAM_CDM_DATABASE"] = args.uri.rsplit("/", 1)[-1]
+    os.environ[f"{label}_DB_PARAM_CDM_SCHEMA"] = args.cdm_schema
+    os.environ[f"{label}_DB_PARAM_RESULTS_SCHEMA"] = args.results_schema
+    os.environ.setdefault("TEMPORARY_FOLDER", tempfile.mkdtemp(prefix="benchmark_"))
+
+
+def create_synthetic_cdm(args: argparse.Namespace, n_patients: int) -> float:
+    """
+    Create the synthetic CDM and an empty results schema.
+
+    Returns
+    -------
+    float
+        The time it took to create the CDM in seconds.
+    """
+    sql = (current_path / "synthetic_cdm.sql").read_text(encoding="utf-8")
+    connection = _create_omop_database_connection(DATABASE_LABEL)
+    start = time.perf_counter()
+    database_connector.execute_sql(
+        connection,
+        sqlrender.render(
+            sql,
+            cdm_schema=args.cdm_schema,
+            n_patients=n_patients,
+            noise_records=args.noise_records,
+        ),
+    )
+    database_connector.execute_sql(
+        connection,
+        f"DROP SCHEMA IF EXISTS {args.results_schema} CASCADE; "
+        f"CREATE SCHEMA {args.results_schema};",
+    )
+    return round(time.perf_counter() - start, 2)
+
+
+def run_extraction(
+    sessions,
+    args: argparse.Namespace,
+    cohort_definition: dict,
+    n_patients: int,
+    task_id: int,
+) -> dict:
+    """
+    Run `create_cohort` for the synthetic cohort and measure it.
+
+    Returns
+    -------
+    dict
+        The wall time, throughput and peak memory of the run, the peak memory of
+        writing the cohort file, the names of the write stages that ran and the
+        wall time of the stages of `create_cohort`.
+    """
+    cohort_name = f"benchmark_{n_patients}"
+    meta_run = RunMetaData(
+        task_id=task_id,
+        node_id=0,
+        collaboration_id=None,
+        organization_id=0,
+        temporary_directory=Path(os.environ["TEMPORARY_FOLDER"]),
+        output_file=None,
+        input_file=None,
+        token_file=None,
+    )
+    options = {
+        "engine": args.engine,
+        "index_cohort_table": args.index_cohort_table,
+        "generate_stats": args.generate_stats,
+        "feature_groups": args.feature_groups,
+    }
+    if args.batch_size:
+        options["batch_size"] = args.batch_size
+
+    # Skip the `metadata` decorator, which reads the task metadata from the token
+    # that the node provides. The results schema is recreated for every size, so
+    # the cohort table does not need to be dropped by the algorithm. Earlier runs on
+    # the same synthetic CDM must not be reused, as then nothing is extracted.
+    start = time.perf_counter()
+    result = sessions.create_cohort.__wrapped__(
+        meta_run,
+        [cohort_definition],
+        [cohort_name],
+        keep_cohort_tables=True,
+        reuse_extractions=False,
+        **options,
+    )
+    seconds = time.perf_counter() - start
+    if "error" in result:
+        raise RuntimeError(f"create_cohort failed: {result['error']}")
+
+    rows = pq.read_metadata(f"/mnt/data/cohort_{cohort_name}.parquet").num_rows
+    sessions.del_cohorts([f"cohort_{cohort_name}"])
+    if rows != n_patients:
+        print(f"WARNING: extracted {rows} rows for {n_patients} patients")
+
+    return {
+        "rows": rows,
+        "seconds": round(seconds, 2),
+        "patients_per_second": round(n_patients / seconds, 1),
+        "peak_rss_mb": max(
+            (stage["peak_rss_mb"] for stage in result["stages"]), default=None
+        ),
+        "write_peak_rss_mb": max(
+            (
+                stage["peak_rss_mb"]
+                for stage in result["stages"]
+                if stage["stage"] in WRITE_STAGES
+            ),
+            default=None,
+        ),
+        "write_stages": sorted(
+            {stage["stage"] for stage in result["stages"]} & set(WRITE_STAGES)
+        ),
+        "timings": result["timings"],
+    }
+
+
+def report(result: dict) -> None:
+    print(
+        f"{result['patients']:>9} patients: {result['seconds']:>9.2f} s, "
+        f"{result['patients_per_second']:>9.1f} patients/s, "
+        f"peak RSS {result['peak_rss_mb']} MB"
+    )
+    for stage, seconds in result["timings"].items():
+        print(f"{'':>11}{stage:<20} {seconds:>9.2f} s")
+
+
+def find_regressions(results: list[dict], baseline: list[dict], tolerance: float):
+    """
+    Compare the throughput of the sizes that are in both the results and baseline.
+
+    Returns
+    -------
+    list[str]
+        A description of every size of which the throughput dropped more than the
+        tolerance.
+    """
+    baseline = {result["patients"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["patients"])
+        if previous is None:
+            continue
+        minimum = previous["patients_per_second"] * (1 - tolerance)
+        if result["patients_per_second"] < minimum:
+            regressions.append(
+                f"{result['patients']} patients: "
+                f"{result['patients_per_second']} patients/s, "
+                f"baseline {previous['patients_per_second']} patients/s"
+            )
+    return regressions
+
+
+def check_memory_bound(results: list[dict], tolerance: float) -> list[str]:
+    """
+    Check that writing the cohort file does not need more memory for larger
+    cohorts, as the batched engines only hold a single batch in memory.
+
+    Returns
+    -------
+    list[str]
+        A description of every size that read the complete file back into memory,
+        or of which the peak memory of the write stages grew more than the
+        tolerance (in MB) compared to the smallest size.
+    """
+    violations = [
+        f"{result['patients']} patients: the file was read back to optimize its "
+        "layout"
+        for result in results
+        if "optimize_layout" in result["write_stages"]
+    ]
+    measured = sorted(
+        (result for result in results if result["write_peak_rss_mb"] is not None),
+        key=lambda result: result["patients"],
+    )
+    if len(measured) < 2:
+        return violations
+    smallest, largest = measured[0], measured[-1]
+    growth = largest["write_peak_rss_mb"] - smallest["write_peak_rss_mb"]
+    if growth > tolerance:
+        violations.append(
+            f"{largest['patients']} patients: writing peaked at "
+            f"{largest['write_peak_rss_mb']} MB, {growth:.1f} MB more than for "
+            f"{smallest['patients']} patients"
+        )
+    return violations
+
+
+if __name__ == "__main__":
+    sys.exit(main())
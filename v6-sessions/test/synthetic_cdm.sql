@@ -0,0 +1,583 @@
+--- Synthetic OMOP CDM for the extraction benchmark, see `benchmark.py`.
+---
+--- Every patient has a sarcoma diagnosis (the entry event of the benchmark cohort) with
+--- a disease episode, tumor size, grade and focality at diagnosis and a surgery with
+--- the resection margin. Depending on the person ID, a patient also has a second
+--- disease episode, radiotherapy, chemotherapy, a tumor rupture, a recurrence,
+--- metastases and a death date. Each patient further has `@noise_records` unrelated
+--- conditions and measurements, so that the feature query has to filter the CDM
+--- tables as it does on a real database.
+---
+--- All values are derived from the person ID, so every run creates the same data.
+--- This file is written for PostgreSQL and is only rendered, not translated.
+DROP SCHEMA IF EXISTS @cdm_schema CASCADE;
+CREATE SCHEMA @cdm_schema;
+
+CREATE TABLE @cdm_schema.concept (
+    concept_id INTEGER NOT NULL,
+    concept_name VARCHAR(255) NOT NULL,
+    domain_id VARCHAR(20) NOT NULL,
+    vocabulary_id VARCHAR(20) NOT NULL,
+    concept_class_id VARCHAR(20) NOT NULL,
+    standard_concept VARCHAR(1) NULL,
+    concept_code VARCHAR(50) NOT NULL,
+    valid_start_date DATE NOT NULL,
+    valid_end_date DATE NOT NULL,
+    invalid_reason VARCHAR(1) NULL
+);
+
+CREATE TABLE @cdm_schema.concept_ancestor (
+    ancestor_concept_id INTEGER NOT NULL,
+    descendant_concept_id INTEGER NOT NULL,
+    min_levels_of_separation INTEGER NOT NULL,
+    max_levels_of_separation INTEGER NOT NULL
+);
+
+CREATE TABLE @cdm_schema.cdm_source (
+    cdm_source_name VARCHAR(255) NOT NULL,
+    cdm_source_abbreviation VARCHAR(25) NOT NULL,
+    cdm_holder VARCHAR(255) NOT NULL,
+    source_description TEXT NULL,
+    source_documentation_reference VARCHAR(255) NULL,
+    cdm_etl_reference VARCHAR(255) NULL,
+    source_release_date DATE NOT NULL,
+    cdm_release_date DATE NOT NULL,
+    cdm_version VARCHAR(10) NULL,
+    cdm_version_concept_id INTEGER NOT NULL,
+    vocabulary_version VARCHAR(20) NOT NULL
+);
+
+CREATE TABLE @cdm_schema.person (
+    person_id INTEGER NOT NULL,
+    gender_concept_id INTEGER NOT NULL,
+    year_of_birth INTEGER NOT NULL,
+    month_of_birth INTEGER NULL,
+    day_of_birth INTEGER NULL,
+    birth_datetime TIMESTAMP NULL,
+    race_concept_id INTEGER NOT NULL,
+    ethnicity_concept_id INTEGER NOT NULL,
+    location_id INTEGER NULL,
+    provider_id INTEGER NULL,
+    care_site_id INTEGER NULL,
+    person_source_value VARCHAR(50) NULL,
+    gender_source_value VARCHAR(50) NULL,
+    gender_source_concept_id INTEGER NULL,
+    race_source_value VARCHAR(50) NULL,
+    race_source_concept_id INTEGER NULL,
+    ethnicity_source_value VARCHAR(50) NULL,
+    ethnicity_source_concept_id INTEGER NULL
+);
+
+CREATE TABLE @cdm_schema.observation_period (
+    observation_period_id INTEGER NOT NULL,
+    person_id INTEGER NOT NULL,
+    observation_period_start_date DATE NOT NULL,
+    observation_period_end_date DATE NOT NULL,
+    period_type_concept_id INTEGER NOT NULL
+);
+
+CREATE TABLE @cdm_schema.death (
+    person_id INTEGER NOT NULL,
+    death_date DATE NOT NULL,
+    death_datetime TIMESTAMP NULL,
+    death_type_concept_id INTEGER NULL,
+    cause_concept_id INTEGER NULL,
+    cause_source_value VARCHAR(50) NULL,
+    cause_source_concept_id INTEGER NULL
+);
+
+CREATE TABLE @cdm_schema.condition_occurrence (
+    condition_occurrence_id INTEGER NOT NULL,
+    person_id INTEGER NOT NULL,
+    condition_concept_id INTEGER NOT NULL,
+    condition_start_date DATE NOT NULL,
+    condition_start_datetime TIMESTAMP NULL,
+    condition_end_date DATE NULL,
+    condition_end_datetime TIMESTAMP NULL,
+    condition_type_concept_id INTEGER NOT NULL,
+    condition_status_concept_id INTEGER NULL,
+    stop_reason VARCHAR(20) NULL,
+    provider_id INTEGER NULL,
+    visit_occurrence_id INTEGER NULL,
+    visit_detail_id INTEGER NULL,
+    condition_source_value VARCHAR(50) NULL,
+    condition_source_concept_id INTEGER NULL,
+    condition_status_source_value VARCHAR(50) NULL
+);
+
+CREATE TABLE @cdm_schema.visit_occurrence (
+    visit_occurrence_id INTEGER NOT NULL,
+    person_id INTEGER NOT NULL,
+    visit_concept_id INTEGER NOT NULL,
+    visit_start_date DATE NOT NULL,
+    visit_start_datetime TIMESTAMP NULL,
+    visit_end_date DATE NOT NULL,
+    visit_end_datetime TIMESTAMP NULL,
+    visit_type_concept_id INTEGER NOT NULL,
+    provider_id INTEGER NULL,
+    care_site_id INTEGER NULL,
+    visit_source_value VARCHAR(50) NULL,
+    visit_source_concept_id INTEGER NULL,
+    admitted_from_concept_id INTEGER NULL,
+    admitted_from_source_value VARCHAR(50) NULL,
+    discharged_to_concept_id INTEGER NULL,
+    discharged_to_source_value VARCHAR(50) NULL,
+    preceding_visit_occurrence_id INTEGER NULL
+);
+
+CREATE TABLE @cdm_schema.drug_exposure (
+    drug_exposure_id INTEGER NOT NULL,
+    person_id INTEGER NOT NULL,
+    drug_concept_id INTEGER NOT NULL,
+    drug_exposure_start_date DATE NOT NULL,
+    drug_exposure_start_datetime TIMESTAMP NULL,
+    drug_exposure_end_date DATE NOT NULL,
+    drug_exposure_end_datetime TIMESTAMP NULL,
+    verbatim_end_date DATE NULL,
+    drug_type_concept_id INTEGER NOT NULL,
+    stop_reason VARCHAR(20) NULL,
+    refills INTEGER NULL,
+    quantity NUMERIC NULL,
+    days_supply INTEGER NULL,
+    sig TEXT NULL,
+    route_concept_id INTEGER NULL,
+    lot_number VARCHAR(50) NULL,
+    provider_id INTEGER NULL,
+    visit_occurrence_id INTEGER NULL,
+    visit_detail_id INTEGER NULL,
+    drug_source_value VARCHAR(50) NULL,
+    drug_source_concept_id INTEGER NULL,
+    route_source_value VARCHAR(50) NULL,
+    dose_unit_source_value VARCHAR(50) NULL
+);
+
+CREATE TABLE @cdm_schema.observation (
+    observation_id INTEGER NOT NULL,
+    person_id INTEGER NOT NULL,
+    observation_concept_id INTEGER NOT NULL,
+    observation_date DATE NOT NULL,
+    observation_datetime TIMESTAMP NULL,
+    observation_type_concept_id INTEGER NOT NULL,
+    value_as_number NUMERIC NULL,
+    value_as_string VARCHAR(60) NULL,
+    value_as_concept_id INTEGER NULL,
+    qualifier_concept_id INTEGER NULL,
+    unit_concept_id INTEGER NULL,
+    provider_id INTEGER NULL,
+    visit_occurrence_id INTEGER NULL,
+    visit_detail_id INTEGER NULL,
+    observation_source_value VARCHAR(50) NULL,
+    observation_source_concept_id INTEGER NULL,
+    unit_source_value VARCHAR(50) NULL,
+    qualifier_source_value VARCHAR(50) NULL,
+    value_source_value VARCHAR(50) NULL,
+    observation_event_id BIGINT NULL,
+    obs_event_field_concept_id INTEGER NULL
+);
+
+CREATE TABLE @cdm_schema.procedure_occurrence (
+    procedure_occurrence_id INTEGER NOT NULL,
+    person_id INTEGER NOT NULL,
+    procedure_concept_id INTEGER NOT NULL,
+    procedure_date DATE NOT NULL,
+    procedure_datetime TIMESTAMP NULL,
+    procedure_end_date DATE NULL,
+    procedure_end_datetime TIMESTAMP NULL,
+    procedure_type_concept_id INTEGER NOT NULL,
+    modifier_concept_id INTEGER NULL,
+    quantity INTEGER NULL,
+    provider_id INTEGER NULL,
+    visit_occurrence_id INTEGER NULL,
+    visit_detail_id INTEGER NULL,
+    procedure_source_value VARCHAR(50) NULL,
+    procedure_source_concept_id INTEGER NULL,
+    modifier_source_value VARCHAR(50) NULL
+);
+
+CREATE TABLE @cdm_schema.measurement (
+    measurement_id INTEGER NOT NULL,
+    person_id INTEGER NOT NULL,
+    measurement_concept_id INTEGER NOT NULL,
+    measurement_date DATE NOT NULL,
+    measurement_datetime TIMESTAMP NULL,
+    measurement_time VARCHAR(10) NULL,
+    measurement_type_concept_id INTEGER NOT NULL,
+    operator_concept_id INTEGER NULL,
+    value_as_number NUMERIC NULL,
+    value_as_concept_id INTEGER NULL,
+    unit_concept_id INTEGER NULL,
+    range_low NUMERIC NULL,
+    range_high NUMERIC NULL,
+    provider_id INTEGER NULL,
+    visit_occurrence_id INTEGER NULL,
+    visit_detail_id INTEGER NULL,
+    measurement_source_value VARCHAR(50) NULL,
+    measurement_source_concept_id INTEGER NULL,
+    unit_source_value VARCHAR(50) NULL,
+    unit_source_concept_id INTEGER NULL,
+    value_source_value VARCHAR(50) NULL,
+    measurement_event_id BIGINT NULL,
+    meas_event_field_concept_id INTEGER NULL
+);
+
+CREATE TABLE @cdm_schema.episode (
+    episode_id BIGINT NOT NULL,
+    person_id BIGINT NOT NULL,
+    episode_concept_id INTEGER NOT NULL,
+    episode_start_date DATE NOT NULL,
+    episode_start_datetime TIMESTAMP NULL,
+    episode_end_date DATE NULL,
+    episode_end_datetime TIMESTAMP NULL,
+    episode_parent_id BIGINT NULL,
+    episode_number INTEGER NULL,
+    episode_object_concept_id INTEGER NOT NULL,
+    episode_type_concept_id INTEGER NOT NULL,
+    episode_source_value VARCHAR(50) NULL,
+    episode_source_concept_id INTEGER NULL
+);
+
+CREATE TABLE @cdm_schema.episode_event (
+    episode_id BIGINT NOT NULL,
+    event_id BIGINT NOT NULL,
+    episode_event_field_concept_id INTEGER NOT NULL
+);
+
+--- Vocabulary: the concepts used by the feature query, the synthetic diagnosis and
+--- the concepts of the unrelated records (IDs above 2000000000 are local concepts)
+INSERT INTO @cdm_schema.concept
+SELECT
+    concept_id,
+    concept_name,
+    domain_id,
+    'Synthetic',
+    'Synthetic',
+    'S',
+    CAST(concept_id AS VARCHAR(50)),
+    DATE '1970-01-01',
+    DATE '2099-12-31',
+    NULL
+FROM (
+    VALUES
+        (8507, 'MALE', 'Gender'),
+        (8532, 'FEMALE', 'Gender'),
+        (8582, 'centimeter', 'Unit'),
+        (8588, 'millimeter', 'Unit'),
+        (32533, 'Disease Episode', 'Episode'),
+        (32939, 'Surgery', 'Episode'),
+        (32940, 'Radiotherapy', 'Episode'),
+        (32941, 'Cancer Drug Treatment', 'Episode'),
+        (36529541, 'Liposarcoma', 'Condition'),
+        (36517959, 'Leiomyosarcoma', 'Condition'),
+        (36564558, 'Solitary fibrous tumor', 'Condition'),
+        (36518164, 'Malignant peripheral nerve sheath tumor', 'Condition'),
+        (36517265, 'Undifferentiated pleomorphic sarcoma', 'Condition'),
+        (36517688, 'Sarcoma, other', 'Condition'),
+        (4301351, 'Surgical procedure', 'Procedure'),
+        (4311405, 'Biopsy', 'Measurement'),
+        (4273629, 'Chemotherapy', 'Procedure'),
+        (4097297, 'Recurrent neoplasm', 'Condition'),
+        (4163998, 'Unifocal tumor', 'Condition'),
+        (4163442, 'Multifocal tumor', 'Condition'),
+        (36769933, 'Unifocal Tumor', 'Measurement'),
+        (36769332, 'Multifocal Tumor', 'Measurement'),
+        (36769180, 'Metastasis', 'Measurement'),
+        (36768904, 'Tumor Rupture', 'Measurement'),
+        (36768664, 'Tumor size', 'Measurement'),
+        (36768255, 'Tumor size, largest dimension', 'Measurement'),
+        (1634643, 'R0: No residual tumor', 'Measurement'),
+        (1633801, 'R1: Microscopic residual tumor', 'Measurement'),
+        (1634484, 'R2: Macroscopic residual tumor', 'Measurement'),
+        (1634371, 'FNCLCC Grade 1', 'Measurement'),
+        (1634752, 'FNCLCC Grade 2', 'Measurement'),
+        (1633749, 'FNCLCC Grade 3', 'Measurement'),
+        (2000000001, 'Synthetic sarcoma diagnosis', 'Condition')
+) AS vocabulary (concept_id, concept_name, domain_id)
+UNION ALL
+SELECT
+    2000000100 + i,
+    'Synthetic condition ' || i,
+    'Condition',
+    'Synthetic',
+    'Synthetic',
+    'S',
+    CAST(2000000100 + i AS VARCHAR(50)),
+    DATE '1970-01-01',
+    DATE '2099-12-31',
+    NULL
+FROM generate_series(0, 9) AS i
+UNION ALL
+SELECT
+    2000000200 + i,
+    'Synthetic measurement ' || i,
+    'Measurement',
+    'Synthetic',
+    'Synthetic',
+    'S',
+    CAST(2000000200 + i AS VARCHAR(50)),
+    DATE '1970-01-01',
+    DATE '2099-12-31',
+    NULL
+FROM generate_series(0, 9) AS i;
+
+INSERT INTO @cdm_schema.concept_ancestor
+SELECT concept_id, concept_id, 0, 0 FROM @cdm_schema.concept;
+
+INSERT INTO @cdm_schema.cdm_source (
+    cdm_source_name, cdm_source_abbreviation, cdm_holder, source_release_date,
+    cdm_release_date, cdm_version, cdm_version_concept_id, vocabulary_version
+)
+VALUES (
+    'Synthetic sarcoma CDM', 'Synthetic', 'vantage6', DATE '2024-12-31',
+    DATE '2024-12-31', 'v5.4', 756265, 'Synthetic'
+);
+
+--- Patients, with the diagnosis date spread over ten years
+CREATE TABLE @cdm_schema.synthetic_patient AS
+SELECT
+    p AS person_id,
+    DATE '2010-01-01' + (p * 37) % 3650 AS diagnosis_date
+FROM generate_series(1, @n_patients) AS p;
+
+INSERT INTO @cdm_schema.person (
+    person_id, gender_concept_id, year_of_birth, month_of_birth, day_of_birth,
+    birth_datetime, race_concept_id, ethnicity_concept_id
+)
+SELECT
+    person_id,
+    CASE WHEN person_id % 2 = 0 THEN 8507 ELSE 8532 END,
+    1930 + person_id % 70,
+    1 + person_id % 12,
+    1 + person_id % 28,
+    MAKE_TIMESTAMP(1930 + person_id % 70, 1 + person_id % 12, 1 + person_id % 28, 0, 0, 0),
+    0,
+    0
+FROM @cdm_schema.synthetic_patient;
+
+INSERT INTO @cdm_schema.observation_period
+SELECT person_id, person_id, DATE '2000-01-01', DATE '2024-12-31', 32879
+FROM @cdm_schema.synthetic_patient;
+
+--- A third of the patients died, between 30 days and 11 years after the diagnosis
+INSERT INTO @cdm_schema.death (person_id, death_date, death_type_concept_id)
+SELECT person_id, diagnosis_date + 30 + (person_id * 53) % 4000, 32879
+FROM @cdm_schema.synthetic_patient
+WHERE person_id % 3 = 0;
+
+--- Episodes: the disease episode (and a later second one for 1 in 20 patients), the
+--- surgery, radiotherapy before or after the surgery and chemotherapy. The surgery is
+--- on the day of diagnosis for 7 in 10 patients.
+INSERT INTO @cdm_schema.episode (
+    episode_id, person_id, episode_concept_id, episode_start_date, episode_end_date,
+    episode_parent_id, episode_number, episode_object_concept_id, episode_type_concept_id
+)
+SELECT
+    person_id * 10,
+    person_id,
+    32533,
+    diagnosis_date,
+    diagnosis_date + 1000,
+    CAST(NULL AS BIGINT),
+    1,
+    CASE person_id % 6
+        WHEN 0 THEN 36529541
+        WHEN 1 THEN 36517959
+        WHEN 2 THEN 36564558
+        WHEN 3 THEN 36518164
+        WHEN 4 THEN 36517265
+        ELSE 36517688
+    END,
+    32879
+FROM @cdm_schema.synthetic_patient
+UNION ALL
+SELECT person_id * 10 + 1, person_id, 32533, diagnosis_date + 1500, NULL, NULL, 2, 36517688, 32879
+FROM @cdm_schema.synthetic_patient
+WHERE person_id % 20 = 0
+UNION ALL
+SELECT
+    person_id * 10 + 2,
+    person_id,
+    32939,
+    CASE WHEN person_id % 10 < 7 THEN diagnosis_date ELSE diagnosis_date + 45 END,
+    CASE WHEN person_id % 10 < 7 THEN diagnosis_date + 1 ELSE diagnosis_date + 46 END,
+    person_id * 10,
+    NULL,
+    4301351,
+    32879
+FROM @cdm_schema.synthetic_patient
+UNION ALL
+SELECT
+    person_id * 10 + 3,
+    person_id,
+    32940,
+    CASE WHEN person_id % 2 = 0 THEN diagnosis_date - 40 ELSE diagnosis_date + 60 END,
+    CASE WHEN person_id % 2 = 0 THEN diagnosis_date - 10 ELSE diagnosis_date + 90 END,
+    person_id * 10,
+    NULL,
+    0,
+    32879
+FROM @cdm_schema.synthetic_patient
+WHERE person_id % 5 < 2
+UNION ALL
+SELECT
+    person_id * 10 + 4,
+    person_id,
+    32941,
+    CASE WHEN person_id % 2 = 0 THEN diagnosis_date - 80 ELSE diagnosis_date + 90 END,
+    CASE WHEN person_id % 2 = 0 THEN diagnosis_date - 20 ELSE diagnosis_date + 150 END,
+    person_id * 10,
+    NULL,
+    0,
+    32879
+FROM @cdm_schema.synthetic_patient
+WHERE person_id % 10 < 3;
+
+--- Procedures of the surgery and chemotherapy episodes
+INSERT INTO @cdm_schema.procedure_occurrence (
+    procedure_occurrence_id, person_id, procedure_concept_id, procedure_date,
+    procedure_end_date, procedure_type_concept_id
+)
+SELECT episode_id, person_id, 4301351, episode_start_date, episode_end_date, 32879
+FROM @cdm_schema.episode
+WHERE episode_concept_id = 32939
+UNION ALL
+SELECT episode_id, person_id, 4273629, episode_start_date, episode_end_date, 32879
+FROM @cdm_schema.episode
+WHERE episode_concept_id = 32941;
+
+INSERT INTO @cdm_schema.episode_event
+SELECT episode_id, episode_id, 1147082 --- procedure_occurrence.procedure_occurrence_id
+FROM @cdm_schema.episode
+WHERE episode_concept_id IN (32939, 32941);
+
+--- Conditions: the diagnosis, focality at diagnosis, recurrences and unrelated
+--- conditions
+INSERT INTO @cdm_schema.condition_occurrence (
+    condition_occurrence_id, person_id, condition_concept_id, condition_start_date,
+    condition_type_concept_id
+)
+SELECT person_id * 1000, person_id, 2000000001, diagnosis_date, 32879
+FROM @cdm_schema.synthetic_patient
+UNION ALL
+SELECT
+    person_id * 1000 + 1,
+    person_id,
+    CASE WHEN person_id % 7 = 0 THEN 4163442 ELSE 4163998 END,
+    diagnosis_date,
+    32879
+FROM @cdm_schema.synthetic_patient
+WHERE person_id % 4 = 0
+UNION ALL
+SELECT person_id * 1000 + 2, person_id, 4097297, diagnosis_date + 400 + person_id % 500, 32879
+FROM @cdm_schema.synthetic_patient
+WHERE person_id % 5 = 0
+UNION ALL
+SELECT
+    person_id * 1000 + 100 + i,
+    person_id,
+    2000000100 + (person_id + i) % 10,
+    diagnosis_date - 365 + i * 30,
+    32879
+FROM @cdm_schema.synthetic_patient
+CROSS JOIN generate_series(1, @noise_records) AS i;
+
+--- Measurements: tumor size, grade and focality at diagnosis, resection margin and
+--- tumor rupture at the surgery, metastases and unrelated measurements
+INSERT INTO @cdm_schema.measurement (
+    measurement_id, person_id, measurement_concept_id, measurement_date,
+    measurement_type_concept_id, value_as_number, unit_concept_id
+)
+SELECT
+    person_id * 1000,
+    person_id,
+    CASE WHEN person_id % 2 = 0 THEN 36768664 ELSE 36768255 END,
+    diagnosis_date,
+    32879,
+    CASE WHEN person_id % 2 = 0 THEN 1 + person_id % 25 ELSE 10 + person_id % 250 END,
+    CASE WHEN person_id % 2 = 0 THEN 8582 ELSE 8588 END
+FROM @cdm_schema.synthetic_patient
+UNION ALL
+SELECT
+    person_id * 1000 + 1,
+    person_id,
+    CASE person_id % 3 WHEN 0 THEN 1634371 WHEN 1 THEN 1634752 ELSE 1633749 END,
+    diagnosis_date,
+    32879,
+    NULL,
+    NULL
+FROM @cdm_schema.synthetic_patient
+UNION ALL
+SELECT
+    person_id * 1000 + 2,
+    person_id,
+    CASE WHEN person_id % 9 = 0 THEN 36769332 ELSE 36769933 END,
+    diagnosis_date,
+    32879,
+    NULL,
+    NULL
+FROM @cdm_schema.synthetic_patient
+WHERE person_id % 3 = 0
+UNION ALL
+SELECT
+    person_id * 1000 + 3,
+    person_id,
+    CASE person_id % 4 WHEN 0 THEN 1633801 WHEN 1 THEN 1634484 ELSE 1634643 END,
+    episode_start_date,
+    32879,
+    NULL,
+    NULL
+FROM @cdm_schema.episode
+WHERE episode_concept_id = 32939
+UNION ALL
+SELECT person_id * 1000 + 4, person_id, 36768904, episode_start_date, 32879, NULL, NULL
+FROM @cdm_schema.episode
+WHERE episode_concept_id = 32939 AND person_id % 20 = 1
+UNION ALL
+SELECT
+    person_id * 1000 + 5,
+    person_id,
+    36769180,
+    diagnosis_date + 200 + person_id % 300,
+    32879,
+    NULL,
+    NULL
+FROM @cdm_schema.synthetic_patient
+WHERE person_id % 7 = 1
+UNION ALL
+SELECT
+    person_id * 1000 + 100 + i,
+    person_id,
+    2000000200 + (person_id + i) % 10,
+    diagnosis_date - 180 + i * 14,
+    32879,
+    (person_id * i) % 1000 / 10.0,
+    NULL
+FROM @cdm_schema.synthetic_patient
+CROSS JOIN generate_series(1, @noise_records) AS i;
+
+DROP TABLE @cdm_schema.synthetic_patient;
+
+--- Indexes as created by the OMOP CDM DDL
+CREATE INDEX idx_person_id ON @cdm_schema.person (person_id);
+CREATE INDEX idx_observation_period_person_id ON @cdm_schema.observation_period (person_id);
+CREATE INDEX idx_death_person_id ON @cdm_schema.death (person_id);
+CREATE INDEX idx_condition_person_id ON @cdm_schema.condition_occurrence (person_id);
+CREATE INDEX idx_condition_concept_id ON @cdm_schema.condition_occurrence (condition_concept_id);
+CREATE INDEX idx_procedure_person_id ON @cdm_schema.procedure_occurrence (person_id);
+CREATE INDEX idx_measurement_person_id ON @cdm_schema.measurement (person_id);
+CREATE INDEX idx_measurement_concept_id ON @cdm_schema.measurement (measurement_concept_id);
+CREATE INDEX idx_episode_person_id ON @cdm_schema.episode (person_id);
+CREATE INDEX idx_episode_event_episode_id ON @cdm_schema.episode_event (episode_id);
+CREATE INDEX idx_concept_concept_id ON @cdm_schema.concept (concept_id);
+CREATE INDEX idx_concept_ancestor_ancestor ON @cdm_schema.concept_ancestor (ancestor_concept_id);
+CREATE INDEX idx_concept_ancestor_descendant ON @cdm_schema.concept_ancestor (descendant_concept_id);
+
+ANALYZE @cdm_schema.person;
+ANALYZE @cdm_schema.observation_period;
+ANALYZE @cdm_schema.death;
+ANALYZE @cdm_schema.condition_occurrence;
+ANALYZE @cdm_schema.procedure_occurrence;
+ANALYZE @cdm_schema.measurement;
+ANALYZE @cdm_schema.episode;
+ANALYZE @cdm_schema.episode_event;
+ANALYZE @cdm_schema.concept;
+ANALYZE @cdm_schema.concept_ancestor;
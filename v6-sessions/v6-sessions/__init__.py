@@ -1,3 +1,24 @@
-from .central import *
-from .partial import *
-from .cohort import *
+import importlib
+
+from .cohort_files import *
+
+# Methods that need R and the OHDSI packages, and the module that contains them.
+# These modules take several seconds to load, so they are only imported when one of
+# their methods is requested (e.g. by `wrap_algorithm`).
+_METHODS = {
+    "central": "central",
+    "partial": "partial",
+    "create_cohort": "cohort",
+    "purge_stale_cohort_tables": "cohort",
+}
+
+
+def __getattr__(name: str):
+    if name not in _METHODS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(f".{_METHODS[name]}", __name__)
+    method = getattr(module, name)
+    # Importing the module sets it as attribute of this package, which must not
+    # shadow the method with the same name (e.g. `partial`)
+    globals()[name] = method
+    return method
@@ -0,0 +1,145 @@
+"""
+This file contains a content-addressed cache for generated SQL.
+
+Rendering and translating the feature SQL (SqlRender) and building the cohort SQL from
+a cohort definition (Circe) are round-trips into R and Java that take seconds per
+call. Their output only depends on their input, so the output is stored on the
+persistent volume of the node under a hash of the input. Subsequent tasks with the
+same input skip the R calls entirely. The input should therefore not contain values
+that differ per task, such as the name of the cohort table (see
+`sql_templates.with_sentinels`).
+
+The number of entries per kind is limited, when an entry is added to a full cache the
+least recently used entries are removed.
+"""
+import os
+import json
+import hashlib
+import traceback
+
+from pathlib import Path
+from typing import Any, Callable
+
+from vantage6.algorithm.tools.util import info, warn, get_env_var
+
+# Location of the cache. By default the cache is stored on the data volume of the
+# node so that it is shared between tasks. The node admin can override this value by
+# setting the environment variable below.
+ENVVAR_SQL_CACHE_DIR = "SQL_CACHE_DIR"
+DEFAULT_SQL_CACHE_DIR = "/mnt/data/.sql_cache"
+
+# Maximum number of entries per kind (namespace). The node admin can override this
+# value by setting the environment variable below.
+ENVVAR_SQL_CACHE_MAX_ENTRIES = "SQL_CACHE_MAX_ENTRIES"
+DEFAULT_SQL_CACHE_MAX_ENTRIES = 256
+
+# Increase this version when the format of the cached entries changes, so that old
+# entries are no longer used.
+CACHE_VERSION = 1
+
+
+def fingerprint(*parts: Any) -> str:
+    """
+    Compute a stable hash of (JSON serializable) values.
+
+    Parameters
+    ----------
+    parts : Any
+        The values to hash. Dictionaries are hashed independent of their key order.
+
+    Returns
+    -------
+    str
+        The SHA-256 hash in hexadecimal form.
+    """
+    content = json.dumps(
+        [CACHE_VERSION, *parts], sort_keys=True, default=str, separators=(",", ":")
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_or_create(namespace: str, key: str, create: Callable[[], Any]) -> str:
+    """
+    Obtain a cached text, or create and cache it when it is not in the cache.
+
+    Failures to read or write the cache are logged and otherwise ignored, the text is
+    then simply created.
+
+    Parameters
+    ----------
+    namespace : str
+        Kind of entry (e.g. "render" or "circe"), used as subdirectory.
+    key : str
+        Key of the entry, usually obtained from `fingerprint`.
+    create : Callable[[], Any]
+        Function that creates the text on a cache miss. R character vectors are
+        converted to a Python string.
+
+    Returns
+    -------
+    str
+        The (cached) text.
+    """
+    path = _cache_dir() / namespace / f"{key}.sql"
+
+    try:
+        text = path.read_text(encoding="utf-8")
+        info(f"Using cached {namespace} SQL {key[:12]}")
+        # Mark the entry as recently used, see `_evict`
+        os.utime(path)
+        return text
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        warn(f"Failed to read cached SQL {path}: {e}")
+
+    text = _as_text(create())
+
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, path)
+        _evict(path.parent)
+    except Exception as e:
+        warn(f"Failed to cache SQL at {path}: {e}")
+        traceback.print_exc()
+
+    return text
+
+
+def _cache_dir() -> Path:
+    return Path(get_env_var(ENVVAR_SQL_CACHE_DIR, DEFAULT_SQL_CACHE_DIR))
+
+
+def _evict(directory: Path) -> None:
+    """
+    Remove the least recently used entries of a namespace when it holds more than the
+    maximum number of entries.
+    """
+    max_entries = get_env_var(
+        ENVVAR_SQL_CACHE_MAX_ENTRIES, DEFAULT_SQL_CACHE_MAX_ENTRIES, as_type="int"
+    )
+    entries = []
+    for path in directory.glob("*.sql"):
+        try:
+            entries.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            # Removed by a concurrent task
+            continue
+    if len(entries) <= max_entries:
+        return
+    entries.sort()
+    for _, path in entries[: len(entries) - max_entries]:
+        path.unlink(missing_ok=True)
+    info(f"Removed {len(entries) - max_entries} cached SQL entries from {directory}")
+
+
+def _as_text(value: Any) -> str:
+    """
+    Convert the output of the R wrappers (a character vector of length one) to a
+    Python string.
+    """
+    if isinstance(value, str):
+        return value
+    return str(value[0])
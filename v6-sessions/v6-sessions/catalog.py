@@ -0,0 +1,375 @@
+"""
+This file contains the catalog of the cohorts that are stored on the node.
+
+The catalog is a JSON manifest on the data volume with an entry per cohort file. An
+entry holds the schema and row count of the file, a hash of its content, a hash of
+the cohort definition it was created from, a hash of the CDM snapshot it was extracted
+from (see `reuse`), the extracted feature groups (see `projection`) and the ID of the
+task that created it. The catalog is maintained
+by `create_cohort` and `del_cohorts` and is replaced atomically on every update, so
+readers never see a partially written catalog.
+
+The content hash only changes when the data changes, which makes it a stable version
+of the dataset that can be used to key caches on.
+"""
+import os
+import json
+import fcntl
+import hashlib
+import datetime
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from pathlib import Path
+from contextlib import contextmanager
+
+from vantage6.algorithm.tools.util import info, warn
+
+from . import companion_files
+
+DATA_DIR = "/mnt/data"
+CATALOG_FILE = "cohorts.catalog.json"
+
+# Increase this version when the format of the catalog changes, so that the catalog
+# is rebuilt from the cohort files.
+CATALOG_VERSION = 1
+
+# Size of the chunks in which cohort files are read to compute their content hash
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def list_cohorts() -> list[dict]:
+    """
+    Describe the cohort files that are stored on the node.
+
+    Cohort files that are registered in the catalog, and have not been modified
+    since, are described by their catalog entry. Other cohort files (e.g. created
+    before the catalog existed) are described from their Parquet footer, in which
+    case the hashes and task ID are not known.
+
+    Returns
+    -------
+    list[dict]
+        Description of each cohort file.
+    """
+    cohorts = read_catalog()["cohorts"]
+    entries = []
+    for file_ in sorted(Path(DATA_DIR).glob("cohort_*.parquet")):
+        entry = cohorts.get(file_.stem)
+        if entry is None or not _is_current(entry, file_):
+            entry = {
+                **describe_cohort(file_),
+                "content_hash": None,
+                "definition_hash": None,
+                "snapshot_hash": None,
+                "feature_groups": None,
+                "task_id": None,
+            }
+        entries.append(entry)
+    return entries
+
+
+def get_entry(cohort_name: str) -> dict | None:
+    """
+    Obtain the catalog entry of a cohort.
+
+    Parameters
+    ----------
+    cohort_name : str
+        Name of the cohort, e.g. `cohort_x` for `/mnt/data/cohort_x.parquet`.
+
+    Returns
+    -------
+    dict | None
+        The catalog entry, or None when the cohort is not in the catalog or its file
+        has been modified since it was registered.
+    """
+    entry = read_catalog()["cohorts"].get(cohort_name)
+    path = Path(DATA_DIR) / f"{cohort_name}.parquet"
+    if entry is None or not path.exists() or not _is_current(entry, path):
+        return None
+    return entry
+
+
+def find_cohort(
+    definition_hash: str,
+    snapshot_hash: str,
+    cohort_name: str | None = None,
+    feature_groups: list[str] | None = None,
+) -> dict | None:
+    """
+    Find a cohort that is extracted from a cohort definition on a CDM snapshot.
+
+    Parameters
+    ----------
+    definition_hash : str
+        Hash of the cohort definition, see `definition_hash`.
+    snapshot_hash : str
+        Hash of the CDM snapshot, see `reuse.snapshot_hash`.
+    cohort_name : str | None
+        Name of the cohort that is preferred when multiple cohorts match, e.g.
+        `cohort_x` for `/mnt/data/cohort_x.parquet`.
+    feature_groups : list[str] | None
+        The feature groups of the cohort, see `projection.normalize_groups`. None
+        for all features.
+
+    Returns
+    -------
+    dict | None
+        The catalog entry of the cohort, or None when there is no such cohort of
+        which the file is unmodified since it was registered.
+    """
+    matches = [
+        entry
+        for entry in read_catalog()["cohorts"].values()
+        if entry.get("definition_hash") == definition_hash
+        and entry.get("snapshot_hash") == snapshot_hash
+        and entry.get("feature_groups") == feature_groups
+    ]
+    matches.sort(key=lambda entry: entry["name"] != cohort_name)
+    for entry in matches:
+        path = Path(DATA_DIR) / f"{entry['name']}.parquet"
+        if path.exists() and _is_current(entry, path):
+            return entry
+    return None
+
+
+def register_cohort(
+    path: str | Path,
+    cohort_definition: dict | str,
+    task_id: int,
+    snapshot_hash: str | None = None,
+    feature_groups: list[str] | None = None,
+) -> dict:
+    """
+    Add (or replace) the entry of a cohort file in the catalog.
+
+    Parameters
+    ----------
+    path : str | Path
+        Location of the Parquet file of the cohort.
+    cohort_definition : dict | str
+        The cohort definition the cohort was created from.
+    task_id : int
+        ID of the task that created the cohort.
+    snapshot_hash : str | None
+        Hash of the CDM snapshot the cohort was extracted from, see `reuse`. None
+        when not known, in which case the cohort is not reused.
+    feature_groups : list[str] | None
+        The feature groups that are extracted, see `projection`. None when all
+        features are extracted.
+
+    Returns
+    -------
+    dict
+        The catalog entry of the cohort.
+    """
+    path = Path(path)
+    entry = {
+        **describe_cohort(path),
+        "content_hash": content_hash(path),
+        "definition_hash": definition_hash(cohort_definition),
+        "snapshot_hash": snapshot_hash,
+        "feature_groups": feature_groups,
+        "task_id": task_id,
+    }
+
+    def add_entry(cohorts: dict) -> None:
+        cohorts[entry["name"]] = entry
+
+    _update_catalog(add_entry)
+    info(f"Registered {entry['name']} in the cohort catalog")
+    return entry
+
+
+def unregister_cohorts(cohort_names: list[str]) -> None:
+    """
+    Remove the entries of cohorts from the catalog.
+
+    Parameters
+    ----------
+    cohort_names : list[str]
+        Names of the cohorts, e.g. `cohort_x` for `/mnt/data/cohort_x.parquet`.
+    """
+
+    def remove_entries(cohorts: dict) -> None:
+        for cohort_name in cohort_names:
+            cohorts.pop(cohort_name, None)
+
+    _update_catalog(remove_entries)
+
+
+def read_catalog() -> dict:
+    """
+    Read the catalog from the data volume.
+
+    Returns
+    -------
+    dict
+        The catalog. An empty catalog is returned when there is no (readable)
+        catalog of the current version.
+    """
+    try:
+        catalog = json.loads(_catalog_path().read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        catalog = None
+    except Exception as e:
+        warn(f"Failed to read the cohort catalog: {e}")
+        catalog = None
+
+    if catalog is None or catalog.get("version") != CATALOG_VERSION:
+        return {"version": CATALOG_VERSION, "cohorts": {}}
+    return catalog
+
+
+def describe_cohort(path: str | Path) -> dict:
+    """
+    Describe a cohort file from its Parquet footer and sidecar, without reading the
+    data itself.
+
+    Parameters
+    ----------
+    path : str | Path
+        Location of the Parquet file.
+
+    Returns
+    -------
+    dict
+        The name, modification time, number of observations and the schema of the
+        cohort file.
+    """
+    path = Path(path)
+    stat = path.stat()
+    parquet_file = pq.ParquetFile(path)
+    dtypes = parquet_file.schema_arrow.empty_table().to_pandas().dtypes
+    levels = _get_category_levels(path, dtypes)
+
+    def get_column_metadata(name, type_):
+        metadata = {
+            "name": name,
+            "dtype": str(type_),
+        }
+        if isinstance(type_, pd.CategoricalDtype):
+            metadata["levels"] = levels.get(name, [])
+        return metadata
+
+    return {
+        "name": path.name.split(".")[0],
+        "created_at": datetime.datetime.fromtimestamp(stat.st_mtime).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        ),
+        "observations": parquet_file.metadata.num_rows,
+        "variables": list(dtypes.index),
+        "types": [
+            get_column_metadata(name, type_) for name, type_ in dtypes.to_dict().items()
+        ],
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def content_hash(path: str | Path) -> str:
+    """
+    Compute the SHA-256 hash of the content of a file.
+
+    Parameters
+    ----------
+    path : str | Path
+        Location of the file.
+
+    Returns
+    -------
+    str
+        The hash in hexadecimal form.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def definition_hash(cohort_definition: dict | str) -> str:
+    """
+    Compute the SHA-256 hash of a cohort definition, independent of its formatting
+    and key order.
+
+    Parameters
+    ----------
+    cohort_definition : dict | str
+        The cohort definition, as dictionary or JSON string.
+
+    Returns
+    -------
+    str
+        The hash in hexadecimal form.
+    """
+    if isinstance(cohort_definition, str):
+        try:
+            cohort_definition = json.loads(cohort_definition)
+        except json.JSONDecodeError:
+            pass
+    content = json.dumps(
+        cohort_definition, sort_keys=True, default=str, separators=(",", ":")
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _get_category_levels(file_: Path, dtypes: pd.Series) -> dict[str, list]:
+    """
+    Obtain the levels of the categorical columns of a cohort file.
+
+    The levels are read from the sidecar file that is written during the
+    extraction. For files without a sidecar, only the categorical columns are read.
+    """
+    sidecar = companion_files.read_sidecar(file_)
+    if sidecar is not None and "levels" in sidecar:
+        return sidecar["levels"]
+
+    columns = [
+        name for name, type_ in dtypes.items() if isinstance(type_, pd.CategoricalDtype)
+    ]
+    if not columns:
+        return {}
+    df = pd.read_parquet(file_, columns=columns)
+    return {name: df[name].unique().tolist() for name in columns}
+
+
+def _is_current(entry: dict, path: Path) -> bool:
+    """
+    Check whether a catalog entry still describes the file at `path`.
+    """
+    stat = path.stat()
+    current = (stat.st_size, stat.st_mtime_ns)
+    return (entry.get("size"), entry.get("mtime_ns")) == current
+
+
+def _update_catalog(update) -> None:
+    """
+    Apply `update` to the cohorts in the catalog and replace the catalog file.
+
+    The update is done under an exclusive lock, so that concurrent tasks on the node
+    do not overwrite each other's changes.
+    """
+    path = _catalog_path()
+    with _locked(path.with_name(f".{path.name}.lock")):
+        catalog = read_catalog()
+        update(catalog["cohorts"])
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(catalog, indent=2, default=str), "utf-8")
+        os.replace(tmp_path, path)
+
+
+@contextmanager
+def _locked(lock_path: Path):
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _catalog_path() -> Path:
+    return Path(DATA_DIR) / CATALOG_FILE
@@ -0,0 +1,136 @@
+"""
+This file contains the cleanup of the cohort tables in the results schema.
+
+Every `create_cohort` task generates its cohorts in a table named
+`cohort_{task_id}_{node_id}`, next to the inclusion and statistics tables of
+CohortGenerator (`cohort_{task_id}_{node_id}_inclusion`, ...). These tables are no
+longer needed once the cohort features are stored on the node.
+
+The tables are dropped in a separate process with its own database connection, so
+that the task does not wait for the drops before it returns its result.
+"""
+import re
+import multiprocessing
+
+from rpy2.robjects import RS4
+
+from vantage6.algorithm.tools.util import info, warn
+from vantage6.algorithm.tools.decorators import _create_omop_database_connection
+
+from ohdsi import database_connector
+
+from . import conversion
+
+# Cohort tables (and the CohortGenerator tables derived from them) of a task
+COHORT_TABLE_PATTERN = re.compile(r"^cohort_(?P<task_id>\d+)_(?P<node_id>\d+)(_\w+)?$")
+
+
+def drop_tables(connection: RS4, schema: str, tables: list[str]) -> list[str]:
+    """
+    Drop tables from a schema. Failures are logged and do not stop the other tables
+    from being dropped.
+
+    Parameters
+    ----------
+    connection : RS4
+        Connection to the database.
+    schema : str
+        The schema that contains the tables.
+    tables : list[str]
+        Names of the tables.
+
+    Returns
+    -------
+    list[str]
+        The names of the tables that are dropped.
+    """
+    dropped = []
+    for table in tables:
+        try:
+            database_connector.execute_sql(
+                connection, f"DROP TABLE IF EXISTS {schema}.{table}"
+            )
+        except Exception as e:
+            warn(f"Failed to drop {schema}.{table}: {e}")
+            continue
+        dropped.append(table)
+    info(f"Dropped {len(dropped)} table(s) from {schema}")
+    return dropped
+
+
+def drop_tables_in_background(
+    label: str, schema: str, tables: list[str]
+) -> multiprocessing.Process:
+    """
+    Drop tables from a schema in a separate process.
+
+    The process is not joined, so the caller can return immediately. The Python
+    interpreter waits for the process before it exits, so the drops are completed
+    before the algorithm container stops.
+
+    Parameters
+    ----------
+    label : str
+        The label of the OMOP database at the node.
+    schema : str
+        The schema that contains the tables.
+    tables : list[str]
+        Names of the tables.
+
+    Returns
+    -------
+    multiprocessing.Process
+        The process that drops the tables.
+    """
+    process = multiprocessing.get_context("spawn").Process(
+        target=_drop_tables_in_worker,
+        args=(label, schema, tables),
+        name="cohort-table-cleanup",
+    )
+    process.start()
+    info(f"Dropping {len(tables)} table(s) from {schema} in the background")
+    return process
+
+
+def find_cohort_tables(
+    connection: RS4, schema: str, node_id: int
+) -> dict[int, list[str]]:
+    """
+    Find the cohort tables of a node in a schema.
+
+    Parameters
+    ----------
+    connection : RS4
+        Connection to the database.
+    schema : str
+        The schema to search.
+    node_id : int
+        ID of the node, which is part of the table names.
+
+    Returns
+    -------
+    dict[int, list[str]]
+        The names of the tables per task ID.
+    """
+    data_r = database_connector.query_sql(
+        connection,
+        "SELECT table_name FROM information_schema.tables "
+        f"WHERE table_schema = '{schema}' AND table_name LIKE 'cohort%'",
+    )
+    tables = {}
+    for table in conversion.convert_from_r(data_r).iloc[:, 0]:
+        match = COHORT_TABLE_PATTERN.match(table)
+        if match and int(match.group("node_id")) == node_id:
+            tables.setdefault(int(match.group("task_id")), []).append(table)
+    return tables
+
+
+def _drop_tables_in_worker(label: str, schema: str, tables: list[str]) -> None:
+    """
+    Drop tables using a new database connection, see `drop_tables_in_background`.
+    """
+    try:
+        connection = _create_omop_database_connection(label)
+        drop_tables(connection, schema, tables)
+    except Exception as e:
+        warn(f"Failed to clean up the tables in {schema}: {e}")
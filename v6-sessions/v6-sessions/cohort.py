@@ -1,21 +1,25 @@
+import atexit
 import traceback
 import pkg_resources
-import datetime
+import multiprocessing
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from rpy2.robjects import RS4
-from rpy2.rinterface_lib.sexp import NACharacterType
 
-from vantage6.algorithm.tools.util import info, error
+from vantage6.algorithm.tools.util import info, error, warn, get_env_var
 from vantage6.algorithm.tools.decorators import (
     database_connection,
     OHDSIMetaData,
     metadata,
     RunMetaData,
+    _create_omop_database_connection,
+    _get_user_database_labels,
 )
 
 from ohdsi import cohort_generator
@@ -24,59 +28,218 @@ from ohdsi import common as ohdsi_common
 from ohdsi import sqlrender
 from ohdsi import database_connector
 
+from . import cache
+from . import catalog
+from . import cleanup
+from . import conversion
+from . import extraction
+from . import feature_types
+from . import incremental
+from . import instrumentation
+from . import projection
+from . import reuse
+from . import sql_templates
+from . import staging
 
-def del_cohorts(cohort_names: list[str]):
-    for cohort_name in cohort_names:
-        Path(f"/mnt/data/{cohort_name}.parquet").unlink()
-    return {"msg": f"Cohort(s) {', '.join(cohort_names)} deleted"}
+# Engines that can be used to retrieve the cohort features from the database
+EXTRACTION_ENGINES = ("auto", "memory", "stream", "andromeda", "arrow")
+
+# Maximum number of cohorts that are extracted concurrently. The node admin can
+# override this value by setting the environment variable below.
+ENVVAR_MAX_WORKERS = "EXTRACTION_MAX_WORKERS"
+DEFAULT_MAX_WORKERS = 4
+
+# Temporary table with the IDs of the changed patients of a refresh, and the number of
+# IDs that is inserted per statement
+CHANGED_PATIENTS_TABLE = "v6_changed_patients"
+CHANGED_PATIENTS_CHUNK_SIZE = 1000
 
 
 @metadata
-def get_cohorts(meta_run: RunMetaData):
-    files = Path("/mnt/data").glob("cohort_*.parquet")
-    # get the filenames, dates and number of records
-
-    metadata = []
-    for file_ in files:
-        df = pd.read_parquet(file_)
-
-        def get_column_metadata(df, name, type_):
-            metadata = {
-                "name": name,
-                "dtype": str(type_),
-            }
-            if pd.api.types.is_categorical_dtype(df[name]):
-                metadata["levels"] = df[name].unique().tolist()
-            return metadata
-
-        metadata.append(
-            {
-                "name": file_.name.split(".")[0],
-                "created_at": datetime.datetime.fromtimestamp(
-                    file_.stat().st_mtime
-                ).strftime("%Y-%m-%d %H:%M:%S"),
-                "observations": df.shape[0],
-                "variables": list(df.columns),
-                "types": [
-                    get_column_metadata(df, name, type_)
-                    for name, type_ in df.dtypes.to_dict().items()
-                ],
-                "organization": meta_run.organization_id,
-            }
-        )
+@database_connection(types=["OMOP"], include_metadata=True)
+def purge_stale_cohort_tables(
+    connection: RS4,
+    meta_omop: OHDSIMetaData,
+    meta_run: RunMetaData,
+    keep_latest: int = 5,
+):
+    """
+    Drop the cohort tables of earlier `create_cohort` tasks of this node from the
+    results schema, e.g. tables that are left behind by failed tasks or by tasks
+    that were run with `keep_cohort_tables`.
 
-    return metadata
+    The tables are dropped in the background, the result lists the tables that are
+    being dropped. A `partial` task that refers to the `create_cohort` task of a
+    dropped table (by its `cohort_task_id`) fails afterwards, so choose
+    `keep_latest` such that the tasks that are still used are kept.
+
+    Parameters
+    ----------
+    keep_latest : int
+        The tables of this number of most recent tasks are kept, as these tasks may
+        still be using them, or `partial` tasks may still read them.
+    """
+    tables = cleanup.find_cohort_tables(
+        connection, meta_omop.results_schema, meta_run.node_id
+    )
+    stale_task_ids = sorted(tables, reverse=True)[keep_latest:]
+    stale_tables = [table for task_id in stale_task_ids for table in tables[task_id]]
+    if not stale_tables:
+        return {"msg": "No stale cohort tables found", "tables": []}
+
+    cleanup.drop_tables_in_background(
+        _get_user_database_labels()[0], meta_omop.results_schema, stale_tables
+    )
+    return {
+        "msg": f"Dropping {len(stale_tables)} stale cohort table(s)",
+        "tables": stale_tables,
+    }
 
 
 @metadata
 @database_connection(types=["OMOP"], include_metadata=True)
+@instrumentation.instrumented
 def create_cohort(
     connection: RS4,
     meta_omop: OHDSIMetaData,
     meta_run: RunMetaData,
     cohort_definitions: list[dict],
     cohort_names: list[str],
+    engine: str = "auto",
+    batch_size: int = extraction.DEFAULT_BATCH_SIZE,
+    max_workers: int = 1,
+    single_pass: bool = False,
+    refresh: bool = False,
+    staged: bool = False,
+    index_cohort_table: bool = False,
+    keep_cohort_tables: bool = True,
+    timing_log: bool = False,
+    reuse_extractions: bool = False,
+    generate_stats: bool = False,
+    feature_groups: list[str] | None = None,
 ):
+    """
+    Create the cohorts in the database and store the features of each cohort in a
+    Parquet file on the node.
+
+    Parameters
+    ----------
+    cohort_definitions : list[dict]
+        The cohort definitions in JSON format, for example created from ATLAS.
+    cohort_names : list[str]
+        The names of the cohorts, used for the Parquet file names.
+    engine : str
+        How the features are retrieved from the database. "memory" loads the
+        complete result set at once, "stream" fetches the result in batches of
+        `batch_size` rows and appends each batch to the Parquet file and "andromeda"
+        first spills the result to disk and then converts it in batches. "arrow"
+        fetches the result in batches of Arrow records over a native PostgreSQL
+        connection instead of the R session, and falls back to "stream" for other
+        databases, see `native`. "auto" (default) uses "andromeda" for cohorts with
+        more records than the threshold set by the node and "memory" otherwise.
+    batch_size : int
+        Number of rows per batch when the "stream", "andromeda" or "arrow" engine is
+        used.
+    max_workers : int
+        Number of cohorts that are extracted concurrently, each with its own
+        database connection. The node can limit this number by setting the
+        environment variable `EXTRACTION_MAX_WORKERS`.
+    single_pass : bool
+        When True, the features of all cohorts are retrieved with a single query
+        and split into the Parquet files per cohort afterwards. This avoids scanning
+        the CDM tables once per cohort. `max_workers` is ignored in this case.
+    refresh : bool
+        When True, a cohort that was extracted before from the same cohort
+        definition is refreshed instead of extracted in full. Only the features of
+        patients that are new or whose source data changed are retrieved, and merged
+        into the existing Parquet file. Cohorts are refreshed one at a time,
+        `single_pass` and `max_workers` are ignored in this case.
+    staged : bool
+        When True, the CTEs of the feature query are materialized one by one as
+        indexed temporary tables before the final select is executed, and the
+        materialization of every CTE is reported in the result. Cohorts are
+        extracted one at a time, `max_workers` is ignored in this case. Not used
+        together with `refresh` or `single_pass`.
+    index_cohort_table : bool
+        When True, the generated cohort table is indexed on the cohort definition ID
+        and subject ID and analyzed before the features are extracted, so that the
+        feature query can use the index and planner statistics. The duration of
+        this step is reported in the result, next to the duration of the
+        extraction that is always reported, so that runs with and without the index
+        can be compared.
+    keep_cohort_tables : bool
+        When True (the default), the cohort tables of this task are kept in the
+        results schema. `partial.partial` reads the cohort table of the task with
+        `cohort_task_id`, so only set this to False when no `partial` task follows.
+        The tables are then dropped in the background once the Parquet files are
+        written.
+    timing_log : bool
+        When True, the recorded stages of each cohort are also written to a JSON
+        file next to its Parquet file, e.g. `/mnt/data/cohort_x.timings.json`.
+    reuse_extractions : bool
+        When True, a cohort definition that was extracted before on the same
+        snapshot of the CDM is not generated and extracted again, its Parquet file
+        is hard-linked (or copied) to the new name instead. The same holds for
+        cohorts of this task that have the same definition. The snapshot counts the
+        records of the large CDM tables, which can take longer than the extraction
+        of a small cohort, and it does not detect records that are updated in place,
+        see `reuse`. By default (False), all cohorts are extracted in full.
+    generate_stats : bool
+        When True, the inclusion rule statistics of the cohorts are computed during
+        the generation and stored in the inclusion tables of the cohort table. These
+        statistics are not used by the extraction and slow down the generation, so
+        by default they are not computed. The duration of the generation is
+        reported in the result with `generate_stats` as label, so that runs with and
+        without statistics can be compared.
+    feature_groups : list[str] | None
+        The groups of features to extract, e.g. `["survival", "treatment"]`, see
+        `projection.FEATURE_GROUPS`. The feature blocks of the other groups are not
+        computed by the database and their columns are not stored. The patient ID is
+        always included. By default all features are extracted.
+
+    The result lists the cohorts that are reused (`reused`). It also reports the wall
+    time, peak memory and rows in and out of every stage of the pipeline (`stages`),
+    and the wall time of the main steps (`timings`), see `instrumentation`.
+    """
+    if engine not in EXTRACTION_ENGINES:
+        error(f"Unknown extraction engine: {engine}")
+        return {"error": f"Unknown extraction engine '{engine}'"}
+    try:
+        feature_groups = projection.normalize_groups(feature_groups)
+    except ValueError as e:
+        error(str(e))
+        return {"error": str(e)}
+
+    # Cohorts that are extracted before from the same definition on the same snapshot
+    # of the CDM, or that have the same definition as another cohort of this task, are
+    # linked to that extraction rather than generated and extracted again
+    requested = dict(zip(cohort_names, cohort_definitions))
+    snapshot_hash = None
+    reused, duplicates = {}, {}
+    if reuse_extractions:
+        with instrumentation.stage("cdm_snapshot"):
+            snapshot_hash = __query_snapshot_hash(
+                connection, meta_omop, f"cohort_{meta_run.task_id}_{meta_run.node_id}"
+            )
+        reused, duplicates = __find_reusable_cohorts(
+            requested, snapshot_hash, feature_groups
+        )
+        cohort_names = [
+            name for name in requested if name not in reused and name not in duplicates
+        ]
+        cohort_definitions = [requested[name] for name in cohort_names]
+    if not cohort_names:
+        info("All cohorts are reused, nothing to extract")
+        return __complete_cohorts(
+            requested,
+            reused,
+            duplicates,
+            {},
+            snapshot_hash,
+            feature_groups,
+            meta_run,
+            timing_log,
+        )
 
     # The first step is to create the cohorts in result schema of the database. This
     # schema should have write permissions for the user that is used to connect to the
@@ -104,153 +267,1244 @@ def create_cohort(
     )
 
     # Then we create a table with all cohort definitions and their corresponding SQL
+    with instrumentation.stage("cohort_sql", rows_in=n):
+        cohort_queries = [
+            _create_cohort_query(cohort, generate_stats)
+            for cohort in cohort_definitions
+        ]
     cohort_definition_set = pd.DataFrame(
         {
             "cohortId": cohort_ids,
             "cohortName": cohort_names,
             "json": cohort_definitions,
-            "sql": [_create_cohort_query(cohort) for cohort in cohort_definitions],
+            "sql": cohort_queries,
             "logicDescription": [None] * n,
-            "generateStats": [True] * n,
+            "generateStats": [generate_stats] * n,
         }
     )
     cohort_definition_set = ohdsi_common.convert_to_r(cohort_definition_set)
     info(f"Generated {n} cohort definitions including SQL")
 
-    info("Executing cohort generation")
-    cohort_generator.generate_cohort_set(
-        connection=connection,
-        cdm_database_schema=meta_omop.cdm_schema,
-        cohort_database_schema=meta_omop.results_schema,
-        cohort_table_names=cohort_table_names,
-        cohort_definition_set=cohort_definition_set,
-    )
+    info(f"Executing cohort generation (inclusion statistics: {generate_stats})")
+    with instrumentation.stage(
+        "cohort_generation", rows_in=n, generate_stats=generate_stats
+    ):
+        cohort_generator.generate_cohort_set(
+            connection=connection,
+            cdm_database_schema=meta_omop.cdm_schema,
+            cohort_database_schema=meta_omop.results_schema,
+            cohort_table_names=cohort_table_names,
+            cohort_definition_set=cohort_definition_set,
+        )
     info("Generated cohort set")
 
+    if index_cohort_table:
+        with instrumentation.stage("cohort_table_index"):
+            try:
+                __index_cohort_table(connection, meta_omop, cohort_table)
+            except Exception as e:
+                # The extraction works without the index, only slower
+                warn(f"Failed to index the cohort table {cohort_table}: {e}")
+                traceback.print_exc()
+
     info("Providing the cohort dataset to vantage6")
-    for cohort_id, cohort_name in zip(cohort_ids, cohort_names):
-        info(f"Retrieving variables for cohort: {cohort_id} {cohort_name}")
-        try:
-            df = __create_cohort_dataframe(
-                connection, meta_omop, cohort_table, cohort_id
+    max_workers = min(
+        max_workers,
+        get_env_var(ENVVAR_MAX_WORKERS, DEFAULT_MAX_WORKERS, as_type="int"),
+        n,
+    )
+    with instrumentation.stage("extraction"):
+        if refresh:
+            statuses = {}
+            for cohort_id, cohort_name, cohort_definition in zip(
+                cohort_ids, cohort_names, cohort_definitions
+            ):
+                with instrumentation.stage("refresh", cohort=cohort_name):
+                    statuses[cohort_name] = _refresh_cohort(
+                        connection,
+                        meta_omop,
+                        cohort_table,
+                        cohort_id,
+                        cohort_name,
+                        cohort_definition,
+                        engine,
+                        batch_size,
+                        feature_groups,
+                    )
+                if statuses[cohort_name] == extraction.ExtractionStatus.SAVE_FAILED:
+                    break
+        elif single_pass and n > 1:
+            statuses = __extract_cohorts_single_pass(
+                connection,
+                meta_omop,
+                cohort_table,
+                cohort_ids,
+                cohort_names,
+                engine,
+                batch_size,
+                feature_groups,
+            )
+        elif max_workers > 1 and not staged:
+            statuses = _extract_cohorts_parallel(
+                meta_omop,
+                cohort_table,
+                cohort_ids,
+                cohort_names,
+                engine,
+                batch_size,
+                max_workers,
+                feature_groups,
             )
+        else:
+            statuses = {}
+            for cohort_id, cohort_name in zip(cohort_ids, cohort_names):
+                with instrumentation.stage("extract", cohort=cohort_name):
+                    statuses[cohort_name] = _extract_cohort(
+                        connection,
+                        meta_omop,
+                        cohort_table,
+                        cohort_id,
+                        cohort_name,
+                        engine,
+                        batch_size,
+                        staged=staged,
+                        feature_groups=feature_groups,
+                    )
+                if statuses[cohort_name] == extraction.ExtractionStatus.SAVE_FAILED:
+                    break
 
+    result = __complete_cohorts(
+        requested,
+        reused,
+        duplicates,
+        statuses,
+        snapshot_hash,
+        feature_groups,
+        meta_run,
+        timing_log,
+    )
+    if "error" in result:
+        return result
+
+    # Unless a `partial` task still needs them, the cohort tables are no longer
+    # needed now the features are stored on the node
+    if not keep_cohort_tables:
+        try:
+            cleanup.drop_tables_in_background(
+                _get_user_database_labels()[0],
+                meta_omop.results_schema,
+                [str(table[0]) for table in cohort_table_names],
+            )
         except Exception as e:
-            error(f"Failed to create cohort dataframe: {cohort_name}, continuing")
+            warn(f"Failed to start the cleanup of the cohort tables: {e}")
             traceback.print_exc()
-            # TODO we need to create a special container error for this
+
+    info("Done!")
+    return result
+
+
+def __query_snapshot_hash(
+    connection: RS4, meta_omop: OHDSIMetaData, cohort_table: str
+) -> str | None:
+    """
+    Query the snapshot of the CDM (see `sql/cdm_snapshot.sql`) and compute the hash
+    under which the extractions of this task can be reused. None is returned when the
+    snapshot can not be obtained, in which case no extraction is reused.
+    """
+    try:
+        template_path = pkg_resources.resource_filename(
+            "v6-sessions", reuse.SNAPSHOT_SQL
+        )
+        with open(template_path, "r") as f:
+            raw_sql = f.read()
+        sql = _render_features_sql(
+            raw_sql, cohort_table, -1, meta_omop, template_path=template_path
+        )
+        with instrumentation.stage("query") as stage:
+            data_r = database_connector.query_sql(connection, sql)
+            stage.rows_out = data_r.nrow
+        snapshot = conversion.convert_from_r(data_r)
+        return reuse.snapshot_hash(
+            snapshot, __read_features_sql(), meta_omop.database, meta_omop.cdm_schema
+        )
+    except Exception as e:
+        warn(f"Failed to obtain the snapshot of the CDM, not reusing cohorts: {e}")
+        traceback.print_exc()
+        return None
+
+
+def __find_reusable_cohorts(
+    requested: dict[str, dict],
+    snapshot_hash: str | None,
+    feature_groups: list[str] | None,
+) -> tuple[dict[str, Path], dict[str, str]]:
+    """
+    Find the requested cohorts that do not need to be extracted.
+
+    Returns the cohorts that are extracted before on the same CDM snapshot with the
+    same feature groups, with the
+    location of that extraction, and the cohorts that have the same definition as
+    an earlier cohort of this task, with the name of that cohort.
+    """
+    reused, duplicates, first_names = {}, {}, {}
+    for cohort_name, cohort_definition in requested.items():
+        definition_hash = catalog.definition_hash(cohort_definition)
+        if definition_hash in first_names:
+            duplicates[cohort_name] = first_names[definition_hash]
+            info(f"Cohort {cohort_name} is the same as {duplicates[cohort_name]}")
+            continue
+        first_names[definition_hash] = cohort_name
+        if snapshot_hash is None:
             continue
 
         try:
-            df.to_parquet(f"/mnt/data/cohort_{cohort_name}.parquet")
-        except Exception as e:
-            error(
-                f"Failed to save cohort data to /mnt/data/cohort_{cohort_name}.parquet"
+            entry = catalog.find_cohort(
+                definition_hash,
+                snapshot_hash,
+                f"cohort_{cohort_name}",
+                feature_groups,
             )
-            traceback.print_exc()
+        except Exception as e:
+            warn(f"Failed to search the catalog for {cohort_name}: {e}")
+            continue
+        if entry is not None:
+            reused[cohort_name] = Path(catalog.DATA_DIR) / f"{entry['name']}.parquet"
+            info(f"Cohort {cohort_name} is extracted before as {entry['name']}")
+    return reused, duplicates
+
+
+def __complete_cohorts(
+    requested: dict[str, dict],
+    reused: dict[str, Path],
+    duplicates: dict[str, str],
+    statuses: dict[str, extraction.ExtractionStatus],
+    snapshot_hash: str | None,
+    feature_groups: list[str] | None,
+    meta_run: RunMetaData,
+    timing_log: bool,
+) -> dict:
+    """
+    Link the reused cohorts to their earlier extraction, and register all saved
+    cohorts in the catalog.
+
+    Returns the result of `create_cohort`, or an error when a cohort could not be
+    saved.
+    """
+    statuses = dict(statuses)
+    for cohort_name, source in reused.items():
+        with instrumentation.stage("reuse", cohort=cohort_name):
+            statuses[cohort_name] = __link_cohort(source, cohort_name)
+    for cohort_name, source_name in duplicates.items():
+        status = statuses.get(source_name, extraction.ExtractionStatus.FAILED)
+        if status == extraction.ExtractionStatus.SAVED:
+            with instrumentation.stage("reuse", cohort=cohort_name):
+                source = f"/mnt/data/cohort_{source_name}.parquet"
+                status = __link_cohort(source, cohort_name)
+        statuses[cohort_name] = status
+
+    for cohort_name, status in statuses.items():
+        if status == extraction.ExtractionStatus.SAVE_FAILED:
             return {
                 "error": f"Failed to save cohort data to /mnt/data/cohort_{cohort_name}.parquet"
             }
 
-        # TODO change this to a parquet file
-        info(f"Saved cohort data to /mnt/data/cohort_{cohort_name}.parquet")
+    __register_cohorts(
+        list(requested.values()),
+        list(requested),
+        statuses,
+        meta_run.task_id,
+        snapshot_hash,
+        feature_groups,
+    )
+    if timing_log:
+        __write_timing_logs(list(requested), statuses)
+    return {
+        "msg": "Cohort created and available for use on this node",
+        "reused": sorted([*reused, *duplicates]),
+    }
 
-    # TODO clean up the results schema as we do not need it anymore
-    info("Done!")
-    return {"msg": "Cohort created and available for use on this node"}
+
+def __link_cohort(source: str | Path, cohort_name: str) -> extraction.ExtractionStatus:
+    """
+    Make an earlier extraction available as the Parquet file of a cohort.
+    """
+    path = f"/mnt/data/cohort_{cohort_name}.parquet"
+    try:
+        reuse.link_cohort(source, path)
+    except Exception as e:
+        error(f"Failed to reuse {source} as {path}: {e}")
+        traceback.print_exc()
+        return extraction.ExtractionStatus.SAVE_FAILED
+    return extraction.ExtractionStatus.SAVED
 
 
-def _create_cohort_query(cohort_definition: dict) -> str:
+def __index_cohort_table(
+    connection: RS4, meta_omop: OHDSIMetaData, cohort_table: str
+) -> None:
     """
-    Creates a cohort query from a cohort definition in JSON format.
+    Index the cohort table on the columns that the feature query filters and joins
+    on, and update the planner statistics of the table.
+    """
+    table = f"{meta_omop.results_schema}.{cohort_table}"
+    info(f"Indexing and analyzing {table}")
+    database_connector.execute_sql(
+        connection, f"CREATE INDEX ON {table} (cohort_definition_id, subject_id)"
+    )
+    database_connector.execute_sql(connection, f"CREATE INDEX ON {table} (subject_id)")
+    database_connector.execute_sql(connection, f"ANALYZE {table}")
+
+
+def __register_cohorts(
+    cohort_definitions: list[dict],
+    cohort_names: list[str],
+    statuses: dict[str, extraction.ExtractionStatus],
+    task_id: int,
+    snapshot_hash: str | None = None,
+    feature_groups: list[str] | None = None,
+) -> None:
+    """
+    Add the cohorts that are saved to the cohort catalog. A failure to update the
+    catalog does not fail the task, as the cohort files themselves are complete.
+    """
+    for cohort_definition, cohort_name in zip(cohort_definitions, cohort_names):
+        if statuses.get(cohort_name) != extraction.ExtractionStatus.SAVED:
+            continue
+        try:
+            catalog.register_cohort(
+                f"/mnt/data/cohort_{cohort_name}.parquet",
+                cohort_definition,
+                task_id,
+                snapshot_hash,
+                feature_groups,
+            )
+        except Exception as e:
+            warn(f"Failed to register cohort {cohort_name} in the catalog: {e}")
+            traceback.print_exc()
+
+
+def __write_timing_logs(
+    cohort_names: list[str], statuses: dict[str, extraction.ExtractionStatus]
+) -> None:
+    """
+    Write the stages recorded so far to a timing log next to the Parquet file of
+    every saved cohort. A failure to write a log does not fail the task.
+    """
+    recording = instrumentation.current()
+    if recording is None:
+        return
+    for cohort_name in cohort_names:
+        if statuses.get(cohort_name) != extraction.ExtractionStatus.SAVED:
+            continue
+        path = instrumentation.log_path(f"/mnt/data/cohort_{cohort_name}.parquet")
+        try:
+            recording.write(path, cohort=cohort_name)
+        except Exception as e:
+            warn(f"Failed to write the timing log of {cohort_name}: {e}")
+
+
+def _refresh_cohort(
+    connection: RS4,
+    meta_omop: OHDSIMetaData,
+    cohort_table: str,
+    cohort_id: float,
+    cohort_name: str,
+    cohort_definition: dict,
+    engine: str,
+    batch_size: int,
+    feature_groups: list[str] | None = None,
+) -> extraction.ExtractionStatus:
+    """
+    Refresh the Parquet file of a cohort with the patients that are new or changed
+    since the previous extraction.
+
+    When there is no previous extraction of the same cohort definition, or when most
+    patients changed, the cohort is extracted in full. In both cases the patient
+    versions are stored with the file for the next refresh.
 
     Parameters
     ----------
-    cohort_definition: dict
-        The cohort definition in JSON format, for example created from ATLAS.
+    connection : RS4
+        Connection to the database.
+    meta_omop : OHDSIMetaData
+        Metadata of the OMOP database.
+    cohort_table : str
+        Name of the cohort table in the results schema.
+    cohort_id : float
+        The cohort definition ID within the cohort table.
+    cohort_name : str
+        Name of the cohort, used for the Parquet file name.
+    cohort_definition : dict
+        The cohort definition, to check that the previous extraction is of the same
+        cohort.
+    engine : str
+        The requested extraction engine for a full extraction, see `create_cohort`.
+    batch_size : int
+        Number of rows per batch for the batched engines.
+    feature_groups : list[str] | None
+        The groups of features to extract, see `projection`. A previous extraction
+        of other feature groups is not refreshed but replaced.
 
     Returns
     -------
-    str
-        The cohort query.
+    extraction.ExtractionStatus
+        Whether the cohort is extracted and saved.
     """
-    cohort_expression = circe.cohort_expression_from_json(cohort_definition)
-    options = circe.create_generate_options(generate_stats=True)
-    return circe.build_cohort_query(cohort_expression, options)[0]
+    path = f"/mnt/data/cohort_{cohort_name}.parquet"
+    info(f"Refreshing cohort: {cohort_id} {cohort_name}")
+    try:
+        versions = __query_person_versions(
+            connection, meta_omop, cohort_table, cohort_id
+        )
+        previous = __read_previous_versions(path, cohort_definition, feature_groups)
+    except Exception as e:
+        error(f"Failed to obtain the patient versions of: {cohort_name}, continuing")
+        traceback.print_exc()
+        return extraction.ExtractionStatus.FAILED
 
+    if previous is None:
+        info(f"No previous extraction of {cohort_name}, extracting in full")
+        changed, removed = set(versions["PATIENT_ID"]), set()
+    else:
+        changed, removed = incremental.diff_versions(previous, versions)
+        info(f"{len(changed)} new or changed and {len(removed)} removed patients")
 
-def __create_cohort_dataframe(
+    if previous is not None and not changed and not removed:
+        info(f"Cohort {cohort_name} is up to date")
+        return extraction.ExtractionStatus.SAVED
+
+    full_extraction = previous is None or (
+        len(changed) > incremental.MAX_CHANGED_FRACTION * len(versions)
+    )
+    if full_extraction:
+        status = _extract_cohort(
+            connection,
+            meta_omop,
+            cohort_table,
+            cohort_id,
+            cohort_name,
+            engine,
+            batch_size,
+            feature_groups=feature_groups,
+        )
+    else:
+        status = __merge_changed_patients(
+            connection,
+            meta_omop,
+            cohort_table,
+            cohort_id,
+            path,
+            changed,
+            removed,
+            feature_groups,
+        )
+
+    if status == extraction.ExtractionStatus.SAVED:
+        try:
+            incremental.write_versions(path, versions, catalog.content_hash(path))
+        except Exception as e:
+            # The next refresh will then extract the cohort in full
+            warn(f"Failed to store the patient versions of {cohort_name}: {e}")
+            traceback.print_exc()
+    return status
+
+
+def __query_person_versions(
     connection: RS4,
     meta_omop: OHDSIMetaData,
     cohort_table: str,
     cohort_id: float,
 ) -> pd.DataFrame:
     """
-    Query the database for the data of the cohort.
+    Query the version of the source data of each patient in the cohort, see
+    `sql/person_versions.sql`.
+    """
+    template_path = pkg_resources.resource_filename(
+        "v6-sessions", incremental.VERSIONS_SQL
+    )
+    with open(template_path, "r") as f:
+        raw_sql = f.read()
+    sql = _render_features_sql(
+        raw_sql, cohort_table, cohort_id, meta_omop, template_path=template_path
+    )
+    data_r = database_connector.query_sql(connection, sql)
+    versions = conversion.convert_from_r(data_r)
+    versions.columns = versions.columns.str.upper()
+    return versions
+
+
+def __read_previous_versions(
+    path: str, cohort_definition: dict, feature_groups: list[str] | None
+) -> pd.DataFrame | None:
+    """
+    Read the patient versions of the previous extraction of a cohort. These are only
+    used when the cohort file is registered in the catalog, has not been modified
+    since and is created from the same cohort definition and feature groups, with
+    the current column types.
+    """
+    entry = catalog.get_entry(Path(path).stem)
+    if entry is None:
+        return None
+    if entry["definition_hash"] != catalog.definition_hash(cohort_definition):
+        info(f"Cohort definition of {path} changed, not refreshing")
+        return None
+    if entry.get("feature_groups") != feature_groups:
+        info(f"Feature groups of {path} changed, not refreshing")
+        return None
+    if feature_types.read_types(path) is None:
+        info(f"Column types of {path} are not recorded, not refreshing")
+        return None
+    return incremental.read_versions(path, entry["content_hash"])
+
+
+def __merge_changed_patients(
+    connection: RS4,
+    meta_omop: OHDSIMetaData,
+    cohort_table: str,
+    cohort_id: float,
+    path: str,
+    changed: set,
+    removed: set,
+    feature_groups: list[str] | None = None,
+) -> extraction.ExtractionStatus:
+    """
+    Retrieve the features of the changed patients and merge them into the cohort
+    file.
+
+    The changed patients are copied to a separate cohort (with the negated cohort
+    ID) in the cohort table, so that the feature query is limited to them. Their IDs
+    are loaded into a temporary table first (see `__load_changed_patients`), so that
+    the size of the statement does not grow with the number of changed patients.
+    """
+    delta = None
+    if changed:
+        delta_id = -cohort_id
+        table = f"{meta_omop.results_schema}.{cohort_table}"
+        try:
+            __load_changed_patients(connection, changed)
+            database_connector.execute_sql(
+                connection,
+                f"INSERT INTO {table} (cohort_definition_id, subject_id, "
+                "cohort_start_date, cohort_end_date) "
+                f"SELECT {int(delta_id)}, cohort.subject_id, cohort.cohort_start_date, "
+                f"cohort.cohort_end_date FROM {table} cohort "
+                f"JOIN pg_temp.{CHANGED_PATIENTS_TABLE} changed "
+                "ON cohort.subject_id = changed.subject_id "
+                f"WHERE cohort.cohort_definition_id = {int(cohort_id)}",
+            )
+            database_connector.execute_sql(
+                connection, f"DROP TABLE pg_temp.{CHANGED_PATIENTS_TABLE}"
+            )
+            delta = __create_cohort_dataframe(
+                connection, meta_omop, cohort_table, delta_id, feature_groups
+            )
+        except Exception as e:
+            error(f"Failed to retrieve the changed patients of {path}, continuing")
+            traceback.print_exc()
+            return extraction.ExtractionStatus.FAILED
+
+    try:
+        n_rows = incremental.merge_cohort(path, delta, changed | removed)
+    except Exception as e:
+        error(f"Failed to merge the changed patients into {path}")
+        traceback.print_exc()
+        return extraction.ExtractionStatus.SAVE_FAILED
+
+    info(f"Merged {len(changed)} patients into {path}, now {n_rows} rows")
+    return extraction.ExtractionStatus.SAVED
+
+
+def __load_changed_patients(connection: RS4, changed: set) -> None:
+    """
+    Load the IDs of the changed patients into a temporary table, in statements of at
+    most `CHANGED_PATIENTS_CHUNK_SIZE` IDs.
+    """
+    database_connector.execute_sql(
+        connection, f"DROP TABLE IF EXISTS pg_temp.{CHANGED_PATIENTS_TABLE}"
+    )
+    database_connector.execute_sql(
+        connection,
+        f"CREATE TEMP TABLE {CHANGED_PATIENTS_TABLE} (subject_id BIGINT PRIMARY KEY)",
+    )
+    subject_ids = sorted(int(subject_id) for subject_id in changed)
+    for offset in range(0, len(subject_ids), CHANGED_PATIENTS_CHUNK_SIZE):
+        values = ", ".join(
+            f"({subject_id})"
+            for subject_id in subject_ids[offset : offset + CHANGED_PATIENTS_CHUNK_SIZE]
+        )
+        database_connector.execute_sql(
+            connection,
+            f"INSERT INTO {CHANGED_PATIENTS_TABLE} (subject_id) VALUES {values}",
+        )
+    database_connector.execute_sql(
+        connection, f"ANALYZE pg_temp.{CHANGED_PATIENTS_TABLE}"
+    )
+
+
+def _extract_cohort(
+    connection: RS4,
+    meta_omop: OHDSIMetaData,
+    cohort_table: str,
+    cohort_id: float,
+    cohort_name: str,
+    engine: str,
+    batch_size: int,
+    staged: bool = False,
+    feature_groups: list[str] | None = None,
+) -> extraction.ExtractionStatus:
+    """
+    Retrieve the features of a single cohort and store them in a Parquet file.
+
+    Failures are logged and reported through the returned status, so that a failing
+    cohort does not stop the extraction of the other cohorts.
 
     Parameters
     ----------
     connection : RS4
         Connection to the database.
+    meta_omop : OHDSIMetaData
+        Metadata of the OMOP database.
+    cohort_table : str
+        Name of the cohort table in the results schema.
+    cohort_id : float
+        The cohort definition ID within the cohort table.
+    cohort_name : str
+        Name of the cohort, used for the Parquet file name.
+    engine : str
+        The requested extraction engine, see `create_cohort`.
+    batch_size : int
+        Number of rows per batch for the batched engines.
+    staged : bool
+        Whether to materialize the CTEs of the feature query first, see `staging`.
+    feature_groups : list[str] | None
+        The groups of features to extract, see `projection`. None for all features.
 
     Returns
     -------
-    pd.DataFrame
-        The data of the cohort.
+    extraction.ExtractionStatus
+        Whether the cohort is extracted and saved.
+    """
+    info(f"Retrieving variables for cohort: {cohort_id} {cohort_name}")
+    try:
+        cohort_engine = extraction.resolve_engine(
+            engine,
+            connection,
+            f"{meta_omop.results_schema}.{cohort_table}",
+            cohort_id,
+            meta_omop.dbms,
+        )
+    except Exception as e:
+        error(f"Failed to count the records of cohort: {cohort_name}, continuing")
+        traceback.print_exc()
+        return extraction.ExtractionStatus.FAILED
+
+    if staged:
+        try:
+            __extract_cohort_staged(
+                connection,
+                meta_omop,
+                cohort_table,
+                cohort_id,
+                f"/mnt/data/cohort_{cohort_name}.parquet",
+                cohort_engine,
+                batch_size,
+                feature_groups,
+            )
+        except Exception as e:
+            error(f"Failed to extract cohort data: {cohort_name}, continuing")
+            traceback.print_exc()
+            return extraction.ExtractionStatus.FAILED
+
+        info(f"Saved cohort data to /mnt/data/cohort_{cohort_name}.parquet")
+        return extraction.ExtractionStatus.SAVED
+
+    if cohort_engine in extraction.BATCH_ENGINES:
+        try:
+            __extract_cohort_to_parquet(
+                connection,
+                meta_omop,
+                cohort_table,
+                cohort_id,
+                f"/mnt/data/cohort_{cohort_name}.parquet",
+                cohort_engine,
+                batch_size,
+                feature_groups,
+            )
+        except Exception as e:
+            error(f"Failed to extract cohort data: {cohort_name}, continuing")
+            traceback.print_exc()
+            return extraction.ExtractionStatus.FAILED
+
+        info(f"Saved cohort data to /mnt/data/cohort_{cohort_name}.parquet")
+        return extraction.ExtractionStatus.SAVED
+
+    try:
+        df = __create_cohort_dataframe(
+            connection, meta_omop, cohort_table, cohort_id, feature_groups
+        )
+
+    except Exception as e:
+        error(f"Failed to create cohort dataframe: {cohort_name}, continuing")
+        traceback.print_exc()
+        # TODO we need to create a special container error for this
+        return extraction.ExtractionStatus.FAILED
+
+    try:
+        extraction.write_batches_to_parquet(
+            [df], f"/mnt/data/cohort_{cohort_name}.parquet", layout=True
+        )
+    except Exception as e:
+        error(f"Failed to save cohort data to /mnt/data/cohort_{cohort_name}.parquet")
+        traceback.print_exc()
+        return extraction.ExtractionStatus.SAVE_FAILED
+
+    info(f"Saved cohort data to /mnt/data/cohort_{cohort_name}.parquet")
+    return extraction.ExtractionStatus.SAVED
+
+
+def _extract_cohorts_parallel(
+    meta_omop: OHDSIMetaData,
+    cohort_table: str,
+    cohort_ids: list[float],
+    cohort_names: list[str],
+    engine: str,
+    batch_size: int,
+    max_workers: int,
+    feature_groups: list[str] | None = None,
+) -> dict[str, extraction.ExtractionStatus]:
+    """
+    Retrieve the features of multiple cohorts concurrently.
+
+    Every worker is a separate process with its own R session and its own database
+    connection, as the embedded R session (and thereby the database connection) can
+    only be used by one thread at a time. A failure in one of the cohorts does not
+    affect the other cohorts.
+
+    Parameters
+    ----------
+    max_workers : int
+        Maximum number of cohorts that are extracted at the same time.
+
+    See `_extract_cohort` for the other parameters.
+
+    Returns
+    -------
+    dict[str, extraction.ExtractionStatus]
+        The status of the extraction for each cohort.
+    """
+    info(f"Extracting {len(cohort_ids)} cohorts using {max_workers} workers")
+    label = _get_user_database_labels()[0]
+    statuses = {}
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_extraction_worker,
+        initargs=(label,),
+    ) as executor:
+        futures = {
+            executor.submit(
+                _extract_cohort_in_worker,
+                meta_omop,
+                cohort_table,
+                cohort_id,
+                cohort_name,
+                engine,
+                batch_size,
+                feature_groups=feature_groups,
+            ): cohort_name
+            for cohort_id, cohort_name in zip(cohort_ids, cohort_names)
+        }
+        for future in as_completed(futures):
+            cohort_name = futures[future]
+            try:
+                statuses[cohort_name], stages = future.result()
+            except Exception as e:
+                error(f"Extraction worker failed for cohort: {cohort_name}, continuing")
+                traceback.print_exc()
+                statuses[cohort_name] = extraction.ExtractionStatus.FAILED
+                continue
+            instrumentation.merge(stages)
+
+    return statuses
+
+
+# Database connection of an extraction worker process, see `_init_extraction_worker`
+_worker_connection = None
+
+
+def _init_extraction_worker(label: str) -> None:
+    """
+    Create the database connection for an extraction worker process. The connection
+    is closed when the worker process exits, i.e. when the pool is shut down.
+
+    Parameters
+    ----------
+    label : str
+        The label of the OMOP database at the node.
+    """
+    global _worker_connection
+    _worker_connection = _create_omop_database_connection(label)
+    atexit.register(_close_extraction_worker)
+
+
+def _close_extraction_worker() -> None:
+    """
+    Close the database connection of an extraction worker process.
+    """
+    global _worker_connection
+    if _worker_connection is None:
+        return
+    try:
+        database_connector.disconnect(_worker_connection)
+    except Exception as e:
+        warn(f"Failed to close the database connection of the worker: {e}")
+    _worker_connection = None
+
+
+def _extract_cohort_in_worker(
+    meta_omop: OHDSIMetaData,
+    cohort_table: str,
+    cohort_id: float,
+    cohort_name: str,
+    *args,
+    **kwargs,
+) -> tuple[extraction.ExtractionStatus, list[dict]]:
+    """
+    Extract a single cohort in an extraction worker process using the connection of
+    that worker. See `_extract_cohort` for the arguments.
+
+    Returns
+    -------
+    tuple[extraction.ExtractionStatus, list[dict]]
+        Whether the cohort is extracted and saved, and the stages that are recorded
+        in the worker, see `instrumentation`.
+    """
+    with instrumentation.recording() as recording:
+        with instrumentation.stage("extract", cohort=cohort_name):
+            status = _extract_cohort(
+                _worker_connection,
+                meta_omop,
+                cohort_table,
+                cohort_id,
+                cohort_name,
+                *args,
+                **kwargs,
+            )
+    return status, recording.entries()
+
+
+def _create_cohort_query(cohort_definition: dict, generate_stats: bool = False) -> str:
+    """
+    Creates a cohort query from a cohort definition in JSON format.
+
+    Parameters
+    ----------
+    cohort_definition: dict
+        The cohort definition in JSON format, for example created from ATLAS.
+    generate_stats: bool
+        Whether the query also computes the inclusion rule statistics.
+
+    Returns
+    -------
+    str
+        The cohort query.
     """
+    generate_options = {"generate_stats": generate_stats}
+
+    def build_cohort_query() -> str:
+        cohort_expression = circe.cohort_expression_from_json(cohort_definition)
+        options = circe.create_generate_options(**generate_options)
+        return circe.build_cohort_query(cohort_expression, options)[0]
+
+    # The cohort query only depends on the definition and the options, so it is
+    # cached to avoid the calls to Circe
+    key = cache.fingerprint(cohort_definition, generate_options)
+    return cache.get_or_create("circe", key, build_cohort_query)
+
+
+def __features_sql_path() -> str:
     # Obtain SQL file for standard features
-    sql_path = pkg_resources.resource_filename(
+    return pkg_resources.resource_filename(
         "v6-sessions",
         "sql/sarcoma_features.sql",
     )
 
-    # SQL READ
+
+def __read_features_sql() -> str:
+    """
+    Read the SQL file that contains the sarcoma feature query.
+
+    Returns
+    -------
+    str
+        The (unrendered) SQL.
+    """
+    sql_path = __features_sql_path()
+
+    # SQL READ, the file is read in Python as SqlRender's `read_sql` only reads the
+    # file as well
     try:
-        raw_sql = sqlrender.read_sql(sql_path)
+        raw_sql = Path(sql_path).read_text(encoding="utf-8")
     except Exception as e:
         error(f"Failed to read SQL file: {e}")
         traceback.print_exc()
         raise e
     info(f"Red SQL file: {sql_path}")
+    return raw_sql
 
-    info("Start query sequence the database")
-    df = _query_database(connection, raw_sql, cohort_table, cohort_id, meta_omop)
 
-    # NACHARS
-    info("Post-processing the data")
+def __create_cohort_dataframe(
+    connection: RS4,
+    meta_omop: OHDSIMetaData,
+    cohort_table: str,
+    cohort_id: float,
+    feature_groups: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Query the database for the data of the cohort.
+
+    Parameters
+    ----------
+    connection : RS4
+        Connection to the database.
+    feature_groups : list[str] | None
+        The groups of features to query, see `projection`. None for all features.
+
+    Returns
+    -------
+    pd.DataFrame
+        The data of the cohort.
+    """
+    raw_sql = __read_features_sql()
+
+    info("Start query sequence the database")
+    df = _query_database(
+        connection, raw_sql, cohort_table, cohort_id, meta_omop, feature_groups
+    )
 
     info(df.columns)
-    # df["OBSERVATION_VAS"] = df["OBSERVATION_VAS"].apply(
-    #     lambda val: np.nan if isinstance(val, NACharacterType) else val
-    # )
+    return _post_process_features(df)
+
 
-    # Assuming df is your DataFrame and NACharacterType is defined somewhere in your code
-    df = df.applymap(lambda val: np.nan if isinstance(val, NACharacterType) else val)
+def _post_process_features(
+    df: pd.DataFrame, seen_patients: set | None = None
+) -> pd.DataFrame:
+    """
+    Post-process the features of a cohort as retrieved from the database.
 
-    # DROP DUPLICATES
-    sub_df = df.drop_duplicates("PATIENT_ID", keep="first")
-    info(f"Dropped {len(df) - len(sub_df)} rows")
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The features of the cohort, or a batch of them.
+    seen_patients : set | None
+        When the features are processed in batches, the patient IDs of the earlier
+        batches. These patients are dropped from `df`, and the patients of `df` are
+        added to the set.
 
-    # Convert to category when type is object
-    info("Converting object columns to category")
-    for col in sub_df.select_dtypes(include=["object"]).columns:
-        sub_df[col] = sub_df[col].astype("category")
+    Returns
+    -------
+    pd.DataFrame
+        The features with a single row per patient, converted to their declared
+        types, see `feature_types`.
+    """
+    # R NA values are already converted to nulls by `conversion.convert_from_r`
+    info("Post-processing the data")
+
+    with instrumentation.stage("post_process", rows_in=len(df)) as stage:
+        # DROP DUPLICATES, the query already returns a single row per patient so this
+        # is only a safety net
+        sub_df = df.drop_duplicates("PATIENT_ID", keep="first")
+        if seen_patients is not None:
+            sub_df = sub_df[~sub_df["PATIENT_ID"].isin(seen_patients)]
+            seen_patients.update(sub_df["PATIENT_ID"])
+        if len(sub_df) < len(df):
+            warn(f"Dropped {len(df) - len(sub_df)} duplicate rows")
+
+        info("Converting the columns to their declared types")
+        sub_df = feature_types.apply_types(sub_df)
+        stage.rows_out = len(sub_df)
 
     return sub_df
 
 
-def _query_database(
+def _post_process_arrow_features(table: pa.Table, seen_patients: set) -> pa.Table:
+    """
+    Arrow equivalent of `_post_process_features`, for the batches of the "arrow"
+    engine that are written without converting them to pandas.
+
+    Parameters
+    ----------
+    table : pa.Table
+        A batch of the features of the cohort.
+    seen_patients : set
+        The patient IDs of the earlier batches. These patients are dropped from
+        `table`, and the patients of `table` are added to the set.
+
+    Returns
+    -------
+    pa.Table
+        The features with a single row per patient, converted to their declared
+        types, see `feature_types`.
+    """
+    with instrumentation.stage("post_process", rows_in=table.num_rows) as stage:
+        patient_ids = table["PATIENT_ID"].to_numpy()
+        keep = np.zeros(len(patient_ids), dtype=bool)
+        keep[np.unique(patient_ids, return_index=True)[1]] = True
+        keep &= ~np.isin(patient_ids, list(seen_patients))
+        seen_patients.update(patient_ids[keep].tolist())
+        sub_table = table.filter(pa.array(keep))
+        if sub_table.num_rows < table.num_rows:
+            warn(f"Dropped {table.num_rows - sub_table.num_rows} duplicate rows")
+
+        sub_table = feature_types.apply_arrow_types(sub_table)
+        stage.rows_out = sub_table.num_rows
+
+    return sub_table
+
+
+def __extract_cohort_to_parquet(
+    connection: RS4,
+    meta_omop: OHDSIMetaData,
+    cohort_table: str,
+    cohort_id: float,
+    path: str,
+    engine: str,
+    batch_size: int,
+    feature_groups: list[str] | None = None,
+) -> int:
+    """
+    Query the database for the data of the cohort and write it in batches to a
+    Parquet file.
+
+    The post-processing of `__create_cohort_dataframe` is applied per batch. Patients
+    that are already written in an earlier batch are dropped, so that only the
+    patient IDs (and not the data) of the cohort are kept in memory.
+
+    Parameters
+    ----------
+    connection : RS4
+        Connection to the database.
+    path : str
+        Location of the Parquet file.
+    engine : str
+        Either "stream", "andromeda" or "arrow", see `extraction`.
+    batch_size : int
+        Maximum number of rows fetched from the database at once.
+    feature_groups : list[str] | None
+        The groups of features to query, see `projection`. None for all features.
+
+    Returns
+    -------
+    int
+        The number of rows written.
+    """
+    raw_sql = __read_features_sql()
+    sql = _render_features_sql(
+        raw_sql, cohort_table, cohort_id, meta_omop, feature_groups=feature_groups
+    )
+
+    seen_patients = set()
+
+    info(f"Start {engine} query sequence the database")
+    n_rows = extraction.query_to_parquet(
+        connection,
+        sql,
+        path,
+        engine=engine,
+        batch_size=batch_size,
+        transform=lambda df: _post_process_features(df, seen_patients),
+        transform_arrow=lambda table: _post_process_arrow_features(
+            table, seen_patients
+        ),
+    )
+    info(f"Extracted {n_rows} rows to {path}")
+    return n_rows
+
+
+def __extract_cohort_staged(
+    connection: RS4,
+    meta_omop: OHDSIMetaData,
+    cohort_table: str,
+    cohort_id: float,
+    path: str,
+    engine: str,
+    batch_size: int,
+    feature_groups: list[str] | None = None,
+) -> int:
+    """
+    Materialize the CTEs of the feature query as temporary tables, then query the
+    data of the cohort from them and write it to a Parquet file.
+
+    Parameters
+    ----------
+    connection : RS4
+        Connection to the database.
+    path : str
+        Location of the Parquet file.
+    engine : str
+        Either "memory", "stream", "andromeda" or "arrow", see `extraction`. The
+        temporary tables only exist in the session of `connection`, so "arrow" is
+        replaced by "stream".
+    batch_size : int
+        Maximum number of rows fetched from the database at once.
+    feature_groups : list[str] | None
+        The groups of features to query, see `projection`. None for all features.
+
+    Returns
+    -------
+    int
+        The number of rows written.
+    """
+    if engine == "arrow":
+        engine = "stream"
+    raw_sql = __read_features_sql()
+    sql = _render_features_sql(
+        raw_sql, cohort_table, cohort_id, meta_omop, feature_groups=feature_groups
+    )
+
+    with staging.StagedQuery(connection, sql) as staged:
+        if engine in extraction.BATCH_ENGINES:
+            seen_patients = set()
+            n_rows = extraction.query_to_parquet(
+                connection,
+                staged.sql,
+                path,
+                engine=engine,
+                batch_size=batch_size,
+                transform=lambda df: _post_process_features(df, seen_patients),
+            )
+        else:
+            with instrumentation.stage("query") as stage:
+                data_r = database_connector.query_sql(connection, staged.sql)
+                stage.rows_out = data_r.nrow
+            df = _post_process_features(conversion.convert_from_r(data_r))
+            n_rows = extraction.write_batches_to_parquet([df], path, layout=True)
+
+    info(f"Extracted {n_rows} rows to {path}")
+    info(f"Stage timings: {staged.timings}")
+    return n_rows
+
+
+def __extract_cohorts_single_pass(
     connection: RS4,
+    meta_omop: OHDSIMetaData,
+    cohort_table: str,
+    cohort_ids: list[float],
+    cohort_names: list[str],
+    engine: str,
+    batch_size: int,
+    feature_groups: list[str] | None = None,
+) -> dict[str, extraction.ExtractionStatus]:
+    """
+    Query the database once for the data of all cohorts in the cohort table and
+    split the result into a Parquet file per cohort.
+
+    The feature query is rendered with `cohort_id = -1`, in which case it includes
+    all cohorts of the cohort table and adds the `COHORT_DEFINITION_ID` column.
+
+    Parameters
+    ----------
+    connection : RS4
+        Connection to the database.
+    meta_omop : OHDSIMetaData
+        Metadata of the OMOP database.
+    cohort_table : str
+        Name of the cohort table in the results schema.
+    cohort_ids : list[float]
+        The cohort definition IDs within the cohort table.
+    cohort_names : list[str]
+        The names of the cohorts, used for the Parquet file names.
+    engine : str
+        The requested extraction engine, see `create_cohort`.
+    batch_size : int
+        Number of rows per batch for the batched engines.
+    feature_groups : list[str] | None
+        The groups of features to query, see `projection`. None for all features.
+
+    Returns
+    -------
+    dict[str, extraction.ExtractionStatus]
+        The status of the extraction for each cohort.
+    """
+    info(f"Retrieving variables for {len(cohort_ids)} cohorts in a single query")
+    failed = {name: extraction.ExtractionStatus.FAILED for name in cohort_names}
+    try:
+        engine = extraction.resolve_engine(
+            engine,
+            connection,
+            f"{meta_omop.results_schema}.{cohort_table}",
+            -1,
+            meta_omop.dbms,
+        )
+        raw_sql = __read_features_sql()
+    except Exception as e:
+        error("Failed to prepare the cohort extraction")
+        traceback.print_exc()
+        return failed
+
+    writers = {
+        cohort_id: extraction.ParquetBatchWriter(
+            f"/mnt/data/cohort_{cohort_name}.parquet",
+            layout=engine not in extraction.BATCH_ENGINES,
+        )
+        for cohort_id, cohort_name in zip(cohort_ids, cohort_names)
+    }
+    seen_patients = {cohort_id: set() for cohort_id in cohort_ids}
+
+    def write_partitioned(df: pd.DataFrame) -> None:
+        cohort_column = df.pop("COHORT_DEFINITION_ID").astype(float)
+        for cohort_name, (cohort_id, writer) in zip(cohort_names, writers.items()):
+            with instrumentation.stage("split", cohort=cohort_name):
+                writer.write(
+                    _post_process_features(
+                        df[cohort_column == cohort_id], seen_patients[cohort_id]
+                    )
+                )
+
+    try:
+        if engine in extraction.BATCH_ENGINES:
+            sql = _render_features_sql(
+                raw_sql, cohort_table, -1, meta_omop, feature_groups=feature_groups
+            )
+            for df in extraction.query_batches(connection, sql, engine, batch_size):
+                write_partitioned(df)
+        else:
+            write_partitioned(
+                _query_database(
+                    connection, raw_sql, cohort_table, -1, meta_omop, feature_groups
+                )
+            )
+    except Exception as e:
+        error("Failed to extract the cohort data")
+        traceback.print_exc()
+        for writer in writers.values():
+            writer.abort()
+        return failed
+
+    statuses = {}
+    for cohort_name, writer in zip(cohort_names, writers.values()):
+        try:
+            with instrumentation.stage("save", cohort=cohort_name):
+                writer.close()
+        except Exception as e:
+            error(f"Failed to save cohort data to {writer.path}")
+            traceback.print_exc()
+            statuses[cohort_name] = extraction.ExtractionStatus.SAVE_FAILED
+            continue
+        info(f"Saved {writer.n_rows} rows of cohort data to {writer.path}")
+        statuses[cohort_name] = extraction.ExtractionStatus.SAVED
+    return statuses
+
+
+def _render_features_sql(
     sql: str,
     cohort_table: str,
     cohort_id: float,
     meta_omop: OHDSIMetaData,
-) -> pd.DataFrame:
+    template_path: str | None = None,
+    feature_groups: list[str] | None = None,
+) -> str:
 
-    # RENDER
-    info("Rendering the SQL")
-    sql = sqlrender.render(
-        sql,
+    parameters = dict(
         cohort_table=f"{cohort_table}",
         cohort_id=cohort_id,
         results_schema=meta_omop.results_schema,
@@ -262,15 +1516,64 @@ def _query_database(
         incl_measurement_concept_id=["NULL"],
         incl_drug_concept_id=["NULL"],  #'ALL' ? @TODO in algo
     )
+    templated_parameters = sql_templates.with_sentinels(parameters)
+
+    def render_and_translate() -> str:
+        # RENDER
+        info("Rendering the SQL")
+        with instrumentation.stage("render"):
+            rendered_sql = sqlrender.render(sql, **templated_parameters)
+
+        # TRANSLATE
+        info("Translating the SQL")
+        with instrumentation.stage("translate"):
+            return sqlrender.translate(
+                rendered_sql, target_dialect=sql_templates.TARGET_DIALECT
+            )
+
+    # Use the SQL that is translated when the image was built, if available
+    with instrumentation.stage("render_pretranslated"):
+        translated_sql = sql_templates.render_pretranslated(
+            template_path or __features_sql_path(),
+            sql,
+            parameters,
+            sql_templates.TARGET_DIALECT,
+        )
+    if translated_sql is None:
+        # The rendered and translated SQL only depends on the template and
+        # parameters, so it is cached to avoid the calls to SqlRender. It is
+        # rendered with sentinels for the values that differ per task, so that the
+        # cached SQL is shared between tasks.
+        key = cache.fingerprint(sql, templated_parameters, sql_templates.TARGET_DIALECT)
+        translated_sql = sql_templates.bind_sentinels(
+            cache.get_or_create("render", key, render_and_translate), parameters
+        )
+
+    if feature_groups is None:
+        return translated_sql
+    with instrumentation.stage("project"):
+        return projection.project(translated_sql, feature_groups)
+
 
-    # TRANSLATE
-    info("Translating the SQL")
-    sql = sqlrender.translate(sql, target_dialect="postgresql")
+def _query_database(
+    connection: RS4,
+    sql: str,
+    cohort_table: str,
+    cohort_id: float,
+    meta_omop: OHDSIMetaData,
+    feature_groups: list[str] | None = None,
+) -> pd.DataFrame:
+
+    sql = _render_features_sql(
+        sql, cohort_table, cohort_id, meta_omop, feature_groups=feature_groups
+    )
 
     # QUERY
     info("Querying the database")
     try:
-        data_r = database_connector.query_sql(connection, sql)
+        with instrumentation.stage("query") as stage:
+            data_r = database_connector.query_sql(connection, sql)
+            stage.rows_out = data_r.nrow
     except Exception as e:
         error(f"Failed to query the database: {e}")
         traceback.print_exc()
@@ -279,4 +1582,4 @@ def _query_database(
 
     info("Convert")
     # CONVERT
-    return ohdsi_common.convert_from_r(data_r)
+    return conversion.convert_from_r(data_r)
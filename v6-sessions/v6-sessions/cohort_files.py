@@ -0,0 +1,46 @@
+"""
+This file contains the algorithm methods that manage the cohort files on the node.
+
+These methods only use the files in `/mnt/data`, so this module does not import
+CohortGenerator, Circe, SqlRender and the other OHDSI packages that `create_cohort`
+needs. Loading these packages (and their Java libraries) takes several seconds. The
+package only imports the modules that use them when one of their methods is
+requested, see `__init__.py`. The locations of the files next to a cohort file are
+therefore taken from `companion_files`, and not from `extraction` or `incremental`,
+which import rpy2, DatabaseConnector and the ADBC driver. Note that the vantage6
+decorators still import DatabaseConnector when it is installed.
+"""
+from pathlib import Path
+
+from vantage6.algorithm.tools.decorators import metadata, RunMetaData
+
+from . import catalog
+from . import companion_files
+from . import instrumentation
+
+
+def del_cohorts(cohort_names: list[str]):
+    for cohort_name in cohort_names:
+        Path(f"/mnt/data/{cohort_name}.parquet").unlink()
+        companion_files.sidecar_path(f"/mnt/data/{cohort_name}.parquet").unlink(
+            missing_ok=True
+        )
+        companion_files.versions_path(f"/mnt/data/{cohort_name}.parquet").unlink(
+            missing_ok=True
+        )
+        instrumentation.log_path(f"/mnt/data/{cohort_name}.parquet").unlink(
+            missing_ok=True
+        )
+    catalog.unregister_cohorts(cohort_names)
+    return {"msg": f"Cohort(s) {', '.join(cohort_names)} deleted"}
+
+
+@metadata
+def get_cohorts(meta_run: RunMetaData):
+    # The description of each cohort is obtained from the cohort catalog. Cohorts that
+    # are not (or no longer) in the catalog are described from their Parquet footer
+    # and sidecar file, so that the data itself is not read.
+    return [
+        {**entry, "organization": meta_run.organization_id}
+        for entry in catalog.list_cohorts()
+    ]
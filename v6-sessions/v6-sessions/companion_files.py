@@ -0,0 +1,87 @@
+"""
+This file contains the locations of the files that are stored next to a cohort file,
+and the helpers to read and write the sidecar file.
+
+These are used by the methods that only manage the cohort files (see
+`cohort_files`), so this module must not import R or the OHDSI packages, directly or
+through the other modules of this package.
+"""
+import os
+import json
+
+from pathlib import Path
+
+
+def sidecar_path(path: str | Path) -> Path:
+    """
+    Location of the sidecar file with metadata of a Parquet file.
+
+    Parameters
+    ----------
+    path : str | Path
+        Location of the Parquet file, e.g. `/mnt/data/cohort_x.parquet`.
+
+    Returns
+    -------
+    Path
+        Location of the sidecar file, e.g. `/mnt/data/cohort_x.meta.json`.
+    """
+    path = Path(path)
+    return path.with_name(f"{path.stem}.meta.json")
+
+
+def write_sidecar(path: str | Path, content: dict) -> None:
+    """
+    Write (or overwrite) the sidecar file of a Parquet file.
+
+    Parameters
+    ----------
+    path : str | Path
+        Location of the Parquet file.
+    content : dict
+        The (JSON serializable) content of the sidecar.
+    """
+    sidecar = sidecar_path(path)
+    tmp_path = sidecar.with_name(f".{sidecar.name}.tmp")
+    tmp_path.write_text(json.dumps(content, default=str), encoding="utf-8")
+    os.replace(tmp_path, sidecar)
+
+
+def read_sidecar(path: str | Path) -> dict | None:
+    """
+    Read the sidecar file of a Parquet file.
+
+    Parameters
+    ----------
+    path : str | Path
+        Location of the Parquet file.
+
+    Returns
+    -------
+    dict | None
+        The content of the sidecar, or None when the Parquet file has no (readable)
+        sidecar.
+    """
+    try:
+        return json.loads(sidecar_path(path).read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def versions_path(path: str | Path) -> Path:
+    """
+    Location of the file with the patient versions of a cohort file.
+
+    Parameters
+    ----------
+    path : str | Path
+        Location of the Parquet file, e.g. `/mnt/data/cohort_x.parquet`.
+
+    Returns
+    -------
+    Path
+        Location of the versions file, e.g. `/mnt/data/.cohort_x.versions.parquet`.
+        The file is hidden so that it is not listed as a cohort.
+    """
+    path = Path(path)
+    return path.with_name(f".{path.stem}.versions.parquet")
@@ -0,0 +1,109 @@
+"""
+This file contains the conversion of R data frames (as returned by
+DatabaseConnector) to pandas data frames.
+
+The generic rpy2 conversion keeps the R `NA` sentinels (e.g. `NACharacterType`) as
+Python objects in the resulting data frame, which then need to be replaced cell by
+cell. The conversion in this file works column by column on the underlying R
+vectors instead, so that missing values are mapped to proper nulls and every column
+gets a typed dtype in a single vectorized pass.
+"""
+import numpy as np
+import pandas as pd
+
+from rpy2.robjects import vectors
+from rpy2.robjects.packages import importr
+
+from . import instrumentation
+
+# R stores NA for integers and logicals as the smallest 32-bit integer, and NA for
+# 64-bit integers (bit64) as the smallest 64-bit integer.
+R_NA_INTEGER = np.iinfo(np.int32).min
+R_NA_INTEGER64 = np.iinfo(np.int64).min
+
+
+def convert_from_r(data_r: vectors.DataFrame) -> pd.DataFrame:
+    """
+    Convert an R data frame to a pandas data frame.
+
+    Parameters
+    ----------
+    data_r : vectors.DataFrame
+        The R data frame.
+
+    Returns
+    -------
+    pd.DataFrame
+        The data frame where R `NA` values are converted to nulls. Character columns
+        are of object dtype (with `NaN` for missing values), integer columns of the
+        nullable `Int64` dtype, logical columns of the nullable `boolean` dtype,
+        numeric columns of `float64`, dates of `datetime64` and factors of
+        `category` dtype.
+    """
+    base = importr("base")
+    with instrumentation.stage("convert", rows_in=data_r.nrow) as stage:
+        df = pd.DataFrame(
+            {
+                name: convert_vector_from_r(column, base)
+                for name, column in zip(data_r.names, data_r)
+            }
+        )
+        stage.rows_out = len(df)
+    return df
+
+
+def convert_vector_from_r(
+    column: vectors.Vector, base=None
+) -> np.ndarray | pd.api.extensions.ExtensionArray:
+    """
+    Convert a single R vector (a column of an R data frame) to a typed array.
+
+    Parameters
+    ----------
+    column : vectors.Vector
+        The R vector.
+    base : InstalledSTPackage | None
+        The R `base` package, only used for character vectors.
+
+    Returns
+    -------
+    np.ndarray | pd.api.extensions.ExtensionArray
+        The converted values.
+    """
+    rclass = set(column.rclass)
+
+    if isinstance(column, vectors.FactorVector):
+        codes = np.asarray(column.memoryview()).astype(np.int64)
+        codes = np.where(codes == R_NA_INTEGER, -1, codes - 1)
+        return pd.Categorical.from_codes(codes, categories=list(column.levels))
+
+    if isinstance(column, vectors.BoolVector):
+        values = np.asarray(column.memoryview())
+        return pd.arrays.BooleanArray(values != 0, values == R_NA_INTEGER)
+
+    if isinstance(column, vectors.IntVector):
+        values = np.asarray(column.memoryview())
+        return pd.arrays.IntegerArray(values.astype(np.int64), values == R_NA_INTEGER)
+
+    if isinstance(column, vectors.FloatVector):
+        values = np.asarray(column.memoryview())
+        if "integer64" in rclass:
+            values = values.view(np.int64)
+            return pd.arrays.IntegerArray(values.copy(), values == R_NA_INTEGER64)
+        if "Date" in rclass:
+            return pd.to_datetime(values, unit="D").values
+        if "POSIXct" in rclass:
+            return pd.to_datetime(values, unit="s").values
+        # NA_real_ is a NaN, so no further conversion is required
+        return values.astype(np.float64)
+
+    if isinstance(column, vectors.StrVector):
+        base = base or importr("base")
+        missing = np.asarray(base.is_na(column).memoryview()) != 0
+        values = np.array(column, dtype=object)
+        values[missing] = np.nan
+        return values
+
+    # Other types (e.g. lists) are rare in query results, fall back on the default
+    # conversion of rpy2.
+    return np.array(column, dtype=object)
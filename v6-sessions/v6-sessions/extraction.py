@@ -0,0 +1,784 @@
+"""
+This file contains the functions that move the result of a feature query from the
+database into a file on the node.
+
+The default path (`query_sql`) loads the complete result set in memory. The
+engines in this file fetch the result in batches and append every batch to the
+output file, so the peak memory is bounded by the batch size rather than by the
+size of the cohort:
+
+stream
+    The result is fetched in batches directly from the database.
+andromeda
+    The result is first spilled to disk in an Andromeda object, which is then read in
+    batches. This keeps the database transaction short for cohorts that do not fit
+    in memory at all.
+arrow
+    The result is fetched in batches of Arrow records over a native connection,
+    bypassing the R session, see `native`. Only available for PostgreSQL.
+"""
+import os
+import traceback
+
+from enum import Enum
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from rpy2.robjects import RS4
+from rpy2.robjects.packages import importr
+
+from vantage6.algorithm.tools.util import info, error, warn, get_env_var
+
+from ohdsi import database_connector
+
+from . import companion_files
+from . import conversion
+from . import feature_types
+from . import instrumentation
+from . import native
+
+# Number of rows that are fetched from the database in a single batch
+DEFAULT_BATCH_SIZE = 10000
+
+# When the extraction engine is "auto", cohorts with more records than this threshold
+# are extracted with the "andromeda" engine. The node admin can override this value by
+# setting the environment variable below.
+ENVVAR_ANDROMEDA_THRESHOLD = "EXTRACTION_ANDROMEDA_THRESHOLD"
+DEFAULT_ANDROMEDA_THRESHOLD = 250000
+
+# Engines that write the query result in batches
+BATCH_ENGINES = ("stream", "andromeda", "arrow")
+
+# Number of rows per row group of the cohort files. Smaller row groups allow readers
+# to skip more data using the column statistics, larger row groups compress better.
+# The node admin can override this value by setting the environment variable below.
+ENVVAR_ROW_GROUP_SIZE = "PARQUET_ROW_GROUP_SIZE"
+DEFAULT_ROW_GROUP_SIZE = 65536
+
+# Compression codec of the cohort files
+PARQUET_COMPRESSION = "zstd"
+
+# Formats in which a query result can be written in batches, see `write_batches`
+OUTPUT_FORMATS = ("csv", "parquet", "feather")
+
+# Column by which the rows of the cohort files are sorted
+SORT_COLUMN = "PATIENT_ID"
+
+
+class ExtractionStatus(str, Enum):
+    SAVED = "SAVED"
+    FAILED = "FAILED"
+    SAVE_FAILED = "SAVE_FAILED"
+
+
+def resolve_engine(
+    engine: str,
+    connection: RS4,
+    cohort_table: str,
+    cohort_id: float,
+    dbms: str | None = None,
+) -> str:
+    """
+    Determine the engine to use for the extraction.
+
+    When `engine` is "auto", the number of records of the cohort is counted first.
+    Cohorts larger than the configured threshold are extracted through Andromeda,
+    smaller cohorts are loaded in memory. When `engine` is "arrow" but the native
+    path is not available for the database, the "stream" engine is used instead.
+
+    Parameters
+    ----------
+    engine : str
+        The requested engine.
+    connection : RS4
+        Connection to the database.
+    cohort_table : str
+        Fully qualified name of the cohort table.
+    cohort_id : float
+        The cohort definition ID within the cohort table.
+    dbms : str | None
+        The dialect of the database, e.g. "postgresql".
+
+    Returns
+    -------
+    str
+        The engine to use.
+    """
+    if engine == "arrow" and not native.is_available(dbms):
+        warn(f"The 'arrow' engine is not available for '{dbms}', using 'stream'")
+        return "stream"
+    if engine != "auto":
+        return engine
+
+    threshold = get_env_var(
+        ENVVAR_ANDROMEDA_THRESHOLD, DEFAULT_ANDROMEDA_THRESHOLD, as_type="int"
+    )
+    with instrumentation.stage("count_records") as stage:
+        n_records = count_cohort_records(connection, cohort_table, cohort_id)
+        stage.rows_out = n_records
+    engine = "andromeda" if n_records > threshold else "memory"
+    info(f"Cohort has {n_records} records (threshold {threshold}), using '{engine}'")
+    return engine
+
+
+def count_cohort_records(connection: RS4, cohort_table: str, cohort_id: float) -> int:
+    """
+    Count the number of records of a cohort in the cohort table.
+
+    Parameters
+    ----------
+    connection : RS4
+        Connection to the database.
+    cohort_table : str
+        Fully qualified name of the cohort table.
+    cohort_id : float
+        The cohort definition ID within the cohort table, or -1 to count the records
+        of all cohorts in the table.
+
+    Returns
+    -------
+    int
+        The number of records.
+    """
+    sql = f"SELECT COUNT(*) AS n_records FROM {cohort_table}"
+    if cohort_id != -1:
+        sql += f" WHERE cohort_definition_id = {cohort_id}"
+    data_r = database_connector.query_sql(connection, sql)
+    return int(conversion.convert_from_r(data_r).iloc[0, 0])
+
+
+def query_batches(
+    connection: RS4,
+    sql: str,
+    engine: str = "stream",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+):
+    """
+    Execute a (rendered and translated) query and yield the result in batches.
+
+    Parameters
+    ----------
+    connection : RS4
+        Connection to the database.
+    sql : str
+        The SQL query to execute.
+    engine : str
+        Either "stream", "andromeda" or "arrow". The "arrow" engine does not use
+        `connection` but its own connection to the database, see `native`.
+    batch_size : int
+        Maximum number of rows in a single batch.
+
+    Yields
+    ------
+    pd.DataFrame
+        The batches of the result. The first batch is always yielded, even when the
+        result is empty, so that the columns of the result are known.
+    """
+    if engine == "stream":
+        yield from _stream_batches(connection, sql, batch_size)
+    elif engine == "andromeda":
+        yield from _andromeda_batches(connection, sql, batch_size)
+    elif engine == "arrow":
+        yield from native.fetch_batches(sql, batch_size)
+    else:
+        raise ValueError(f"Engine '{engine}' does not support batches")
+
+
+def query_to_parquet(
+    connection: RS4,
+    sql: str,
+    path: str | Path,
+    engine: str = "stream",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    transform: Callable[[pd.DataFrame], pd.DataFrame] | None = None,
+    transform_arrow: Callable[[pa.Table], pa.Table] | None = None,
+) -> int:
+    """
+    Execute a (rendered and translated) query and write the result to a Parquet
+    file in batches.
+
+    With the "arrow" engine the batches are written as Arrow tables, without
+    converting them to pandas, provided that `transform` has an Arrow equivalent
+    `transform_arrow` (or is not given). Only the first batch is converted, to
+    determine the schema and the metadata of the file.
+
+    Parameters
+    ----------
+    connection : RS4
+        Connection to the database.
+    sql : str
+        The SQL query to execute.
+    path : str | Path
+        Location of the Parquet file.
+    engine : str
+        Either "stream", "andromeda" or "arrow".
+    batch_size : int
+        Maximum number of rows fetched from the database in a single batch.
+    transform : Callable[[pd.DataFrame], pd.DataFrame] | None
+        Optional function that is applied to every batch before it is written.
+    transform_arrow : Callable[[pa.Table], pa.Table] | None
+        Optional Arrow equivalent of `transform`, applied to the batches of the
+        "arrow" engine.
+
+    Returns
+    -------
+    int
+        The number of rows written to the Parquet file.
+    """
+    if engine == "arrow" and (transform is None or transform_arrow is not None):
+        tables = native.fetch_tables(sql, batch_size)
+        return _write_tables_to_parquet(tables, path, transform, transform_arrow)
+
+    batches = query_batches(connection, sql, engine, batch_size)
+    if transform:
+        batches = (transform(df) for df in batches)
+    return write_batches_to_parquet(batches, path)
+
+
+def query_to_csv(
+    connection: RS4,
+    sql: str,
+    path: str | Path,
+    engine: str = "stream",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    transform: Callable[[pd.DataFrame], pd.DataFrame] | None = None,
+) -> int:
+    """
+    Execute a (rendered and translated) query and write the result to a CSV file in
+    batches.
+
+    Parameters are the same as for `query_to_parquet`.
+
+    Returns
+    -------
+    int
+        The number of rows written to the CSV file.
+    """
+    batches = query_batches(connection, sql, engine, batch_size)
+    if transform:
+        batches = (transform(df) for df in batches)
+    return write_batches_to_csv(batches, path)
+
+
+def write_batches(batches, path: str | Path, output_format: str = "parquet") -> int:
+    """
+    Write a sequence of data frames to a single file in one of `OUTPUT_FORMATS`.
+
+    The batches are written one at a time to a temporary file, which replaces the
+    file at `path` once all batches are written. Parquet files are written without
+    optimizing their layout, so that the complete table never needs to be in memory.
+
+    Parameters
+    ----------
+    batches : Iterable[pd.DataFrame]
+        The batches to write. All batches should have the same columns.
+    path : str | Path
+        Location of the file.
+    output_format : str
+        Either "csv", "parquet" or "feather".
+
+    Returns
+    -------
+    int
+        The number of rows written.
+    """
+    if output_format == "csv":
+        return write_batches_to_csv(batches, path)
+    elif output_format == "parquet":
+        return write_batches_to_parquet(batches, path, layout=False)
+    elif output_format == "feather":
+        return write_batches_to_feather(batches, path)
+    raise ValueError(f"Unknown output format '{output_format}'")
+
+
+def write_batches_to_csv(batches, path: str | Path) -> int:
+    """
+    Append a sequence of data frames to a single CSV file.
+
+    The file is written to a temporary file next to `path` which is renamed once all
+    batches are written, so that readers never see a partially written file.
+
+    Parameters
+    ----------
+    batches : Iterable[pd.DataFrame]
+        The batches to write. All batches should have the same columns.
+    path : str | Path
+        Location of the CSV file.
+
+    Returns
+    -------
+    int
+        The number of rows written.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+
+    n_rows = 0
+    try:
+        for i, df in enumerate(batches):
+            if i and not len(df):
+                continue
+            with instrumentation.stage("write", rows_in=len(df)):
+                df.to_csv(tmp_path, index=False, mode="a" if i else "w", header=not i)
+            n_rows += len(df)
+            info(f"Written {n_rows} rows to {path}")
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    if not tmp_path.exists():
+        raise ValueError(f"No data received to write to {path}")
+
+    os.replace(tmp_path, path)
+    return n_rows
+
+
+def write_batches_to_feather(batches, path: str | Path) -> int:
+    """
+    Append a sequence of data frames as record batches to a single Feather (Arrow
+    IPC) file.
+
+    The file is written to a temporary file next to `path` which is renamed once all
+    batches are written, so that readers never see a partially written file. The
+    schema is taken from the first data frame as in `ParquetBatchWriter`, except that
+    categorical columns are stored as strings: an Arrow IPC file holds a single
+    dictionary per column, while the levels of the batches differ.
+
+    Parameters
+    ----------
+    batches : Iterable[pd.DataFrame]
+        The batches to write. All batches should have the same columns.
+    path : str | Path
+        Location of the Feather file.
+
+    Returns
+    -------
+    int
+        The number of rows written.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    options = pa.ipc.IpcWriteOptions(compression=PARQUET_COMPRESSION)
+
+    writer, schema, n_rows = None, None, 0
+    try:
+        for df in batches:
+            if writer is not None and not len(df):
+                continue
+            with instrumentation.stage("write", rows_in=len(df)):
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if writer is None:
+                    schema = _widen_schema(table.schema)
+                    schema = pa.schema(
+                        [
+                            field.with_type(field.type.value_type)
+                            if pa.types.is_dictionary(field.type)
+                            else field
+                            for field in schema
+                        ],
+                        metadata=schema.metadata,
+                    )
+                    writer = pa.ipc.new_file(tmp_path, schema, options=options)
+                writer.write_table(table.cast(schema))
+            n_rows += table.num_rows
+            info(f"Written {n_rows} rows to {path}")
+        if writer is None:
+            raise ValueError(f"No data received to write to {path}")
+        writer.close()
+    except Exception:
+        if writer is not None:
+            writer.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    os.replace(tmp_path, path)
+    return n_rows
+
+
+def write_batches_to_parquet(batches, path: str | Path, layout: bool = False) -> int:
+    """
+    Append a sequence of data frames as row groups to a single Parquet file.
+
+    Parameters
+    ----------
+    batches : Iterable[pd.DataFrame]
+        The batches to write. All batches should have the same columns.
+    path : str | Path
+        Location of the Parquet file.
+    layout : bool
+        Whether to optimize the layout of the file, see `ParquetBatchWriter`. Only
+        use this when the batches fit in memory together.
+
+    Returns
+    -------
+    int
+        The number of rows written.
+    """
+    writer = ParquetBatchWriter(path, layout=layout)
+    try:
+        for df in batches:
+            writer.write(df)
+    except Exception:
+        writer.abort()
+        raise
+    return writer.close()
+
+
+class ParquetBatchWriter:
+    """
+    Write data frames as row groups to a single Parquet file.
+
+    The file is written to a temporary file next to `path` which is renamed when the
+    writer is closed, so that readers never see a partially written file.
+
+    The schema of the file is taken from the first data frame. Columns that only
+    contain missing values in the first data frame are stored as (categorical)
+    strings, and categorical columns are stored with 32-bit dictionary indices so that
+    later data frames with more levels still fit the schema. The types of the columns
+    are recorded in the metadata of the file, see `feature_types`.
+
+    The levels of the categorical columns are collected while writing and stored in a
+    sidecar file (see `companion_files.sidecar_path`), so that they can be listed
+    without reading the data.
+
+    Every data frame is written as it arrives, so that the writer only holds a single
+    batch in memory. When `layout` is True, the file is rewritten with an optimized
+    layout when the writer is closed, see `optimize_layout`. This reads the complete
+    file back into memory, so it is only used for results that are in memory
+    already (the "memory" engine), not for the batched engines.
+
+    Parameters
+    ----------
+    path : str | Path
+        Location of the Parquet file.
+    layout : bool
+        Whether to optimize the layout of the file when it is closed.
+    """
+
+    def __init__(self, path: str | Path, layout: bool = False):
+        self.path = Path(path)
+        self.layout = layout
+        self.tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        self.n_rows = 0
+        self.levels = {}
+        self._writer = None
+        self._schema = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        """
+        Append a data frame as row group. Empty data frames are only written when
+        nothing is written yet, to determine the schema of the file.
+        """
+        if self._writer is not None and not len(df):
+            return
+        with instrumentation.stage("write", rows_in=len(df)):
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._writer is None:
+                self._schema = _widen_schema(table.schema).with_metadata(
+                    {
+                        **(table.schema.metadata or {}),
+                        **feature_types.encode_metadata(df),
+                    }
+                )
+                self._writer = pq.ParquetWriter(
+                    self.tmp_path,
+                    self._schema,
+                    compression=PARQUET_COMPRESSION,
+                    write_statistics=True,
+                )
+            self._writer.write_table(
+                table.cast(self._schema),
+                row_group_size=get_env_var(
+                    ENVVAR_ROW_GROUP_SIZE, DEFAULT_ROW_GROUP_SIZE, as_type="int"
+                ),
+            )
+        self.n_rows += table.num_rows
+
+        # Dictionaries are used as ordered sets of levels
+        for col in df.select_dtypes(include=["category"]).columns:
+            levels = self.levels.setdefault(col, {})
+            for level in df[col].unique().tolist():
+                levels[None if pd.isna(level) else level] = None
+        info(f"Written {self.n_rows} rows to {self.path}")
+
+    def write_arrow(self, table: pa.Table) -> None:
+        """
+        Append an Arrow table as row group, without converting it to pandas. The
+        schema of the file must already be determined by a data frame, see `write`.
+        """
+        if self._writer is None:
+            raise ValueError(f"No schema known to write to {self.path}")
+        if not table.num_rows:
+            return
+        with instrumentation.stage("write", rows_in=table.num_rows):
+            table = table.cast(self._schema)
+            self._writer.write_table(
+                table,
+                row_group_size=get_env_var(
+                    ENVVAR_ROW_GROUP_SIZE, DEFAULT_ROW_GROUP_SIZE, as_type="int"
+                ),
+            )
+        self.n_rows += table.num_rows
+
+        for field in table.schema:
+            if not pa.types.is_dictionary(field.type):
+                continue
+            values = pc.unique(pc.cast(table[field.name], field.type.value_type))
+            levels = self.levels.setdefault(field.name, {})
+            for level in values.to_pylist():
+                levels[level] = None
+        info(f"Written {self.n_rows} rows to {self.path}")
+
+    def close(self) -> int:
+        """
+        Finish the file and move it to its final location.
+
+        Returns
+        -------
+        int
+            The number of rows written.
+        """
+        if self._writer is None:
+            raise ValueError(f"No data received to write to {self.path}")
+        self._writer.close()
+        if self.layout:
+            with instrumentation.stage("optimize_layout", rows_in=self.n_rows):
+                table = optimize_layout(pq.read_table(self.tmp_path))
+                write_table(table, self.tmp_path)
+        companion_files.write_sidecar(
+            self.path,
+            {
+                "levels": {col: list(levels) for col, levels in self.levels.items()},
+            },
+        )
+        os.replace(self.tmp_path, self.path)
+        return self.n_rows
+
+    def abort(self) -> None:
+        """
+        Discard the partially written file.
+        """
+        if self._writer is not None:
+            self._writer.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+
+def optimize_layout(table: pa.Table) -> pa.Table:
+    """
+    Optimize a cohort table for reading.
+
+    The dictionaries of the categorical columns are unified, so that they are
+    dictionary encoded with a single dictionary per column. Numeric columns are
+    downcast to the narrowest type that holds all values without loss, and the rows
+    are sorted by patient ID.
+
+    Parameters
+    ----------
+    table : pa.Table
+        The cohort table.
+
+    Returns
+    -------
+    pa.Table
+        The optimized table.
+    """
+    table = table.unify_dictionaries().combine_chunks()
+    schema = pa.schema(
+        [field.with_type(_narrowest_type(table[field.name])) for field in table.schema],
+        metadata=table.schema.metadata,
+    )
+    table = table.cast(schema)
+    if SORT_COLUMN in table.column_names:
+        table = table.sort_by(SORT_COLUMN)
+    return table
+
+
+def write_table(table: pa.Table, path: str | Path) -> None:
+    """
+    Write a table with the compression, row group size and statistics of the cohort
+    files. The table is written to a temporary file first, which then replaces the
+    file at `path`.
+
+    Parameters
+    ----------
+    table : pa.Table
+        The table to write.
+    path : str | Path
+        Location of the Parquet file.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.layout.tmp")
+    sorting_columns = None
+    if SORT_COLUMN in table.column_names:
+        sorting_columns = [pq.SortingColumn(table.column_names.index(SORT_COLUMN))]
+    pq.write_table(
+        table,
+        tmp_path,
+        row_group_size=get_env_var(
+            ENVVAR_ROW_GROUP_SIZE, DEFAULT_ROW_GROUP_SIZE, as_type="int"
+        ),
+        compression=PARQUET_COMPRESSION,
+        use_dictionary=True,
+        write_statistics=True,
+        sorting_columns=sorting_columns,
+    )
+    os.replace(tmp_path, path)
+
+
+def _stream_batches(connection: RS4, sql: str, batch_size: int):
+    """
+    Generator that sends the query to the database and fetches the result in
+    batches.
+    """
+    dbi = importr("DBI")
+
+    info("Sending the query to the database")
+    try:
+        with instrumentation.stage("query"):
+            result = dbi.dbSendQuery(connection, sql)
+    except Exception as e:
+        error(f"Failed to query the database: {e}")
+        traceback.print_exc()
+        raise e
+
+    try:
+        yield from _fetch_batches(dbi, result, batch_size)
+    finally:
+        dbi.dbClearResult(result)
+
+
+def _andromeda_batches(connection: RS4, sql: str, batch_size: int):
+    """
+    Generator that spills the result of the query to an Andromeda object on disk
+    and reads it back in batches.
+    """
+    dbi = importr("DBI")
+    database_connector_r = importr("DatabaseConnector")
+    andromeda_r = importr("Andromeda")
+
+    andromeda = andromeda_r.andromeda()
+    try:
+        info("Querying the database into Andromeda")
+        try:
+            with instrumentation.stage("query"):
+                database_connector_r.querySqlToAndromeda(
+                    connection=connection,
+                    sql=sql,
+                    andromeda=andromeda,
+                    andromedaTableName="features",
+                )
+        except Exception as e:
+            error(f"Failed to query the database: {e}")
+            traceback.print_exc()
+            raise e
+
+        result = dbi.dbSendQuery(andromeda, "SELECT * FROM features")
+        try:
+            yield from _fetch_batches(dbi, result, batch_size)
+        finally:
+            dbi.dbClearResult(result)
+    finally:
+        andromeda_r.close(andromeda)
+
+
+def _fetch_batches(dbi, result, batch_size: int):
+    """
+    Generator that fetches the result of a query in batches and converts every
+    batch to a pandas data frame.
+
+    The first batch is always yielded (even when it is empty) so that the columns of
+    the result are known to the writer.
+    """
+    first = True
+    while first or not dbi.dbHasCompleted(result)[0]:
+        with instrumentation.stage("fetch") as stage:
+            data_r = dbi.dbFetch(result, n=batch_size)
+            stage.rows_out = data_r.nrow
+        df = conversion.convert_from_r(data_r)
+        # `query_sql` returns upper case column names, `dbFetch` does not
+        df.columns = [col.upper() for col in df.columns]
+        if first or len(df):
+            yield df
+        first = False
+
+
+def _write_tables_to_parquet(
+    tables,
+    path: str | Path,
+    transform: Callable[[pd.DataFrame], pd.DataFrame] | None,
+    transform_arrow: Callable[[pa.Table], pa.Table] | None,
+) -> int:
+    """
+    Write a sequence of Arrow tables to a single Parquet file. The first table is
+    written as data frame, so that the schema and the metadata of the file are the
+    same as when all batches are written as data frames.
+    """
+    writer = ParquetBatchWriter(path)
+    first = True
+    try:
+        for table in tables:
+            if first:
+                df = native.to_pandas(table)
+                writer.write(transform(df) if transform else df)
+                first = False
+            else:
+                writer.write_arrow(transform_arrow(table) if transform_arrow else table)
+    except Exception:
+        writer.abort()
+        raise
+    return writer.close()
+
+
+def _widen_schema(schema: pa.Schema) -> pa.Schema:
+    """
+    Make the schema derived from the first batch general enough for all batches.
+    Numeric columns are widened as well, as they may be read from a cohort file with
+    an optimized layout (see `optimize_layout`). Indicators keep their `int8` type,
+    as all batches convert them to it (see `feature_types`).
+    """
+    fields = []
+    for field in schema:
+        indicator = feature_types.FEATURE_TYPES.get(field.name) == "indicator"
+        if pa.types.is_null(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        elif pa.types.is_signed_integer(field.type):
+            if not (indicator and pa.types.is_int8(field.type)):
+                field = field.with_type(pa.int64())
+        elif pa.types.is_floating(field.type):
+            field = field.with_type(pa.float64())
+        elif pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+        fields.append(field)
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+def _narrowest_type(column: pa.ChunkedArray) -> pa.DataType:
+    """
+    The narrowest type that holds all values of a signed integer or floating point
+    column without loss. Other columns keep their type.
+    """
+    if pa.types.is_signed_integer(column.type):
+        min_max = pc.min_max(column)
+        low, high = min_max["min"].as_py(), min_max["max"].as_py()
+        if low is None:
+            return column.type
+        for type_ in (pa.int8(), pa.int16(), pa.int32()):
+            bounds = np.iinfo(type_.to_pandas_dtype())
+            if bounds.min <= low and high <= bounds.max:
+                return type_
+        return column.type
+
+    if pa.types.is_float64(column.type):
+        values = column.to_numpy()
+        with np.errstate(over="ignore"):
+            narrowed = values.astype(np.float32).astype(np.float64)
+        if np.array_equal(narrowed, values, equal_nan=True):
+            return pa.float32()
+
+    return column.type
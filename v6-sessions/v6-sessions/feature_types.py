@@ -0,0 +1,340 @@
+"""
+This file contains the declared types of the features in the cohort files.
+
+The database returns the features with the types of the SQL dialect and the driver,
+e.g. the `BIT` indicators of the feature query arrive as logicals, bit strings or
+integers depending on the database. Every feature column therefore has a declared
+type, to which it is converted during the post-processing of the extraction:
+
+indicator
+    A 0/1 flag (e.g. `SURVIVAL_5YR`), stored as `int8`. Indicators with missing
+    values are stored as nullable `Int8`.
+integer
+    A count or identifier (e.g. `AGE`), stored as nullable `Int64`.
+float
+    A measurement (e.g. `TUMOR_SIZE`), stored as `float64`.
+category
+    A categorical variable (e.g. `SEX`), stored as `category`.
+
+Columns that are not declared keep the type they are retrieved with, except that
+text columns are stored as `category`. The resulting types of all columns are
+recorded in the metadata of the Parquet file under `METADATA_KEY`, so that readers
+can rely on them without converting the columns themselves.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from pathlib import Path
+
+from vantage6.algorithm.tools.util import warn
+
+# Key in the Parquet metadata with the types of the columns
+METADATA_KEY = b"v6_feature_types"
+
+# Increase this version when the meaning of the recorded types changes
+TYPES_VERSION = 1
+
+# Types of the features of `sql/sarcoma_features.sql`, by (upper case) column name
+FEATURE_TYPES = {
+    "COHORT_DEFINITION_ID": "integer",
+    "PATIENT_ID": "integer",
+    "AGE": "integer",
+    "AGE_GROUP": "category",
+    "SEX": "category",
+    "CENSOR": "indicator",
+    "PATIENT_STATUS": "category",
+    "SURVIVAL_DAYS": "integer",
+    **{f"SURVIVAL_{year}YR": "indicator" for year in range(1, 11)},
+    **{f"DEATH_{year}YR": "indicator" for year in range(1, 11)},
+    "PRIMARY_DIAGNOSIS": "category",
+    "HISTOLOGY": "category",
+    "SURGERY_YN": "indicator",
+    "SURGERY": "category",
+    "TUMOR_RUPTURE": "indicator",
+    "RESECTION": "category",
+    "COMPLETENESS_OF_RESECTION": "category",
+    "LOCAL_RECURRENCE": "indicator",
+    "DISTANT_METASTASIS": "indicator",
+    "MULTIFOCALITY": "category",
+    "TUMOR_SIZE": "float",
+    "FNCLCC_GRADE": "category",
+    "PRE_OPERATIVE_CHEMO": "indicator",
+    "POST_OPERATIVE_CHEMO": "indicator",
+    "PRE_OPERATIVE_RADIO": "indicator",
+    "POST_OPERATIVE_RADIO": "indicator",
+}
+
+# Text representations of indicator values, as returned by some drivers
+_INDICATOR_TEXT = {"1": 1, "0": 0, "true": 1, "false": 0, "t": 1, "f": 0}
+
+
+def apply_types(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the columns of a data frame with features to their declared types. The
+    columns are converted in place.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The features, with upper case column names.
+
+    Returns
+    -------
+    pd.DataFrame
+        The features with typed columns. A declared column of which the values can
+        not be converted is treated as an undeclared column, and a warning is
+        logged.
+    """
+    for col in df.columns:
+        type_ = FEATURE_TYPES.get(col)
+        if type_ is not None:
+            try:
+                df[col] = _CONVERTERS[type_](df[col])
+                continue
+            except (TypeError, ValueError) as e:
+                warn(f"Column {col} can not be converted to {type_}: {e}")
+        if df[col].dtype == object:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def apply_arrow_types(table: pa.Table) -> pa.Table:
+    """
+    Convert the columns of an Arrow table with features to their declared types, the
+    Arrow equivalent of `apply_types`.
+
+    Parameters
+    ----------
+    table : pa.Table
+        The features, with upper case column names.
+
+    Returns
+    -------
+    pa.Table
+        The features with typed columns: indicators as `int8`, integers as `int64`,
+        floats as `float64` and categories (and undeclared text) as dictionaries.
+    """
+    columns = []
+    for col, values in zip(table.column_names, table.columns):
+        type_ = FEATURE_TYPES.get(col)
+        if type_ is not None:
+            try:
+                columns.append(_ARROW_CONVERTERS[type_](values))
+                continue
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError, ValueError) as e:
+                warn(f"Column {col} can not be converted to {type_}: {e}")
+        if pa.types.is_string(values.type) or pa.types.is_large_string(values.type):
+            values = values.dictionary_encode()
+        columns.append(values)
+    return pa.table(columns, names=table.column_names)
+
+
+def describe_types(df: pd.DataFrame) -> dict[str, str]:
+    """
+    Describe the types of the columns of a data frame, see `apply_types`.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The (typed) features.
+
+    Returns
+    -------
+    dict[str, str]
+        The type of every column: one of the declared types, or "date", "text" or
+        "other" for columns that are not declared.
+    """
+    return {col: _describe_dtype(col, dtype) for col, dtype in df.dtypes.items()}
+
+
+def encode_metadata(df: pd.DataFrame) -> dict[bytes, bytes]:
+    """
+    The Parquet metadata that records the types of the columns of a data frame.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The (typed) features.
+
+    Returns
+    -------
+    dict[bytes, bytes]
+        The metadata entry, to be added to the schema of the Parquet file.
+    """
+    content = {"version": TYPES_VERSION, "columns": describe_types(df)}
+    return {METADATA_KEY: json.dumps(content).encode("utf-8")}
+
+
+def decode_metadata(metadata: dict[bytes, bytes] | None) -> dict[str, str] | None:
+    """
+    Read the types of the columns from the metadata of a Parquet file.
+
+    Parameters
+    ----------
+    metadata : dict[bytes, bytes] | None
+        The metadata of the Parquet schema.
+
+    Returns
+    -------
+    dict[str, str] | None
+        The type of every column, or None when the file has no (current) types.
+    """
+    if not metadata or METADATA_KEY not in metadata:
+        return None
+    content = json.loads(metadata[METADATA_KEY])
+    if content.get("version") != TYPES_VERSION:
+        return None
+    return content["columns"]
+
+
+def read_types(path: str | Path) -> dict[str, str] | None:
+    """
+    Read the types of the columns of a cohort file, without reading the data.
+
+    Parameters
+    ----------
+    path : str | Path
+        Location of the Parquet file.
+
+    Returns
+    -------
+    dict[str, str] | None
+        The type of every column, or None when the file has no (current) types,
+        e.g. when it is extracted before the types were recorded.
+    """
+    return decode_metadata(pq.read_schema(path).metadata)
+
+
+def _to_indicator(values: pd.Series) -> pd.Series:
+    if _is_text(values):
+        text = values.astype(object).map(
+            lambda value: value if pd.isna(value) else str(value).strip().lower()
+        )
+        unknown = set(text.dropna()) - set(_INDICATOR_TEXT)
+        if unknown:
+            raise ValueError(f"unexpected values {sorted(unknown)[:5]}")
+        values = text.map(_INDICATOR_TEXT)
+    numbers = pd.Series(values, dtype="Float64")
+    if not numbers.dropna().isin([0, 1]).all():
+        raise ValueError("values other than 0 and 1")
+    if numbers.isna().any():
+        return numbers.astype("Int8")
+    return numbers.astype(np.int8)
+
+
+def _to_integer(values: pd.Series) -> pd.Series:
+    numbers = pd.to_numeric(values.astype(object) if _is_text(values) else values)
+    return numbers.astype("Int64")
+
+
+def _to_float(values: pd.Series) -> pd.Series:
+    numbers = pd.to_numeric(values.astype(object) if _is_text(values) else values)
+    return numbers.astype("Float64").astype(np.float64)
+
+
+def _to_category(values: pd.Series) -> pd.Series:
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values
+    return values.astype("category")
+
+
+def _is_text(values: pd.Series) -> bool:
+    return values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype)
+
+
+def _arrow_to_indicator(values: pa.ChunkedArray) -> pa.ChunkedArray:
+    if _is_arrow_text(values.type):
+        text = pc.utf8_lower(pc.utf8_trim_whitespace(_arrow_to_text(values)))
+        known = pc.is_in(text, value_set=pa.array(list(_INDICATOR_TEXT)))
+        unknown = pc.filter(text, pc.invert(known)).unique()
+        if len(unknown):
+            raise ValueError(f"unexpected values {sorted(unknown.to_pylist())[:5]}")
+        ones = [text for text, value in _INDICATOR_TEXT.items() if value == 1]
+        values = pc.if_else(
+            pc.is_null(text), None, pc.is_in(text, value_set=pa.array(ones))
+        )
+    numbers = pc.cast(values, pa.float64())
+    if not pc.all(
+        pc.is_in(numbers.drop_null(), value_set=pa.array([0.0, 1.0]))
+    ).as_py():
+        raise ValueError("values other than 0 and 1")
+    return pc.cast(numbers, pa.int8())
+
+
+def _arrow_to_integer(values: pa.ChunkedArray) -> pa.ChunkedArray:
+    if _is_arrow_text(values.type):
+        values = pc.cast(_arrow_to_text(values), pa.float64())
+    return pc.cast(values, pa.int64())
+
+
+def _arrow_to_float(values: pa.ChunkedArray) -> pa.ChunkedArray:
+    if _is_arrow_text(values.type):
+        values = _arrow_to_text(values)
+    return pc.cast(values, pa.float64())
+
+
+def _arrow_to_category(values: pa.ChunkedArray) -> pa.ChunkedArray:
+    if pa.types.is_dictionary(values.type):
+        return values
+    return values.dictionary_encode()
+
+
+def _arrow_to_text(values: pa.ChunkedArray) -> pa.ChunkedArray:
+    if pa.types.is_dictionary(values.type):
+        values = pc.cast(values, values.type.value_type)
+    return pc.cast(values, pa.string())
+
+
+def _is_arrow_text(type_: pa.DataType) -> bool:
+    return (
+        pa.types.is_string(type_)
+        or pa.types.is_large_string(type_)
+        or pa.types.is_dictionary(type_)
+    )
+
+
+def _describe_dtype(col: str, dtype) -> str:
+    declared = FEATURE_TYPES.get(col)
+    if declared is not None and _describe_dtype(None, dtype) in _COMPATIBLE[declared]:
+        return declared
+    if isinstance(dtype, pd.CategoricalDtype):
+        return "category"
+    if pd.api.types.is_bool_dtype(dtype):
+        return "indicator"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "integer"
+    if pd.api.types.is_float_dtype(dtype):
+        return "float"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "date"
+    if dtype == object:
+        return "text"
+    return "other"
+
+
+_CONVERTERS = {
+    "indicator": _to_indicator,
+    "integer": _to_integer,
+    "float": _to_float,
+    "category": _to_category,
+}
+
+_ARROW_CONVERTERS = {
+    "indicator": _arrow_to_indicator,
+    "integer": _arrow_to_integer,
+    "float": _arrow_to_float,
+    "category": _arrow_to_category,
+}
+
+# Types of undeclared columns that hold the values of a declared type
+_COMPATIBLE = {
+    "indicator": ("indicator", "integer"),
+    "integer": ("integer",),
+    "float": ("float",),
+    "category": ("category",),
+}
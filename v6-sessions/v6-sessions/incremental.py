@@ -0,0 +1,183 @@
+"""
+This file contains the helpers for the incremental refresh of a cohort.
+
+The features of a patient only change when the cohort dates or the source data of the
+patient change. When a cohort is created with `refresh=True`, a version of the
+source data of each patient (see `sql/person_versions.sql`) is stored next to the
+cohort file. On the next refresh the versions are queried again, and only the patients
+that are new or whose version differs are extracted. Their rows are then merged into
+the existing cohort file, and the rows of patients that left the cohort are removed.
+
+Changes to the vocabulary (e.g. concept names) are not detected, after a vocabulary
+update the cohort should be extracted in full.
+"""
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from pathlib import Path
+
+from vantage6.algorithm.tools.util import info
+
+from . import companion_files
+from . import extraction
+
+# Template of the query that retrieves the version of each patient in a cohort
+VERSIONS_SQL = "sql/person_versions.sql"
+
+# Key in the Parquet metadata of the versions file with the content hash of the cohort
+# file the versions belong to
+CONTENT_HASH_KEY = b"cohort_content_hash"
+
+# When more than this fraction of the patients is new or changed, the cohort is
+# extracted in full, as merging the changes no longer saves work.
+MAX_CHANGED_FRACTION = 0.5
+
+
+def write_versions(path: str | Path, versions: pd.DataFrame, content_hash: str) -> None:
+    """
+    Store the patient versions of a cohort file.
+
+    Parameters
+    ----------
+    path : str | Path
+        Location of the Parquet file of the cohort.
+    versions : pd.DataFrame
+        The versions, with a `PATIENT_ID` column.
+    content_hash : str
+        Content hash of the cohort file, so that the versions are only used for the
+        cohort file they are created for.
+    """
+    table = pa.Table.from_pandas(versions, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), CONTENT_HASH_KEY: content_hash.encode()}
+    )
+    target = companion_files.versions_path(path)
+    tmp_path = target.with_name(f"{target.name}.tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def read_versions(path: str | Path, content_hash: str | None) -> pd.DataFrame | None:
+    """
+    Read the patient versions of a cohort file.
+
+    Parameters
+    ----------
+    path : str | Path
+        Location of the Parquet file of the cohort.
+    content_hash : str | None
+        The current content hash of the cohort file.
+
+    Returns
+    -------
+    pd.DataFrame | None
+        The versions, or None when there are no versions for the current content of
+        the cohort file.
+    """
+    target = companion_files.versions_path(path)
+    if content_hash is None or not target.exists():
+        return None
+    table = pq.read_table(target)
+    if (table.schema.metadata or {}).get(CONTENT_HASH_KEY) != content_hash.encode():
+        info(f"Patient versions in {target} are outdated")
+        return None
+    return table.to_pandas()
+
+
+def diff_versions(previous: pd.DataFrame, current: pd.DataFrame) -> tuple[set, set]:
+    """
+    Compare the patient versions of the previous extraction with the current ones.
+
+    Parameters
+    ----------
+    previous : pd.DataFrame
+        The versions stored with the cohort file.
+    current : pd.DataFrame
+        The versions queried from the database.
+
+    Returns
+    -------
+    tuple[set, set]
+        The IDs of the patients that are new or changed, and the IDs of the patients
+        that are no longer in the cohort.
+    """
+    previous = _normalize_versions(previous)
+    current = _normalize_versions(current)
+
+    removed = set(previous.index) - set(current.index)
+    common = current.index.intersection(previous.index)
+    columns = current.columns.intersection(previous.columns)
+    if len(columns) != len(current.columns):
+        # The version query changed, so the versions can not be compared
+        return set(current.index), removed
+
+    differs = current.loc[common, columns].ne(previous.loc[common, columns])
+    differs = differs.any(axis=1)
+    changed = set(current.index.difference(previous.index)) | set(common[differs])
+    return changed, removed
+
+
+def merge_cohort(
+    path: str | Path,
+    delta: pd.DataFrame | None,
+    dropped_patients: set,
+    batch_size: int = extraction.DEFAULT_BATCH_SIZE,
+) -> int:
+    """
+    Merge the features of new and changed patients into an existing cohort file.
+
+    The existing file is read in batches, the rows of `dropped_patients` are left out
+    and the rows of `delta` are appended. The file is replaced atomically.
+
+    Parameters
+    ----------
+    path : str | Path
+        Location of the Parquet file of the cohort.
+    delta : pd.DataFrame | None
+        The features of the new and changed patients, None when there are none.
+    dropped_patients : set
+        The IDs of the patients whose rows are removed from the file, i.e. the changed
+        patients and the patients that left the cohort.
+    batch_size : int
+        Number of rows that are read from the existing file at once.
+
+    Returns
+    -------
+    int
+        The number of rows in the merged file.
+    """
+    dropped_patients = list(dropped_patients)
+
+    def batches():
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            df = batch.to_pandas()
+            yield df[~df["PATIENT_ID"].isin(dropped_patients)]
+        if delta is not None:
+            yield delta
+
+    return extraction.write_batches_to_parquet(batches(), path)
+
+
+def _normalize_versions(versions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Index the versions by patient and convert the values to strings, so that the
+    versions compare equal independent of the dtypes they are stored with. Patients
+    with multiple records in the cohort table are reduced to a single version.
+    """
+    normalized = pd.DataFrame(
+        {
+            col: versions[col].map(lambda value: "" if pd.isna(value) else str(value))
+            for col in versions.columns
+            if col != "PATIENT_ID"
+        }
+    )
+    normalized.insert(0, "PATIENT_ID", versions["PATIENT_ID"])
+    return (
+        normalized.sort_values(list(normalized.columns))
+        .drop_duplicates("PATIENT_ID", keep="first")
+        .set_index("PATIENT_ID")
+    )
@@ -0,0 +1,376 @@
+"""
+This file contains the instrumentation of the extraction pipeline.
+
+Every step of the pipeline (building the cohort SQL, generating the cohorts,
+rendering and translating the feature query, querying the database, converting the
+result from R, post-processing and writing the file) is measured as a stage. For
+every stage the wall time, the peak resident set size (RSS) of the process and the
+number of rows that go in and out are recorded.
+
+Stages are only recorded within a recording:
+
+    with instrumentation.recording() as recording:
+        with instrumentation.stage("query") as stage:
+            data_r = database_connector.query_sql(connection, sql)
+            stage.rows_out = data_r.nrow
+
+    recording.entries()
+
+Algorithm functions are decorated with `instrumented`, which records the stages of
+the function and adds them to its result. Outside a recording, `stage` does
+nothing. Stages can be nested, a stage inherits the labels (e.g. the cohort name) of
+the stage it runs in. A stage that runs more than once in the same place (e.g. once
+per batch) is reported as a single entry with the total wall time and rows, and the
+number of calls.
+
+The peak RSS of a stage is read from the high water mark of the process, which is
+reset at the start of every stage when the kernel allows it. Otherwise, the peak RSS
+is the peak of the process up to the end of the stage. The embedded R session runs in
+the same process, so its memory is included.
+"""
+import os
+import json
+import time
+import datetime
+import resource
+import functools
+
+from typing import Callable
+from pathlib import Path
+from contextlib import contextmanager
+
+from vantage6.algorithm.tools.util import info
+
+# Precision of the reported wall times (seconds) and memory (MB)
+TIME_DECIMALS = 4
+MEMORY_DECIMALS = 1
+
+# Fields of a recorded stage that are not labels
+_ENTRY_FIELDS = (
+    "stage",
+    "parent",
+    "calls",
+    "wall_time",
+    "peak_rss_mb",
+    "rows_in",
+    "rows_out",
+)
+
+# Open recordings and stages of this process, innermost last
+_recordings = []
+_open_stages = []
+
+# Whether the high water mark of the RSS can be reset, see `_reset_peak_rss`
+_can_reset_peak_rss = True
+
+
+class Stage:
+    """
+    A single run of a stage. The rows that go in and out of the stage can be set by
+    the code that runs in the stage.
+
+    Attributes
+    ----------
+    name : str
+        Name of the stage.
+    labels : dict
+        Labels of the stage, including the labels of the enclosing stages.
+    rows_in : int | None
+        Number of rows that the stage received.
+    rows_out : int | None
+        Number of rows that the stage produced.
+    """
+
+    def __init__(self, name: str, labels: dict, parent: str | None):
+        self.name = name
+        self.labels = labels
+        self.parent = parent
+        self.rows_in = None
+        self.rows_out = None
+        self.peak_rss = 0
+
+    def _key(self) -> tuple:
+        return (self.name, self.parent, tuple(sorted(self.labels.items())))
+
+
+class Recording:
+    """
+    The stages that are recorded while the recording is open, see `recording`.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def add(self, stage: Stage, wall_time: float) -> None:
+        """
+        Add a run of a stage, combined with the earlier runs of the same stage.
+        """
+        entry = self._entries.setdefault(
+            stage._key(),
+            {
+                "stage": stage.name,
+                **stage.labels,
+                "parent": stage.parent,
+                "calls": 0,
+                "wall_time": 0.0,
+                "peak_rss_mb": 0.0,
+                "rows_in": None,
+                "rows_out": None,
+            },
+        )
+        entry["calls"] += 1
+        entry["wall_time"] = round(entry["wall_time"] + wall_time, TIME_DECIMALS)
+        entry["peak_rss_mb"] = max(
+            entry["peak_rss_mb"], round(stage.peak_rss / 1024, MEMORY_DECIMALS)
+        )
+        for field in ("rows_in", "rows_out"):
+            rows = getattr(stage, field)
+            if rows is not None:
+                entry[field] = (entry[field] or 0) + int(rows)
+
+    def merge(self, entries: list[dict]) -> None:
+        """
+        Add entries that are recorded elsewhere, e.g. in a worker process.
+        """
+        for entry in entries:
+            labels = {k: v for k, v in entry.items() if k not in _ENTRY_FIELDS}
+            key = (entry["stage"], entry["parent"], tuple(sorted(labels.items())))
+            if key not in self._entries:
+                self._entries[key] = dict(entry)
+                continue
+            existing = self._entries[key]
+            existing["calls"] += entry["calls"]
+            existing["wall_time"] = round(
+                existing["wall_time"] + entry["wall_time"], TIME_DECIMALS
+            )
+            existing["peak_rss_mb"] = max(existing["peak_rss_mb"], entry["peak_rss_mb"])
+            for field in ("rows_in", "rows_out"):
+                if entry[field] is not None:
+                    existing[field] = (existing[field] or 0) + entry[field]
+
+    def entries(self, **labels) -> list[dict]:
+        """
+        The recorded stages, in the order in which they first started.
+
+        Parameters
+        ----------
+        **labels
+            Only include the stages with these labels, and the stages that do not
+            have these labels at all (e.g. the stages that are shared by all
+            cohorts).
+
+        Returns
+        -------
+        list[dict]
+            For every stage its name, labels, the name of the enclosing stage, the
+            number of calls, the total wall time in seconds, the peak RSS in MB and
+            the total number of rows in and out (None when not known).
+        """
+        return [
+            dict(entry)
+            for entry in self._entries.values()
+            if all(entry.get(k, v) == v for k, v in labels.items())
+        ]
+
+    def durations(self) -> dict[str, float]:
+        """
+        The wall time in seconds of the top level stages, by stage name. The wall
+        times of top level stages with the same name but different labels (e.g. one
+        per cohort) are summed.
+        """
+        durations = {}
+        for entry in self._entries.values():
+            if entry["parent"] is None:
+                name = entry["stage"]
+                durations[name] = round(
+                    durations.get(name, 0.0) + entry["wall_time"], TIME_DECIMALS
+                )
+        return durations
+
+    def write(self, path: str | Path, **labels) -> None:
+        """
+        Write the recorded stages to a JSON file. The file is written to a temporary
+        file first, so that readers never see a partially written log.
+
+        Parameters
+        ----------
+        path : str | Path
+            Location of the JSON file.
+        **labels
+            Only write the stages with these labels, see `entries`.
+        """
+        path = Path(path)
+        content = {
+            "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            **labels,
+            "stages": self.entries(**labels),
+        }
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_text(json.dumps(content, indent=2, default=str), "utf-8")
+        os.replace(tmp_path, path)
+        info(f"Written the timing log to {path}")
+
+
+@contextmanager
+def recording():
+    """
+    Record the stages that run within the context.
+
+    Yields
+    ------
+    Recording
+        The recording, which holds the stages once they are finished.
+    """
+    recording_ = Recording()
+    _recordings.append(recording_)
+    try:
+        yield recording_
+    finally:
+        _recordings.remove(recording_)
+
+
+def instrumented(func: Callable) -> Callable:
+    """
+    Decorator that records the stages of an algorithm function.
+
+    When the function returns a dictionary, the recorded stages are added to it as
+    `stages` and the wall time of the top level stages as `timings`. Use this
+    decorator below the vantage6 decorators, so that it receives the result of the
+    function itself.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with recording() as recording_:
+            result = func(*args, **kwargs)
+        if isinstance(result, dict):
+            result = {
+                **result,
+                "timings": recording_.durations(),
+                "stages": recording_.entries(),
+            }
+        return result
+
+    return wrapper
+
+
+def current() -> Recording | None:
+    """
+    The innermost open recording, or None when nothing is recorded.
+    """
+    return _recordings[-1] if _recordings else None
+
+
+@contextmanager
+def stage(name: str, rows_in: int | None = None, **labels):
+    """
+    Measure a stage of the pipeline in the current recording.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage.
+    rows_in : int | None
+        Number of rows that the stage receives, if known upfront.
+    **labels
+        Labels of the stage, e.g. `cohort="x"`. These are inherited by the stages
+        that run within this stage.
+
+    Yields
+    ------
+    Stage
+        The stage, on which `rows_in` and `rows_out` can be set.
+    """
+    parent = _open_stages[-1] if _open_stages else None
+    if parent is not None:
+        labels = {**parent.labels, **labels}
+    stage_ = Stage(name, labels, parent.name if parent else None)
+    stage_.rows_in = rows_in
+    if not _recordings:
+        yield stage_
+        return
+
+    # The high water mark is reset below, so fold it into the open stages first
+    peak_rss = _read_peak_rss()
+    for open_stage in _open_stages:
+        open_stage.peak_rss = max(open_stage.peak_rss, peak_rss)
+    _reset_peak_rss()
+
+    _open_stages.append(stage_)
+    start = time.perf_counter()
+    try:
+        yield stage_
+    finally:
+        wall_time = time.perf_counter() - start
+        _open_stages.pop()
+        stage_.peak_rss = max(stage_.peak_rss, _read_peak_rss())
+        _recordings[-1].add(stage_, wall_time)
+
+
+def merge(entries: list[dict]) -> None:
+    """
+    Add entries that are recorded elsewhere (e.g. in a worker process) to the
+    current recording, if any. The top level entries are added to the current stage.
+
+    Parameters
+    ----------
+    entries : list[dict]
+        The entries, see `Recording.entries`.
+    """
+    if not _recordings:
+        return
+    parent = _open_stages[-1] if _open_stages else None
+    if parent is not None:
+        entries = [
+            {**parent.labels, **entry, "parent": entry["parent"] or parent.name}
+            for entry in entries
+        ]
+    _recordings[-1].merge(entries)
+
+
+def log_path(path: str | Path) -> Path:
+    """
+    Location of the timing log of an output file.
+
+    Parameters
+    ----------
+    path : str | Path
+        Location of the output file, e.g. `/mnt/data/cohort_x.parquet`.
+
+    Returns
+    -------
+    Path
+        Location of the timing log, e.g. `/mnt/data/cohort_x.timings.json`.
+    """
+    path = Path(path)
+    return path.with_name(f"{path.stem}.timings.json")
+
+
+def _read_peak_rss() -> int:
+    """
+    The high water mark of the RSS of this process in kB.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # On Linux, `ru_maxrss` is in kB as well
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _reset_peak_rss() -> None:
+    """
+    Reset the high water mark of the RSS of this process to the current RSS. This is
+    supported by Linux, but may not be allowed in every container.
+    """
+    global _can_reset_peak_rss
+    if not _can_reset_peak_rss:
+        return
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        _can_reset_peak_rss = False
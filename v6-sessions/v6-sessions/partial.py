@@ -14,15 +14,14 @@ import pandas as pd
 import numpy as np
 
 from typing import Any
+from pathlib import Path
 
 from rpy2.robjects import RS4
-from rpy2.rinterface_lib.sexp import NACharacterType
 
-from ohdsi.sqlrender import render, translate, read_sql
+from ohdsi.sqlrender import render, translate
 from ohdsi.database_connector import query_sql
-from ohdsi.common import convert_from_r
 
-from vantage6.algorithm.tools.util import info, error
+from vantage6.algorithm.tools.util import info, error, warn
 from vantage6.algorithm.tools.decorators import (
     OHDSIMetaData,
     RunMetaData,
@@ -30,9 +29,16 @@ from vantage6.algorithm.tools.decorators import (
     database_connection,
 )
 
+from . import cache
+from . import extraction
+from . import instrumentation
+from . import sql_templates
+from .conversion import convert_from_r
+
 
 @metadata
 @database_connection(types=["OMOP"], include_metadata=True)
+@instrumentation.instrumented
 def partial(
     connection: RS4,
     meta_omop: OHDSIMetaData,
@@ -40,28 +46,89 @@ def partial(
     database_label: str,
     cohort_id: float,
     cohort_task_id: int,
+    engine: str = "auto",
+    batch_size: int = extraction.DEFAULT_BATCH_SIZE,
+    timing_log: bool = False,
+    output_format: str | None = None,
 ) -> Any:
     """
-    Obtain the cohort from the database and store it over the CSV file.
-    """
-    info("Obtaining the cohort from the database")
-    df = __create_cohort_dataframe(
-        connection, meta_run, meta_omop, cohort_task_id, cohort_id
-    )
+    Obtain the cohort from the database and store it over the file of the database
+    with label `database_label`.
+
+    The cohort is read from the cohort table of the `create_cohort` task with ID
+    `cohort_task_id` in the results schema. This table must still exist: it is
+    dropped when `create_cohort` is run with `keep_cohort_tables=False`, or by
+    `cohort.purge_stale_cohort_tables`.
+
+    The `engine` and `batch_size` arguments determine how the cohort is retrieved
+    from the database, see `cohort.create_cohort`. The recorded stages are reported
+    in the result and, when `timing_log` is True, written to a JSON file next to the
+    file, see `instrumentation`.
 
-    # Save the data to a CSV file
+    The `output_format` is one of `extraction.OUTPUT_FORMATS`: "csv", "parquet" or
+    "feather" (Arrow IPC). By default the type of the database in the node
+    configuration is used when it is one of these, and "csv" otherwise. The file is
+    written in batches to a temporary file which then replaces the existing file, so
+    that readers never see a partially written file.
+    """
+    # Check the environment variables before the (expensive) query is executed
     info("Checking environment variables")
-    csv_uri_env_var = f"{database_label.upper()}_DATABASE_URI"
-    if csv_uri_env_var not in os.environ:
-        error(f"Environment variable {csv_uri_env_var} not set")
+    uri_env_var = f"{database_label.upper()}_DATABASE_URI"
+    if uri_env_var not in os.environ:
+        error(f"Environment variable {uri_env_var} not set")
         return {"error": "Environment variable not set"}
+    database_uri = os.environ[uri_env_var]
+
+    if output_format is None:
+        database_type = os.environ.get(f"{database_label.upper()}_DATABASE_TYPE", "")
+        output_format = database_type.lower()
+        if output_format not in extraction.OUTPUT_FORMATS:
+            output_format = "csv"
+    if output_format not in extraction.OUTPUT_FORMATS:
+        error(f"Unknown output format: {output_format}")
+        return {"error": f"Unknown output format '{output_format}'"}
+
+    cohort_table = f"cohort_{cohort_task_id}_{meta_run.node_id}"
+    engine = extraction.resolve_engine(
+        engine,
+        connection,
+        f"{meta_omop.results_schema}.{cohort_table}",
+        float(cohort_id),
+        meta_omop.dbms,
+    )
 
-    info(f"Overwriting '{database_label}' CSV file")
-    csv_uri = os.environ[csv_uri_env_var]
-    df.to_csv(csv_uri, index=False)
+    if engine in extraction.BATCH_ENGINES:
+        info(f"Overwriting '{database_label}' {output_format} file in batches")
+        with instrumentation.stage("extract"):
+            __extract_cohort_to_file(
+                connection,
+                meta_run,
+                meta_omop,
+                cohort_task_id,
+                cohort_id,
+                database_uri,
+                output_format,
+                engine,
+                batch_size,
+            )
+    else:
+        info("Obtaining the cohort from the database")
+        with instrumentation.stage("extract"):
+            df = __create_cohort_dataframe(
+                connection, meta_run, meta_omop, cohort_task_id, cohort_id
+            )
+
+            info(f"Overwriting '{database_label}' {output_format} file")
+            extraction.write_batches([df], database_uri, output_format)
+
+    if timing_log:
+        try:
+            instrumentation.current().write(instrumentation.log_path(database_uri))
+        except Exception as e:
+            warn(f"Failed to write the timing log: {e}")
 
     info("Done!")
-    return {"msg": f"Overwritten '{database_label}' CSV file"}
+    return {"msg": f"Overwritten '{database_label}' {output_format} file"}
 
 
 def __create_cohort_dataframe(
@@ -95,47 +162,115 @@ def __create_cohort_dataframe(
     # TODO: Check if this is correct
     cohort_id = float(shared_cohort_id)
 
+    raw_sql = __read_features_sql()
+
+    info("Start query sequence the database")
+    df = _query_database(connection, raw_sql, cohort_table, cohort_id, meta_omop)
+
+    # R NA values are already converted to nulls by `convert_from_r`
+    info("Post-processing the data")
+
+    # DROP DUPLICATES, the query already returns a single row per subject so this is
+    # only a safety net
+    with instrumentation.stage("post_process", rows_in=len(df)) as stage:
+        sub_df = df.drop_duplicates("SUBJECT_ID", keep="first")
+        stage.rows_out = len(sub_df)
+    if len(sub_df) < len(df):
+        warn(f"Dropped {len(df) - len(sub_df)} duplicate rows")
+
+    return sub_df
+
+
+def __extract_cohort_to_file(
+    connection: RS4,
+    meta_run: RunMetaData,
+    meta_omop: OHDSIMetaData,
+    cohort_task_id: int,
+    shared_cohort_id: str,
+    path: str,
+    output_format: str,
+    engine: str,
+    batch_size: int,
+) -> int:
+    """
+    Query the database for the data of the cohort and write it in batches to a file
+    in `output_format`, see `extraction.write_batches`.
+
+    The post-processing of `__create_cohort_dataframe` is applied per batch.
+    Subjects that are already written in an earlier batch are dropped.
+
+    Returns
+    -------
+    int
+        The number of rows written.
+    """
+    cohort_table = f"cohort_{cohort_task_id}_{meta_run.node_id}"
+    info(f"Using cohort table: {cohort_table}")
+    cohort_id = float(shared_cohort_id)
+    info(f"Using cohort ID: {cohort_id}")
+
+    raw_sql = __read_features_sql()
+    sql = _render_features_sql(raw_sql, cohort_table, cohort_id, meta_omop)
+
+    seen_subjects = set()
+
+    def post_process(df: pd.DataFrame) -> pd.DataFrame:
+        # DROP DUPLICATES, also over batches (only a safety net)
+        with instrumentation.stage("post_process", rows_in=len(df)) as stage:
+            sub_df = df.drop_duplicates("SUBJECT_ID", keep="first")
+            sub_df = sub_df[~sub_df["SUBJECT_ID"].isin(seen_subjects)]
+            seen_subjects.update(sub_df["SUBJECT_ID"])
+            stage.rows_out = len(sub_df)
+        if len(sub_df) < len(df):
+            warn(f"Dropped {len(df) - len(sub_df)} duplicate rows")
+        return sub_df
+
+    batches = extraction.query_batches(connection, sql, engine, batch_size)
+    n_rows = extraction.write_batches(
+        (post_process(df) for df in batches), path, output_format
+    )
+    info(f"Extracted {n_rows} rows to {path}")
+    return n_rows
+
+
+def __features_sql_path() -> str:
     # Obtain SQL file for standard features
-    sql_path = pkg_resources.resource_filename(
+    return pkg_resources.resource_filename(
         "v6-ohdsi-update-csv", "sql/standard_features.sql"
     )
 
-    # SQL READ
+
+def __read_features_sql() -> str:
+    """
+    Read the SQL file that contains the standard feature query.
+
+    Returns
+    -------
+    str
+        The (unrendered) SQL.
+    """
+    sql_path = __features_sql_path()
+
+    # SQL READ, the file is read in Python as SqlRender's `read_sql` only reads the
+    # file as well
     try:
-        raw_sql = read_sql(sql_path)
+        raw_sql = Path(sql_path).read_text(encoding="utf-8")
     except Exception as e:
         error(f"Failed to read SQL file: {e}")
         traceback.print_exc()
         raise e
     info(f"Read SQL file: {sql_path}")
-
-    info("Start query sequence the database")
-    df = _query_database(connection, raw_sql, cohort_table, cohort_id, meta_omop)
-
-    info("Post-processing the data")
-    df["OBSERVATION_VAS"] = df["OBSERVATION_VAS"].apply(
-        lambda val: np.nan if isinstance(val, NACharacterType) else val
-    )
-
-    # DROP DUPLICATES
-    sub_df = df.drop_duplicates("SUBJECT_ID", keep="first")
-    info(f"Dropped {len(df) - len(sub_df)} rows")
-
-    return sub_df
+    return raw_sql
 
 
-def _query_database(
-    connection: RS4,
+def _render_features_sql(
     sql: str,
     cohort_table: str,
     cohort_id: float,
     meta_omop: OHDSIMetaData,
-) -> pd.DataFrame:
+) -> str:
 
-    # RENDER
-    info("Rendering the SQL")
-    sql = render(
-        sql,
+    parameters = dict(
         cohort_table=f"{meta_omop.results_schema}.{cohort_table}",
         cohort_id=cohort_id,
         cdm_database_schema=meta_omop.cdm_schema,
@@ -144,16 +279,57 @@ def _query_database(
         incl_measurement_concept_id=["NULL"],
         incl_drug_concept_id=["NULL"],  #'ALL' ? @TODO in algo
     )
+    templated_parameters = sql_templates.with_sentinels(parameters)
 
-    # TRANSLATE
-    info("Translating the SQL")
-    sql = translate(sql, target_dialect="postgresql")
+    def render_and_translate() -> str:
+        # RENDER
+        info("Rendering the SQL")
+        with instrumentation.stage("render"):
+            rendered_sql = render(sql, **templated_parameters)
+
+        # TRANSLATE
+        info("Translating the SQL")
+        with instrumentation.stage("translate"):
+            return translate(
+                rendered_sql, target_dialect=sql_templates.TARGET_DIALECT
+            )
+
+    # Use the SQL that is translated when the image was built, if available
+    with instrumentation.stage("render_pretranslated"):
+        translated_sql = sql_templates.render_pretranslated(
+            __features_sql_path(), sql, parameters, sql_templates.TARGET_DIALECT
+        )
+    if translated_sql is not None:
+        return translated_sql
+
+    # The rendered and translated SQL only depends on the template and parameters,
+    # so it is cached to avoid the calls to SqlRender. It is rendered with sentinels
+    # for the values that differ per task, so that the cached SQL is shared between
+    # tasks.
+    key = cache.fingerprint(sql, templated_parameters, sql_templates.TARGET_DIALECT)
+    sql = sql_templates.bind_sentinels(
+        cache.get_or_create("render", key, render_and_translate), parameters
+    )
     info(sql)
+    return sql
+
+
+def _query_database(
+    connection: RS4,
+    sql: str,
+    cohort_table: str,
+    cohort_id: float,
+    meta_omop: OHDSIMetaData,
+) -> pd.DataFrame:
+
+    sql = _render_features_sql(sql, cohort_table, cohort_id, meta_omop)
 
     # QUERY
     info("Querying the database")
     try:
-        data_r = query_sql(connection, sql)
+        with instrumentation.stage("query") as stage:
+            data_r = query_sql(connection, sql)
+            stage.rows_out = data_r.nrow
     except Exception as e:
         error(f"Failed to query the database: {e}")
         traceback.print_exc()
@@ -0,0 +1,236 @@
+"""
+This file contains the projection of the feature query on feature groups.
+
+The feature query (see `sql/sarcoma_features.sql`) computes every feature block in
+its own CTE, which is joined to the `person` CTE in the final select. A study often
+only needs some of these blocks. When `create_cohort` is called with
+`feature_groups`, the CTEs of the other groups are removed from the rendered query,
+together with their joins and output columns, so that the database does not compute
+them and the cohort file only holds the requested features:
+
+    sql = projection.project(sql, ["survival", "treatment"])
+
+The projection works on the rendered and translated query, so the pre-translated
+SQL (see `sql_templates`) is used regardless of the requested groups. CTEs of which
+a remaining CTE selects are kept, e.g. `primary_tumor` is always computed when the
+treatment features are requested.
+"""
+import re
+
+from . import staging
+
+# The CTEs of the feature query that make up each feature group
+FEATURE_GROUPS = {
+    "demographics": ("person",),
+    "survival": ("death", "survival", "survival_death"),
+    "tumor": (
+        "primary_tumor",
+        "histo_group",
+        "tumor_rupture",
+        "focality",
+        "tumor_size",
+        "tumor_grade",
+    ),
+    "surgery": ("surgery", "resection"),
+    "progression": ("recurrence", "metastasis"),
+    "treatment": ("pre_chemo", "post_chemo", "pre_radio", "post_radio"),
+}
+
+# CTE from which the final select starts, which is always kept
+BASE_CTE = "person"
+
+# Output columns that are always kept, as they identify the rows
+KEY_COLUMNS = ("PATIENT_ID", "COHORT_DEFINITION_ID")
+
+# Clauses of the final select after the FROM keyword
+_CLAUSE_PATTERN = re.compile(
+    r"\b(LEFT\s+JOIN|INNER\s+JOIN|JOIN|WHERE|GROUP\s+BY|ORDER\s+BY)\b", re.IGNORECASE
+)
+
+
+def normalize_groups(feature_groups: list[str] | None) -> list[str] | None:
+    """
+    Validate the requested feature groups.
+
+    Parameters
+    ----------
+    feature_groups : list[str] | None
+        Names of the feature groups, see `FEATURE_GROUPS`. None for all features.
+
+    Returns
+    -------
+    list[str] | None
+        The sorted unique names of the groups, or None when all groups are
+        requested.
+
+    Raises
+    ------
+    ValueError
+        When one of the groups is unknown.
+    """
+    if feature_groups is None:
+        return None
+    if isinstance(feature_groups, str):
+        feature_groups = [feature_groups]
+    unknown = set(feature_groups) - set(FEATURE_GROUPS)
+    if unknown:
+        raise ValueError(
+            f"Unknown feature group(s) {sorted(unknown)}, available groups are "
+            f"{list(FEATURE_GROUPS)}"
+        )
+    groups = sorted(set(feature_groups))
+    return None if groups == sorted(FEATURE_GROUPS) else groups
+
+
+def project(sql: str, feature_groups: list[str] | None) -> str:
+    """
+    Remove the CTEs, joins and output columns of the feature groups that are not
+    requested from the feature query.
+
+    Parameters
+    ----------
+    sql : str
+        The rendered and translated feature query.
+    feature_groups : list[str] | None
+        Names of the requested feature groups. None to keep all features.
+
+    Returns
+    -------
+    str
+        The projected query.
+    """
+    if feature_groups is None:
+        return sql
+
+    selected = {BASE_CTE}
+    for group in feature_groups:
+        selected.update(FEATURE_GROUPS[group])
+    enabled = {
+        cte for cte in selected if cte != BASE_CTE or "demographics" in feature_groups
+    }
+
+    ctes, final_select = staging.split_ctes(sql)
+    bodies = dict(ctes)
+    columns, from_item, clauses = _split_select(final_select)
+
+    columns = [
+        column
+        for column in columns
+        if _output_name(column) in KEY_COLUMNS or _referenced(column, bodies) <= enabled
+    ]
+    clauses = [
+        clause
+        for clause in clauses
+        if not _is_join(clause) or _referenced(clause, bodies) <= selected
+    ]
+
+    # Keep the CTEs that the final select uses, and the CTEs these select from
+    required = _referenced(from_item + " ".join(columns + clauses), bodies)
+    pending = list(required)
+    while pending:
+        for name in _selected_from(bodies[pending.pop()], bodies):
+            if name not in required:
+                required.add(name)
+                pending.append(name)
+
+    with_clause = ",\n".join(
+        f"{name} AS (\n{body}\n)" for name, body in ctes if name in required
+    )
+    return (
+        f"WITH {with_clause}\nSELECT\n"
+        + ",\n".join(columns)
+        + f"\nFROM {from_item}\n"
+        + "\n".join(clauses)
+    )
+
+
+def _split_select(sql: str) -> tuple[list[str], str, list[str]]:
+    """
+    Split the final select into its output columns, the item after FROM and the
+    following clauses (joins, WHERE etc).
+    """
+    if not re.match(r"SELECT\b", sql, re.IGNORECASE):
+        raise ValueError("Final select of the query does not start with SELECT")
+    parts = _split_top_level(sql[len("SELECT") :], re.compile(r"\bFROM\b", re.I))
+    if len(parts) != 2:
+        raise ValueError("Final select of the query has no single top-level FROM")
+    select_list, from_clause = parts
+
+    columns = [
+        column.strip()
+        for column in _split_top_level(select_list, re.compile(","))
+        if column.strip()
+    ]
+    segments = _split_top_level(from_clause, _CLAUSE_PATTERN, keep_separator=True)
+    return columns, segments[0].strip(), [segment.strip() for segment in segments[1:]]
+
+
+def _split_top_level(
+    sql: str, separator: re.Pattern, keep_separator: bool = False
+) -> list[str]:
+    """
+    Split SQL on a separator that occurs outside parentheses, string literals and
+    comments.
+    """
+    parts, depth, start, pos = [], 0, 0, 0
+    while pos < len(sql):
+        char = sql[pos]
+        if sql.startswith("--", pos):
+            end = sql.find("\n", pos)
+            pos = len(sql) if end == -1 else end + 1
+            continue
+        if sql.startswith("/*", pos):
+            end = sql.find("*/", pos + 2)
+            pos = len(sql) if end == -1 else end + 2
+            continue
+        if char in ("'", '"'):
+            end = sql.find(char, pos + 1)
+            pos = len(sql) if end == -1 else end + 1
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif depth == 0:
+            match = separator.match(sql, pos)
+            # Only split on keywords at the start of a word
+            if match and not (_is_word_char(sql, pos) and _is_word_char(sql, pos - 1)):
+                parts.append(sql[start:pos])
+                start = pos if keep_separator else match.end()
+                pos = match.end()
+                continue
+        pos += 1
+    parts.append(sql[start:])
+    return parts
+
+
+def _is_word_char(sql: str, pos: int) -> bool:
+    return 0 <= pos < len(sql) and (sql[pos].isalnum() or sql[pos] == "_")
+
+
+def _output_name(column: str) -> str:
+    """
+    Name of an output column of the final select, in upper case.
+    """
+    return re.split(r"[\s.]", column.strip())[-1].upper()
+
+
+def _is_join(clause: str) -> bool:
+    return _CLAUSE_PATTERN.match(clause).group(1).upper().endswith("JOIN")
+
+
+def _referenced(sql: str, bodies: dict[str, str]) -> set[str]:
+    """
+    Names of the CTEs of which `sql` uses columns or which it joins.
+    """
+    names = {name.lower() for name in re.findall(r"\b(\w+)\s*\.", sql)}
+    names.update(_selected_from(sql, bodies))
+    return names & set(bodies)
+
+
+def _selected_from(sql: str, bodies: dict[str, str]) -> set[str]:
+    """
+    Names of the CTEs that `sql` selects from or joins.
+    """
+    names = re.findall(r"\b(?:FROM|JOIN)\s+(\w+)\b", sql, re.IGNORECASE)
+    return {name.lower() for name in names} & set(bodies)
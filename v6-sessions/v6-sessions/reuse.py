@@ -0,0 +1,111 @@
+"""
+This file contains the helpers to reuse an earlier extraction of a cohort.
+
+Users often submit the same cohort definition again under a new name. The features of
+such a cohort are identical to the earlier extraction as long as the CDM did not
+change. Every extraction is therefore registered in the catalog with a hash of the
+CDM snapshot (see `sql/cdm_snapshot.sql`) and the feature query. When a cohort
+definition was extracted before with the same snapshot hash, the cohort file is
+hard-linked (or copied) to the new name instead of being generated and extracted
+again.
+
+Reuse is opt-in (`reuse_extractions=True` in `create_cohort`). The snapshot counts the
+records and the highest ID of every CDM table the features are read from, which scans
+these tables. And it does not detect updates of existing records that leave the
+release dates and the record counts of the CDM unchanged, after which the reused
+cohort files would be outdated. Only enable it for a CDM that is not updated in place.
+"""
+import os
+import shutil
+
+import pandas as pd
+
+from pathlib import Path
+
+from vantage6.algorithm.tools.util import info
+
+from . import cache
+from . import companion_files
+
+# Template of the query that retrieves the snapshot of the CDM
+SNAPSHOT_SQL = "sql/cdm_snapshot.sql"
+
+# Increase this version when the content of the cohort files changes (other than by a
+# change of the feature query), so that earlier extractions are no longer reused.
+REUSE_VERSION = 2
+
+
+def snapshot_hash(
+    snapshot: pd.DataFrame, features_sql: str, database: str, cdm_schema: str
+) -> str:
+    """
+    Compute the hash under which extractions can be reused.
+
+    Parameters
+    ----------
+    snapshot : pd.DataFrame
+        The result of the snapshot query.
+    features_sql : str
+        The (unrendered) feature query.
+    database : str
+        Name of the CDM database.
+    cdm_schema : str
+        Schema of the CDM.
+
+    Returns
+    -------
+    str
+        The hash in hexadecimal form.
+    """
+    snapshot = snapshot.copy()
+    snapshot.columns = snapshot.columns.str.upper()
+    records = snapshot.sort_values("TABLE_NAME").astype(str).to_dict("records")
+    return cache.fingerprint(
+        "reuse", REUSE_VERSION, database, cdm_schema, records, features_sql
+    )
+
+
+def link_cohort(source: str | Path, target: str | Path) -> None:
+    """
+    Make the cohort file at `source`, together with its sidecar and patient versions,
+    available at `target`.
+
+    The files are hard-linked, or copied when the file system does not support hard
+    links. Cohort files are always replaced (never modified in place), so changes to
+    one of the linked cohorts do not affect the other.
+
+    Parameters
+    ----------
+    source : str | Path
+        Location of the existing Parquet file.
+    target : str | Path
+        Location of the new Parquet file, replaced when it exists.
+    """
+    source, target = Path(source), Path(target)
+    if source == target:
+        return
+    _link_or_copy(source, target)
+    for companion_path in (
+        companion_files.sidecar_path,
+        companion_files.versions_path,
+    ):
+        if companion_path(source).exists():
+            _link_or_copy(companion_path(source), companion_path(target))
+        else:
+            companion_path(target).unlink(missing_ok=True)
+    info(f"Reused {source} as {target}")
+
+
+def _link_or_copy(source: Path, target: Path) -> None:
+    """
+    Hard-link or copy a file, replacing the target atomically.
+    """
+    if target.exists() and os.path.samefile(source, target):
+        return
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    tmp_path.unlink(missing_ok=True)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, target)
@@ -0,0 +1,40 @@
+--- Snapshot of the CDM, used to reuse an earlier extraction of the same cohort definition.
+--- The cohorts and their features can only change when the data in one of these tables
+--- changes, which (nearly) always changes the release dates in cdm_source or the number
+--- of records or highest ID of a table. Updates of existing records that change none of
+--- these values are not detected.
+SELECT
+    'cdm_source' AS table_name,
+    COUNT(*) AS n_records,
+    CAST(NULL AS BIGINT) AS max_id,
+    MAX(CONCAT(
+        CAST(cdm_source.cdm_release_date AS VARCHAR(10)), '|',
+        CAST(cdm_source.source_release_date AS VARCHAR(10)), '|',
+        cdm_source.vocabulary_version
+    )) AS release
+FROM
+    @cdm_schema.cdm_source cdm_source
+UNION ALL
+SELECT 'person', COUNT(*), MAX(person_id), NULL FROM @cdm_schema.person
+UNION ALL
+SELECT 'observation_period', COUNT(*), MAX(observation_period_id), NULL FROM @cdm_schema.observation_period
+UNION ALL
+SELECT 'death', COUNT(*), MAX(person_id), NULL FROM @cdm_schema.death
+UNION ALL
+SELECT 'visit_occurrence', COUNT(*), MAX(visit_occurrence_id), NULL FROM @cdm_schema.visit_occurrence
+UNION ALL
+SELECT 'condition_occurrence', COUNT(*), MAX(condition_occurrence_id), NULL FROM @cdm_schema.condition_occurrence
+UNION ALL
+SELECT 'drug_exposure', COUNT(*), MAX(drug_exposure_id), NULL FROM @cdm_schema.drug_exposure
+UNION ALL
+SELECT 'procedure_occurrence', COUNT(*), MAX(procedure_occurrence_id), NULL FROM @cdm_schema.procedure_occurrence
+UNION ALL
+SELECT 'measurement', COUNT(*), MAX(measurement_id), NULL FROM @cdm_schema.measurement
+UNION ALL
+SELECT 'observation', COUNT(*), MAX(observation_id), NULL FROM @cdm_schema.observation
+UNION ALL
+SELECT 'episode', COUNT(*), MAX(episode_id), NULL FROM @cdm_schema.episode
+UNION ALL
+SELECT 'episode_event', COUNT(*), MAX(event_id), NULL FROM @cdm_schema.episode_event
+UNION ALL
+SELECT 'concept', COUNT(*), MAX(concept_id), NULL FROM @vocabulary_schema.concept
@@ -0,0 +1,167 @@
+--- Version of the source data of each patient in the cohort. The features of a patient
+--- only change when one of these values changes, so they are used to find the patients
+--- that need to be extracted again when a cohort is refreshed.
+WITH
+    cohort AS (
+        SELECT
+            cohort.subject_id,
+            cohort.cohort_start_date,
+            cohort.cohort_end_date
+        FROM
+            @results_schema.@cohort_table cohort
+        WHERE
+            cohort.cohort_definition_id = @cohort_id
+    ),
+    episode_version AS (
+        SELECT
+            episode.person_id,
+            COUNT(*) AS n_episodes,
+            MAX(episode.episode_start_date) AS last_episode_start_date,
+            MAX(episode.episode_end_date) AS last_episode_end_date
+        FROM
+            @cdm_schema.episode episode
+        WHERE
+            episode.person_id IN (SELECT subject_id FROM cohort)
+        GROUP BY
+            episode.person_id
+    ),
+    procedure_version AS (
+        SELECT
+            po.person_id,
+            COUNT(*) AS n_procedures,
+            MAX(po.procedure_date) AS last_procedure_date
+        FROM
+            @cdm_schema.procedure_occurrence po
+        WHERE
+            po.person_id IN (SELECT subject_id FROM cohort)
+        GROUP BY
+            po.person_id
+    ),
+    measurement_version AS (
+        SELECT
+            measurement.person_id,
+            COUNT(*) AS n_measurements,
+            MAX(measurement.measurement_date) AS last_measurement_date
+        FROM
+            @cdm_schema.measurement measurement
+        WHERE
+            measurement.person_id IN (SELECT subject_id FROM cohort)
+        GROUP BY
+            measurement.person_id
+    ),
+    observation_period_version AS (
+        SELECT
+            op.person_id,
+            COUNT(*) AS n_observation_periods,
+            MAX(op.observation_period_start_date) AS last_observation_start_date,
+            MAX(op.observation_period_end_date) AS last_observation_end_date
+        FROM
+            @cdm_schema.observation_period op
+        WHERE
+            op.person_id IN (SELECT subject_id FROM cohort)
+        GROUP BY
+            op.person_id
+    ),
+    --- The events of the episodes of a patient, and the procedures and drug exposures
+    --- they refer to. The features join these on the event ID only, so these rows are
+    --- not necessarily found by the person ID.
+    cohort_episode_event AS (
+        SELECT
+            episode.person_id,
+            ee.event_id
+        FROM
+            @cdm_schema.episode episode
+        JOIN
+            @cdm_schema.episode_event ee
+            ON episode.episode_id = ee.episode_id
+        WHERE
+            episode.person_id IN (SELECT subject_id FROM cohort)
+    ),
+    episode_event_version AS (
+        SELECT
+            cohort_episode_event.person_id,
+            COUNT(*) AS n_episode_events,
+            SUM(cohort_episode_event.event_id) AS sum_episode_event_id,
+            COUNT(po.procedure_occurrence_id) AS n_event_procedures,
+            MAX(po.procedure_date) AS last_event_procedure_date,
+            SUM(po.procedure_concept_id) AS sum_event_procedure_concept_id,
+            COUNT(de.drug_exposure_id) AS n_event_drugs,
+            MAX(de.drug_exposure_start_date) AS last_event_drug_date,
+            SUM(de.drug_concept_id) AS sum_event_drug_concept_id
+        FROM
+            cohort_episode_event
+        LEFT JOIN
+            @cdm_schema.procedure_occurrence po
+            ON cohort_episode_event.event_id = po.procedure_occurrence_id
+        LEFT JOIN
+            @cdm_schema.drug_exposure de
+            ON cohort_episode_event.event_id = de.drug_exposure_id
+        GROUP BY
+            cohort_episode_event.person_id
+    ),
+    condition_version AS (
+        SELECT
+            co.person_id,
+            COUNT(*) AS n_conditions,
+            MAX(co.condition_start_date) AS last_condition_date
+        FROM
+            @cdm_schema.condition_occurrence co
+        WHERE
+            co.person_id IN (SELECT subject_id FROM cohort)
+        GROUP BY
+            co.person_id
+    )
+
+SELECT
+    cohort.subject_id AS Patient_ID,
+    cohort.cohort_start_date,
+    cohort.cohort_end_date,
+    person.year_of_birth,
+    person.gender_concept_id,
+    death.death_date,
+    episode_version.n_episodes,
+    episode_version.last_episode_start_date,
+    episode_version.last_episode_end_date,
+    procedure_version.n_procedures,
+    procedure_version.last_procedure_date,
+    measurement_version.n_measurements,
+    measurement_version.last_measurement_date,
+    condition_version.n_conditions,
+    condition_version.last_condition_date,
+    observation_period_version.n_observation_periods,
+    observation_period_version.last_observation_start_date,
+    observation_period_version.last_observation_end_date,
+    episode_event_version.n_episode_events,
+    episode_event_version.sum_episode_event_id,
+    episode_event_version.n_event_procedures,
+    episode_event_version.last_event_procedure_date,
+    episode_event_version.sum_event_procedure_concept_id,
+    episode_event_version.n_event_drugs,
+    episode_event_version.last_event_drug_date,
+    episode_event_version.sum_event_drug_concept_id
+FROM
+    cohort
+LEFT JOIN
+    @cdm_schema.person person
+    ON cohort.subject_id = person.person_id
+LEFT JOIN
+    @cdm_schema.death death
+    ON cohort.subject_id = death.person_id
+LEFT JOIN
+    episode_version
+    ON cohort.subject_id = episode_version.person_id
+LEFT JOIN
+    procedure_version
+    ON cohort.subject_id = procedure_version.person_id
+LEFT JOIN
+    measurement_version
+    ON cohort.subject_id = measurement_version.person_id
+LEFT JOIN
+    condition_version
+    ON cohort.subject_id = condition_version.person_id
+LEFT JOIN
+    observation_period_version
+    ON cohort.subject_id = observation_period_version.person_id
+LEFT JOIN
+    episode_event_version
+    ON cohort.subject_id = episode_event_version.person_id
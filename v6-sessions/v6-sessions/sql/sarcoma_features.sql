@@ -1,68 +1,108 @@
 WITH
     --- get primary diagnosis for all patients in the cohort (the date is the reference for some of the other variables)
+    --- (the first disease episode is used when a patient has multiple)
     primary_tumor AS (
         SELECT
-            episode.person_id,
-            episode.episode_id,
-            episode.episode_concept_id,
-            episode.episode_start_date as diagnosis_date,
-            episode.episode_end_date as diagnosis_end_date,
-            episode.episode_object_concept_id as diagnosis_concept,
-            diagnosis_concept.concept_name as diagnosis
-        FROM
-            @results_schema.@cohort_table cohort
-        LEFT JOIN
-            @cdm_schema.episode episode
-            ON cohort.subject_id = episode.person_id
-        LEFT JOIN
-        	@vocabulary_schema.concept diagnosis_concept
-        	ON episode.episode_object_concept_id = diagnosis_concept.concept_id
-        WHERE
-            episode.episode_concept_id = 32533 --- Disease Episode (overarching episode)
-            {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
+            all_primary_tumor.cohort_definition_id,
+            all_primary_tumor.person_id,
+            all_primary_tumor.episode_id,
+            all_primary_tumor.episode_concept_id,
+            all_primary_tumor.diagnosis_date,
+            all_primary_tumor.diagnosis_end_date,
+            all_primary_tumor.diagnosis_concept,
+            all_primary_tumor.diagnosis
+        FROM (
+            SELECT
+                cohort.cohort_definition_id,
+                episode.person_id,
+                episode.episode_id,
+                episode.episode_concept_id,
+                episode.episode_start_date as diagnosis_date,
+                episode.episode_end_date as diagnosis_end_date,
+                episode.episode_object_concept_id as diagnosis_concept,
+                diagnosis_concept.concept_name as diagnosis,
+                ROW_NUMBER() OVER (PARTITION BY cohort.cohort_definition_id, episode.person_id ORDER BY episode.episode_start_date, episode.episode_id) AS rn
+            FROM
+                @results_schema.@cohort_table cohort
+            LEFT JOIN
+                @cdm_schema.episode episode
+                ON cohort.subject_id = episode.person_id
+            LEFT JOIN
+                @vocabulary_schema.concept diagnosis_concept
+                ON episode.episode_object_concept_id = diagnosis_concept.concept_id
+            WHERE
+                episode.episode_concept_id = 32533 --- Disease Episode (overarching episode)
+                {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
+        ) AS all_primary_tumor
+        WHERE rn = 1
     ),
     --- get all patients in the cohort
+    --- (the first cohort entry is used when a patient entered the cohort multiple times)
     person AS (
         SELECT
-            cohort.subject_id as person_id,
-            gender_concept.concept_name as sex,
-            DATEPART(YEAR, pt.diagnosis_date) - person.year_of_birth as age
-        FROM
-            @results_schema.@cohort_table cohort
-        LEFT JOIN
-            @cdm_schema.person person
-            ON cohort.subject_id = person.person_id
-        LEFT JOIN
-            @vocabulary_schema.concept gender_concept
-            ON person.gender_concept_id = gender_concept.concept_id
-        LEFT JOIN
-            primary_tumor pt
-            ON cohort.subject_id = pt.person_id
-        {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+            all_person.cohort_definition_id,
+            all_person.person_id,
+            all_person.sex,
+            all_person.age
+        FROM (
+            SELECT
+                cohort.cohort_definition_id,
+                cohort.subject_id as person_id,
+                gender_concept.concept_name as sex,
+                DATEPART(YEAR, pt.diagnosis_date) - person.year_of_birth as age,
+                ROW_NUMBER() OVER (PARTITION BY cohort.cohort_definition_id, cohort.subject_id ORDER BY cohort.cohort_start_date) AS rn
+            FROM
+                @results_schema.@cohort_table cohort
+            LEFT JOIN
+                @cdm_schema.person person
+                ON cohort.subject_id = person.person_id
+            LEFT JOIN
+                @vocabulary_schema.concept gender_concept
+                ON person.gender_concept_id = gender_concept.concept_id
+            LEFT JOIN
+                primary_tumor pt
+                ON cohort.subject_id = pt.person_id
+                AND cohort.cohort_definition_id = pt.cohort_definition_id
+            {@cohort_id != -1} ? {WHERE cohort.cohort_definition_id = @cohort_id}
+        ) AS all_person
+        WHERE rn = 1
     ),
     --- get all patients in the cohort and their death information
+    --- (the first cohort entry is used when a patient entered the cohort multiple times)
     death AS (
         SELECT
-            cohort.subject_id as person_id,
-            CAST(IIF(death.death_date IS NOT NULL, 1, 0) AS BIT) AS censor,
-            IIF(death.death_date IS NOT NULL, 'DEAD', 'ALIVE') AS status,
-            ISNULL(
-                (death.death_date - cohort.cohort_start_date),
-                (cohort.cohort_end_date - cohort.cohort_start_date)
-            ) AS survival_days
-        FROM
-            @results_schema.@cohort_table cohort
-        LEFT JOIN
-            @cdm_schema.death death
-            ON cohort.subject_id = death.person_id
-        LEFT JOIN
-            @cdm_schema.observation_period op
-            ON cohort.subject_id = op.person_id
-        {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+            all_death.cohort_definition_id,
+            all_death.person_id,
+            all_death.censor,
+            all_death.status,
+            all_death.survival_days
+        FROM (
+            SELECT
+                cohort.cohort_definition_id,
+                cohort.subject_id as person_id,
+                CAST(IIF(death.death_date IS NOT NULL, 1, 0) AS BIT) AS censor,
+                IIF(death.death_date IS NOT NULL, 'DEAD', 'ALIVE') AS status,
+                ISNULL(
+                    (death.death_date - cohort.cohort_start_date),
+                    (cohort.cohort_end_date - cohort.cohort_start_date)
+                ) AS survival_days,
+                ROW_NUMBER() OVER (PARTITION BY cohort.cohort_definition_id, cohort.subject_id ORDER BY cohort.cohort_start_date, death.death_date) AS rn
+            FROM
+                @results_schema.@cohort_table cohort
+            LEFT JOIN
+                @cdm_schema.death death
+                ON cohort.subject_id = death.person_id
+            LEFT JOIN
+                @cdm_schema.observation_period op
+                ON cohort.subject_id = op.person_id
+            {@cohort_id != -1} ? {WHERE cohort.cohort_definition_id = @cohort_id}
+        ) AS all_death
+        WHERE rn = 1
     ),
     --- get survival from 1 to 10 years
     survival AS (
         SELECT
+            death.cohort_definition_id,
             death.person_id,
             CAST(IIF(death.survival_days >= 365, 1, 0) AS BIT) AS survival_1yr,
             CAST(IIF(death.survival_days >= 2*365, 1, 0) AS BIT) AS survival_2yr,
@@ -80,6 +120,7 @@ WITH
     --- get deaths from 1 to 10 years
     survival_death AS (
         SELECT
+            death.cohort_definition_id,
             death.person_id,
             CAST(IIF(death.survival_days >= 365, 0, 1) AS BIT) AS death_1yr,
             CAST(IIF(death.survival_days >= 2*365, 0, 1) AS BIT) AS death_2yr,
@@ -97,6 +138,7 @@ WITH
     --- histology group
     histo_group AS (
     	SELECT
+	    	primary_tumor.cohort_definition_id,
 	    	primary_tumor.person_id,
 	    	CASE
                 WHEN primary_tumor.diagnosis_concept IN (36529541,36532543,36540557,36547895,36550930,36565259,36716490,44500609,44501363,44502347,44502555) THEN '1004/1007 Liposarcoma'
@@ -113,6 +155,7 @@ WITH
     --- get main surgery information
     surgery AS (
         SELECT
+            all_surgeries.cohort_def_id AS cohort_definition_id,
             all_surgeries.person_id,
             all_surgeries.episode_start_date as surgery_date,
             po.procedure_concept_id  as surgery_concept,
@@ -120,7 +163,8 @@ WITH
         FROM (
             SELECT
                 *,
-                ROW_NUMBER() OVER (PARTITION BY episode.person_id ORDER BY episode.episode_start_date) AS rn
+                cohort.cohort_definition_id AS cohort_def_id,
+                ROW_NUMBER() OVER (PARTITION BY cohort.cohort_definition_id, episode.person_id ORDER BY episode.episode_start_date) AS rn
             FROM
                 @cdm_schema.episode episode
             LEFT JOIN
@@ -142,7 +186,7 @@ WITH
                         AND c.invalid_reason IS NULL
 						AND c.domain_id = 'Measurement'
 				)
-                {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
+                {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
         ) AS all_surgeries
         LEFT join
             @cdm_schema.episode_event ee
@@ -157,7 +201,8 @@ WITH
     ),
     --- get tumor rupture after main surgery
     tumor_rupture AS (
-        SELECT
+        SELECT DISTINCT
+            cohort.cohort_definition_id,
             cohort.subject_id as person_id,
             measurement.measurement_concept_id
         FROM
@@ -168,43 +213,58 @@ WITH
         left join
             surgery
             on surgery.person_id = measurement.person_id
+            AND surgery.cohort_definition_id = cohort.cohort_definition_id
         WHERE
             measurement.measurement_concept_id = 36768904 --- Tumor Rupture
             and surgery.surgery_date = measurement.measurement_date
-            {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
+            {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
     ),
     --- get resection information @ main surgery
     resection AS (
         SELECT
-            cohort.subject_id as person_id,
-            measurement.measurement_concept_id,
-            resection_concept.concept_name AS resection,
-            IIF(measurement.measurement_concept_id in (1634643,1633801), 'Macroscopically complete', 'Macroscopically incomplete') AS completeness_of_resection
-        FROM
-            @results_schema.@cohort_table cohort
-        LEFT JOIN
-            @cdm_schema.measurement measurement
-            ON cohort.subject_id = measurement.person_id
-        left join
-            surgery
-            on surgery.person_id = measurement.person_id
-        LEFT JOIN
-            @vocabulary_schema.concept resection_concept
-            ON measurement.measurement_concept_id = resection_concept.concept_id
-        WHERE
-            measurement.measurement_concept_id IN (1634643,1633801,1634484) --- R0, R1, R2
-            AND surgery.surgery_date = measurement.measurement_date
-            {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
+            all_resection.cohort_definition_id,
+            all_resection.person_id,
+            all_resection.measurement_concept_id,
+            all_resection.resection,
+            all_resection.completeness_of_resection
+        FROM (
+            SELECT
+                cohort.cohort_definition_id,
+                cohort.subject_id as person_id,
+                measurement.measurement_concept_id,
+                resection_concept.concept_name AS resection,
+                IIF(measurement.measurement_concept_id in (1634643,1633801), 'Macroscopically complete', 'Macroscopically incomplete') AS completeness_of_resection,
+                ROW_NUMBER() OVER (PARTITION BY cohort.cohort_definition_id, cohort.subject_id ORDER BY measurement.measurement_concept_id) AS rn
+            FROM
+                @results_schema.@cohort_table cohort
+            LEFT JOIN
+                @cdm_schema.measurement measurement
+                ON cohort.subject_id = measurement.person_id
+            left join
+                surgery
+                on surgery.person_id = measurement.person_id
+                AND surgery.cohort_definition_id = cohort.cohort_definition_id
+            LEFT JOIN
+                @vocabulary_schema.concept resection_concept
+                ON measurement.measurement_concept_id = resection_concept.concept_id
+            WHERE
+                measurement.measurement_concept_id IN (1634643,1633801,1634484) --- R0, R1, R2
+                AND surgery.surgery_date = measurement.measurement_date
+                {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
+        ) AS all_resection
+        WHERE rn = 1
     ),
     --- get local recurrence information
     recurrence AS (
         SELECT
+            all_recurrence.cohort_def_id AS cohort_definition_id,
             all_recurrence.subject_id AS person_id,
             all_recurrence.condition_start_date AS recurrence_date
         FROM (
             SELECT
                 *,
-                ROW_NUMBER() OVER (PARTITION BY co.person_id ORDER BY co.condition_start_date) AS rn
+                cohort.cohort_definition_id AS cohort_def_id,
+                ROW_NUMBER() OVER (PARTITION BY cohort.cohort_definition_id, co.person_id ORDER BY co.condition_start_date) AS rn
             FROM
                 @results_schema.@cohort_table cohort
             LEFT JOIN
@@ -213,6 +273,7 @@ WITH
             LEFT JOIN
                 primary_tumor
                 ON cohort.subject_id = primary_tumor.person_id
+                AND cohort.cohort_definition_id = primary_tumor.cohort_definition_id
             JOIN
                 (SELECT
                     *
@@ -227,13 +288,14 @@ WITH
                 ON co.condition_concept_id = recurrence_concept.descendant_concept_id
             WHERE
                 DATEDIFF(day,primary_tumor.diagnosis_date, co.condition_start_date) > 0
-                {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
+                {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
         ) AS all_recurrence
         WHERE rn = 1
     ),
     --- get distant metastasis information
     metastasis AS (
         SELECT
+            cohort.cohort_definition_id,
             cohort.subject_id as person_id,
             count(*) as n_metastasis
         FROM
@@ -244,6 +306,7 @@ WITH
         LEFT JOIN
             primary_tumor
             ON cohort.subject_id = primary_tumor.person_id
+            AND cohort.cohort_definition_id = primary_tumor.cohort_definition_id
         JOIN
             (SELECT
                 *
@@ -258,55 +321,75 @@ WITH
             ON m.measurement_concept_id = metastasis_concept.descendant_concept_id
         WHERE
             DATEDIFF(day,primary_tumor.diagnosis_date, m.measurement_date) > 90
-            {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
+            {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
         GROUP BY
+            cohort.cohort_definition_id,
             cohort.subject_id
     ),
     --- get information about focality of tumor (unifocal or multifocal) at diagnosis
+    --- (multifocal takes precedence when both are recorded)
     focality AS (
         SELECT
-            cohort.subject_id as person_id,
-            measurement.measurement_concept_id,
-            upper(focality_concept.concept_name) AS focality
-        FROM
-            @results_schema.@cohort_table cohort
-        LEFT JOIN
-            @cdm_schema.measurement measurement
-            ON cohort.subject_id = measurement.person_id
-        LEFT JOIN
-            primary_tumor
-            on primary_tumor.person_id = measurement.person_id
-        LEFT JOIN
-            @vocabulary_schema.concept focality_concept
-            ON measurement.measurement_concept_id = focality_concept.concept_id
-        WHERE
-            measurement.measurement_concept_id IN (36769933,36769332) --- Unifocal Tumor and Multifocal Tumor
-            AND primary_tumor.diagnosis_date = measurement.measurement_date
-            {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
-   UNION
-    	SELECT
-            cohort.subject_id as person_id,
-            condition.condition_concept_id,
-            upper(focality_concept.concept_name) AS focality
-        FROM
-            @results_schema.@cohort_table cohort
-        LEFT JOIN
-            @cdm_schema.condition_occurrence condition
-            ON cohort.subject_id = condition.person_id
-        LEFT JOIN
-            primary_tumor
-            on primary_tumor.person_id = condition.person_id
-        LEFT JOIN
-            @vocabulary_schema.concept focality_concept
-            ON condition.condition_concept_id = focality_concept.concept_id
-        WHERE
-            condition.condition_concept_id IN (4163998,4163442) --- Unifocal tumor and Multifocal tumor
-            AND primary_tumor.diagnosis_date = condition.condition_start_date
-            {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
+            all_focality.cohort_definition_id,
+            all_focality.person_id,
+            all_focality.measurement_concept_id,
+            all_focality.focality
+        FROM (
+            SELECT
+                focality_union.*,
+                ROW_NUMBER() OVER (PARTITION BY focality_union.cohort_definition_id, focality_union.person_id ORDER BY focality_union.focality, focality_union.measurement_concept_id) AS rn
+            FROM (
+                SELECT
+                    cohort.cohort_definition_id,
+                    cohort.subject_id as person_id,
+                    measurement.measurement_concept_id,
+                    upper(focality_concept.concept_name) AS focality
+                FROM
+                    @results_schema.@cohort_table cohort
+                LEFT JOIN
+                    @cdm_schema.measurement measurement
+                    ON cohort.subject_id = measurement.person_id
+                LEFT JOIN
+                    primary_tumor
+                    on primary_tumor.person_id = measurement.person_id
+                    AND primary_tumor.cohort_definition_id = cohort.cohort_definition_id
+                LEFT JOIN
+                    @vocabulary_schema.concept focality_concept
+                    ON measurement.measurement_concept_id = focality_concept.concept_id
+                WHERE
+                    measurement.measurement_concept_id IN (36769933,36769332) --- Unifocal Tumor and Multifocal Tumor
+                    AND primary_tumor.diagnosis_date = measurement.measurement_date
+                    {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
+                UNION
+                SELECT
+                    cohort.cohort_definition_id,
+                    cohort.subject_id as person_id,
+                    condition.condition_concept_id,
+                    upper(focality_concept.concept_name) AS focality
+                FROM
+                    @results_schema.@cohort_table cohort
+                LEFT JOIN
+                    @cdm_schema.condition_occurrence condition
+                    ON cohort.subject_id = condition.person_id
+                LEFT JOIN
+                    primary_tumor
+                    on primary_tumor.person_id = condition.person_id
+                    AND primary_tumor.cohort_definition_id = cohort.cohort_definition_id
+                LEFT JOIN
+                    @vocabulary_schema.concept focality_concept
+                    ON condition.condition_concept_id = focality_concept.concept_id
+                WHERE
+                    condition.condition_concept_id IN (4163998,4163442) --- Unifocal tumor and Multifocal tumor
+                    AND primary_tumor.diagnosis_date = condition.condition_start_date
+                    {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
+            ) AS focality_union
+        ) AS all_focality
+        WHERE rn = 1
     ),
     --- get tumor size (the greater between diagnosis and surgery)
     tumor_size AS (
         SELECT
+            all_tumor_size.cohort_definition_id,
             all_tumor_size.subject_id AS person_id,
             CASE
                 WHEN all_tumor_size.unit_concept_id = 8582 THEN all_tumor_size.value_as_number
@@ -314,10 +397,11 @@ WITH
             END AS tumor_size
         FROM (
             SELECT
+                cohort.cohort_definition_id,
                 cohort.subject_id,
                 measurement.value_as_number,
                 measurement.unit_concept_id,
-                ROW_NUMBER() OVER (PARTITION BY cohort.subject_id ORDER BY
+                ROW_NUMBER() OVER (PARTITION BY cohort.cohort_definition_id, cohort.subject_id ORDER BY
                                 CASE
                                     WHEN measurement.unit_concept_id = 8582 THEN measurement.value_as_number
                                     WHEN measurement.unit_concept_id = 8588 THEN measurement.value_as_number/10
@@ -330,30 +414,34 @@ WITH
             LEFT JOIN
                 primary_tumor
                 ON primary_tumor.person_id = measurement.person_id
+                AND primary_tumor.cohort_definition_id = cohort.cohort_definition_id
                 AND primary_tumor.diagnosis_date = measurement.measurement_date
             LEFT JOIN
                 surgery
                 ON surgery.person_id = measurement.person_id
+                AND surgery.cohort_definition_id = cohort.cohort_definition_id
                 AND surgery.surgery_date = measurement.measurement_date
             WHERE
                 measurement.measurement_concept_id IN (36768664,36768255) -- Tumor size concepts
                 AND (primary_tumor.diagnosis_date IS NOT NULL OR surgery.surgery_date IS NOT NULL)
-                {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
+                {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
         ) AS all_tumor_size
         WHERE rn = 1
     ),
     --- get tumor grade (if grade after surgery is available, otherwise grade at diagnosis)
     tumor_grade AS (
         SELECT
+            all_tumor_grade.cohort_definition_id,
             all_tumor_grade.subject_id AS person_id,
             all_tumor_grade.grade
         FROM (
             SELECT
+                cohort.cohort_definition_id,
                 cohort.subject_id,
                 measurement.measurement_concept_id,
                 grade_concept.concept_name as grade,
                 measurement.measurement_date,
-                ROW_NUMBER() OVER (PARTITION BY cohort.subject_id ORDER BY measurement.measurement_date DESC) AS rn
+                ROW_NUMBER() OVER (PARTITION BY cohort.cohort_definition_id, cohort.subject_id ORDER BY measurement.measurement_date DESC) AS rn
             FROM
                 @results_schema.@cohort_table cohort
             LEFT JOIN
@@ -362,10 +450,12 @@ WITH
             LEFT JOIN
                 primary_tumor
                 ON primary_tumor.person_id = measurement.person_id
+                AND primary_tumor.cohort_definition_id = cohort.cohort_definition_id
                 AND primary_tumor.diagnosis_date = measurement.measurement_date
             LEFT JOIN
                 surgery
                 ON surgery.person_id = measurement.person_id
+                AND surgery.cohort_definition_id = cohort.cohort_definition_id
                 AND surgery.surgery_date = measurement.measurement_date
             left join
                 @vocabulary_schema.concept grade_concept
@@ -373,19 +463,21 @@ WITH
             WHERE
                 measurement.measurement_concept_id IN (1634371,1634752,1633749) -- FNCLCC grade
                 AND (primary_tumor.diagnosis_date IS NOT NULL OR surgery.surgery_date IS NOT NULL)
-                {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
+                {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
         ) AS all_tumor_grade
         WHERE rn = 1
     ),
     --- Pre-operative radiotherapy
     pre_radio AS (
         SELECT
+            all_pre_radio.cohort_def_id AS cohort_definition_id,
             all_pre_radio.subject_id AS person_id,
             all_pre_radio.episode_start_date AS pre_radio_date
         FROM (
             SELECT
                 *,
-                ROW_NUMBER() OVER (PARTITION BY episode.person_id ORDER BY episode.episode_start_date DESC) AS rn
+                cohort.cohort_definition_id AS cohort_def_id,
+                ROW_NUMBER() OVER (PARTITION BY cohort.cohort_definition_id, episode.person_id ORDER BY episode.episode_start_date DESC) AS rn
             FROM
                 @cdm_schema.episode episode
             LEFT JOIN
@@ -394,25 +486,28 @@ WITH
             LEFT JOIN
                 primary_tumor
                 ON cohort.subject_id = primary_tumor.person_id
+                AND cohort.cohort_definition_id = primary_tumor.cohort_definition_id
             JOIN
                 surgery
-                on cohort.subject_id = surgery.person_id AND episode.episode_start_date < surgery.surgery_date
+                on cohort.subject_id = surgery.person_id AND cohort.cohort_definition_id = surgery.cohort_definition_id AND episode.episode_start_date < surgery.surgery_date
             WHERE
                 episode.episode_concept_id = 32940
                 AND episode.episode_parent_id IN (SELECT primary_tumor.episode_id FROM primary_tumor)
-                {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
+                {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
             ) AS all_pre_radio
         WHERE rn = 1
     ),
     --- Post-operative radiotherapy
     post_radio AS (
         SELECT
+            all_post_radio.cohort_def_id AS cohort_definition_id,
             all_post_radio.subject_id AS person_id,
             all_post_radio.episode_start_date as post_radio_date
         FROM (
             SELECT
                     *,
-                    ROW_NUMBER() OVER (PARTITION BY episode.person_id ORDER BY episode.episode_start_date) AS rn
+                    cohort.cohort_definition_id AS cohort_def_id,
+                    ROW_NUMBER() OVER (PARTITION BY cohort.cohort_definition_id, episode.person_id ORDER BY episode.episode_start_date) AS rn
                 FROM
                     @cdm_schema.episode episode
                 LEFT JOIN
@@ -421,29 +516,33 @@ WITH
                 LEFT JOIN
                     primary_tumor
                     ON cohort.subject_id = primary_tumor.person_id
+                    AND cohort.cohort_definition_id = primary_tumor.cohort_definition_id
                 JOIN
                     surgery
-                    ON cohort.subject_id = surgery.person_id AND episode.episode_start_date > surgery.surgery_date
+                    ON cohort.subject_id = surgery.person_id AND cohort.cohort_definition_id = surgery.cohort_definition_id AND episode.episode_start_date > surgery.surgery_date
                 LEFT JOIN
                     recurrence
                     on cohort.subject_id = recurrence.person_id
+                    AND cohort.cohort_definition_id = recurrence.cohort_definition_id
                 WHERE
                     episode.episode_concept_id = 32940
                     AND episode.episode_parent_id IN (SELECT primary_tumor.episode_id FROM primary_tumor) --- get the radiotherapies related only to the overarching episode considered
                     AND episode.episode_start_date < ISNULL(recurrence.recurrence_date, primary_tumor.diagnosis_end_date)
-                    {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
+                    {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
         ) AS all_post_radio
         WHERE rn = 1
     ),
     --- Pre-operative chemotherapy
     pre_chemo AS (
         SELECT
+            all_pre_chemo.cohort_def_id AS cohort_definition_id,
             all_pre_chemo.subject_id AS person_id,
             all_pre_chemo.episode_start_date as pre_chemo_date
         FROM (
             SELECT
                     *,
-                    ROW_NUMBER() OVER (PARTITION BY episode.person_id ORDER BY episode.episode_start_date DESC) AS rn
+                    cohort.cohort_definition_id AS cohort_def_id,
+                    ROW_NUMBER() OVER (PARTITION BY cohort.cohort_definition_id, episode.person_id ORDER BY episode.episode_start_date DESC) AS rn
                 FROM
                     @cdm_schema.episode episode
                 LEFT JOIN
@@ -452,9 +551,10 @@ WITH
                 LEFT JOIN
                     primary_tumor
                     ON cohort.subject_id = primary_tumor.person_id
+                    AND cohort.cohort_definition_id = primary_tumor.cohort_definition_id
                 JOIN
                     surgery
-                    ON cohort.subject_id = surgery.person_id AND episode.episode_start_date < surgery.surgery_date
+                    ON cohort.subject_id = surgery.person_id AND cohort.cohort_definition_id = surgery.cohort_definition_id AND episode.episode_start_date < surgery.surgery_date
                 JOIN
                     @cdm_schema.procedure_occurrence po
                     ON po.person_id = cohort.subject_id AND po.procedure_date = episode.episode_start_date AND po.procedure_end_date = episode.episode_end_date
@@ -472,19 +572,21 @@ WITH
                             AND ca.ancestor_concept_id IN (4273629) --- Chemotherapy and all descendants
                             AND c.invalid_reason IS NULL
                         )
-                    {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
+                    {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
                 ) AS all_pre_chemo
             WHERE rn = 1
     ),
     --- Post-operative chemotherapy
     post_chemo AS (
         SELECT
+            all_post_chemo.cohort_def_id AS cohort_definition_id,
             all_post_chemo.subject_id AS person_id,
             all_post_chemo.episode_start_date AS post_chemo_date
         FROM (
             SELECT
                 *,
-                ROW_NUMBER() OVER (PARTITION BY episode.person_id ORDER BY episode.episode_start_date) AS rn
+                cohort.cohort_definition_id AS cohort_def_id,
+                ROW_NUMBER() OVER (PARTITION BY cohort.cohort_definition_id, episode.person_id ORDER BY episode.episode_start_date) AS rn
             FROM
                 @cdm_schema.episode episode
             LEFT JOIN
@@ -493,12 +595,14 @@ WITH
             LEFT JOIN
                 primary_tumor
                 ON cohort.subject_id = primary_tumor.person_id
+                AND cohort.cohort_definition_id = primary_tumor.cohort_definition_id
             JOIN
                 surgery
-                ON cohort.subject_id = surgery.person_id AND episode.episode_start_date > surgery.surgery_date
+                ON cohort.subject_id = surgery.person_id AND cohort.cohort_definition_id = surgery.cohort_definition_id AND episode.episode_start_date > surgery.surgery_date
             LEFT JOIN
                 recurrence
                 ON cohort.subject_id = recurrence.person_id
+                AND cohort.cohort_definition_id = recurrence.cohort_definition_id
             JOIN
                 @cdm_schema.procedure_occurrence po
                 ON po.person_id = cohort.subject_id AND po.procedure_date = episode.episode_start_date AND po.procedure_end_date = episode.episode_end_date
@@ -516,12 +620,13 @@ WITH
                         ON c.concept_id = ca.descendant_concept_id
                         AND ca.ancestor_concept_id IN (4273629) --- Chemotherapy and all descendants
                         AND c.invalid_reason IS NULL)
-                {@cohort_id != -1} ? {AND cohort_definition_id = @cohort_id}
+                {@cohort_id != -1} ? {AND cohort.cohort_definition_id = @cohort_id}
             ) AS all_post_chemo
         WHERE rn = 1
     )
 
 SELECT
+    {@cohort_id == -1} ? {person.cohort_definition_id as Cohort_definition_id,}
     person.person_id as Patient_ID,
     person.age as Age,
     CASE
@@ -580,51 +685,68 @@ FROM
 LEFT JOIN
 	primary_tumor
 	ON person.person_id = primary_tumor.person_id
+	AND person.cohort_definition_id = primary_tumor.cohort_definition_id
 LEFT JOIN
     death
     ON person.person_id = death.person_id
+    AND person.cohort_definition_id = death.cohort_definition_id
 LEFT JOIN
     survival
     ON person.person_id = survival.person_id
+    AND person.cohort_definition_id = survival.cohort_definition_id
 LEFT JOIN
     survival_death
     ON person.person_id = survival_death.person_id
+    AND person.cohort_definition_id = survival_death.cohort_definition_id
 LEFT JOIN
     histo_group
     ON person.person_id = histo_group.person_id
+    AND person.cohort_definition_id = histo_group.cohort_definition_id
 LEFT JOIN
     surgery
     ON person.person_id = surgery.person_id
+    AND person.cohort_definition_id = surgery.cohort_definition_id
 LEFT JOIN
     tumor_rupture
     ON person.person_id = tumor_rupture.person_id
+    AND person.cohort_definition_id = tumor_rupture.cohort_definition_id
 LEFT JOIN
     resection
     ON person.person_id = resection.person_id
+    AND person.cohort_definition_id = resection.cohort_definition_id
 LEFT JOIN
     recurrence
     ON person.person_id = recurrence.person_id
+    AND person.cohort_definition_id = recurrence.cohort_definition_id
 LEFT JOIN
     metastasis
     ON person.person_id = metastasis.person_id
+    AND person.cohort_definition_id = metastasis.cohort_definition_id
 LEFT JOIN
     focality
     ON person.person_id = focality.person_id
+    AND person.cohort_definition_id = focality.cohort_definition_id
 LEFT JOIN
     tumor_size
     ON person.person_id = tumor_size.person_id
+    AND person.cohort_definition_id = tumor_size.cohort_definition_id
 LEFT JOIN
     tumor_grade
     ON person.person_id = tumor_grade.person_id
+    AND person.cohort_definition_id = tumor_grade.cohort_definition_id
 LEFT JOIN
     pre_chemo
     ON person.person_id = pre_chemo.person_id
+    AND person.cohort_definition_id = pre_chemo.cohort_definition_id
 LEFT JOIN
     post_chemo
     ON person.person_id = post_chemo.person_id
+    AND person.cohort_definition_id = post_chemo.cohort_definition_id
 LEFT JOIN
     pre_radio
     ON person.person_id = pre_radio.person_id
+    AND person.cohort_definition_id = pre_radio.cohort_definition_id
 LEFT JOIN
     post_radio
-    ON person.person_id = post_radio.person_id
\ No newline at end of file
+    ON person.person_id = post_radio.person_id
+    AND person.cohort_definition_id = post_radio.cohort_definition_id
\ No newline at end of file
@@ -1,122 +1,203 @@
 /* death_int
+   (the first cohort entry is used when a subject entered the cohort multiple times)
 */
 WITH death_query AS (
     SELECT
-        c.subject_id,
-        DATEDIFF(DAY, cohort_start_date, death_date) AS death_int,
-        DATEDIFF(DAY, cohort_start_date, cohort_end_date) AS cohort_int
-    FROM
-        @cohort_table c
-    LEFT JOIN
-        @cdm_database_schema.death T
-	ON T.person_id = c.subject_id
-    {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+        all_death.subject_id,
+        all_death.death_int,
+        all_death.cohort_int
+    FROM (
+        SELECT
+            c.subject_id,
+            DATEDIFF(DAY, cohort_start_date, death_date) AS death_int,
+            DATEDIFF(DAY, cohort_start_date, cohort_end_date) AS cohort_int,
+            ROW_NUMBER() OVER (PARTITION BY c.subject_id ORDER BY cohort_start_date) AS rn
+        FROM
+            @cohort_table c
+        LEFT JOIN
+            @cdm_database_schema.death T
+            ON T.person_id = c.subject_id
+        {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+    ) AS all_death
+    WHERE rn = 1
 ),
 
 /* gender, year of birth, birth int, age
+   (the first cohort entry is used when a subject entered the cohort multiple times)
 */
 person_query AS (
     SELECT
-        c.subject_id,
-        T.gender_concept_id AS gender,
-		T.year_of_birth,
-		DATEDIFF(DAY, birth_datetime, cohort_start_date) AS birth_int,
-		DATEDIFF(YEAR, birth_datetime, cohort_start_date) - CASE WHEN (MONTH(birth_datetime) > MONTH(cohort_start_date)) OR (MONTH(birth_datetime) = MONTH(cohort_start_date) AND DAY(birth_datetime) > DAY(cohort_start_date)) THEN 1 ELSE 0 END age
-    FROM
-        @cohort_table c
-    LEFT JOIN
-        @cdm_database_schema.person T
-	ON T.person_id = c.subject_id
-    {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+        all_person.subject_id,
+        all_person.gender,
+        all_person.year_of_birth,
+        all_person.birth_int,
+        all_person.age
+    FROM (
+        SELECT
+            c.subject_id,
+            T.gender_concept_id AS gender,
+            T.year_of_birth,
+            DATEDIFF(DAY, birth_datetime, cohort_start_date) AS birth_int,
+            DATEDIFF(YEAR, birth_datetime, cohort_start_date) - CASE WHEN (MONTH(birth_datetime) > MONTH(cohort_start_date)) OR (MONTH(birth_datetime) = MONTH(cohort_start_date) AND DAY(birth_datetime) > DAY(cohort_start_date)) THEN 1 ELSE 0 END age,
+            ROW_NUMBER() OVER (PARTITION BY c.subject_id ORDER BY cohort_start_date) AS rn
+        FROM
+            @cohort_table c
+        LEFT JOIN
+            @cdm_database_schema.person T
+            ON T.person_id = c.subject_id
+        {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+    ) AS all_person
+    WHERE rn = 1
 ),
 
 /* condition_concept_id, condition_occurrence_start, condition_occurrence_end
+   (the first included condition of a subject is used)
 */
 condition_occurrence_query AS (
     SELECT
-		c.subject_id,
-        T.condition_concept_id,
-		DATEDIFF(DAY, cohort_start_date, condition_start_date) AS condition_occurrence_start,
-		DATEDIFF(DAY, cohort_start_date, condition_end_date) AS condition_occurrence_end
-    FROM
-        @cohort_table c
-    LEFT JOIN
-        @cdm_database_schema.condition_occurrence T
-	ON T.person_id = c.subject_id
-    {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+        all_condition_occurrence.subject_id,
+        all_condition_occurrence.condition_concept_id,
+        all_condition_occurrence.condition_occurrence_start,
+        all_condition_occurrence.condition_occurrence_end
+    FROM (
+        SELECT
+            c.subject_id,
+            T.condition_concept_id,
+            DATEDIFF(DAY, cohort_start_date, condition_start_date) AS condition_occurrence_start,
+            DATEDIFF(DAY, cohort_start_date, condition_end_date) AS condition_occurrence_end,
+            ROW_NUMBER() OVER (PARTITION BY c.subject_id ORDER BY T.condition_start_date, T.condition_concept_id) AS rn
+        FROM
+            @cohort_table c
+        LEFT JOIN
+            @cdm_database_schema.condition_occurrence T
+            ON T.person_id = c.subject_id
+            AND (T.condition_concept_id IN (@incl_condition_concept_id) OR (@incl_condition_concept_id) IS NULL)
+        {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+    ) AS all_condition_occurrence
+    WHERE rn = 1
 ),
 
 /* drug_concept_id, drug_exposure_start, drug_exposure_end
+   (the first included drug exposure of a subject is used)
 */
 drug_exposure_query AS (
     SELECT
-		c.subject_id,
-        T.drug_concept_id,
-		DATEDIFF(DAY, cohort_start_date, drug_exposure_start_date) AS drug_exposure_start,
-		DATEDIFF(DAY, cohort_start_date, drug_exposure_end_date) AS drug_exposure_end
-    FROM
-        @cohort_table c
-    LEFT JOIN
-        @cdm_database_schema.drug_exposure T
-	ON T.person_id = c.subject_id
-    {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+        all_drug_exposure.subject_id,
+        all_drug_exposure.drug_concept_id,
+        all_drug_exposure.drug_exposure_start,
+        all_drug_exposure.drug_exposure_end
+    FROM (
+        SELECT
+            c.subject_id,
+            T.drug_concept_id,
+            DATEDIFF(DAY, cohort_start_date, drug_exposure_start_date) AS drug_exposure_start,
+            DATEDIFF(DAY, cohort_start_date, drug_exposure_end_date) AS drug_exposure_end,
+            ROW_NUMBER() OVER (PARTITION BY c.subject_id ORDER BY T.drug_exposure_start_date, T.drug_concept_id) AS rn
+        FROM
+            @cohort_table c
+        LEFT JOIN
+            @cdm_database_schema.drug_exposure T
+            ON T.person_id = c.subject_id
+            AND (T.drug_concept_id IN (@incl_drug_concept_id) OR (@incl_drug_concept_id) IS NULL)
+        {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+    ) AS all_drug_exposure
+    WHERE rn = 1
 ),
 
 /* procedure_concept_id, procedure_occurrence_start, procedure_occurrence_end
+   (the first included procedure of a subject is used)
 */
 procedure_occurrence_query AS (
     SELECT
-		c.subject_id,
-        T.procedure_concept_id,
-		DATEDIFF(DAY, cohort_start_date, procedure_date) AS procedure_occurrence_start,
-		DATEDIFF(DAY, cohort_start_date, procedure_end_date) AS procedure_occurrence_end
-    FROM
-        @cohort_table c
-    LEFT JOIN
-        @cdm_database_schema.procedure_occurrence T
-	ON T.person_id = c.subject_id
-    {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+        all_procedure_occurrence.subject_id,
+        all_procedure_occurrence.procedure_concept_id,
+        all_procedure_occurrence.procedure_occurrence_start,
+        all_procedure_occurrence.procedure_occurrence_end
+    FROM (
+        SELECT
+            c.subject_id,
+            T.procedure_concept_id,
+            DATEDIFF(DAY, cohort_start_date, procedure_date) AS procedure_occurrence_start,
+            DATEDIFF(DAY, cohort_start_date, procedure_end_date) AS procedure_occurrence_end,
+            ROW_NUMBER() OVER (PARTITION BY c.subject_id ORDER BY T.procedure_date, T.procedure_concept_id) AS rn
+        FROM
+            @cohort_table c
+        LEFT JOIN
+            @cdm_database_schema.procedure_occurrence T
+            ON T.person_id = c.subject_id
+            AND (T.procedure_concept_id IN (@incl_procedure_concept_id) OR (@incl_procedure_concept_id) IS NULL)
+        {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+    ) AS all_procedure_occurrence
+    WHERE rn = 1
 ),
 
 /* measurement_concept_id, measurement_start, measurement_unit_concept_id, measurement_vac,
    measurement_van, measurement_operator_concept_id
+   (the first included measurement of a subject is used)
 */
 measurement_query AS (
     SELECT
-		c.subject_id,
-        T.measurement_concept_id,
-		DATEDIFF(DAY, cohort_start_date, measurement_date) AS measurement_start,
-		T.unit_concept_id AS measurement_unit_concept_id,
-		T.value_as_concept_id AS measurement_vac,
-		T.value_as_number AS measurement_van,
-		T.operator_concept_id AS measurement_operator_concept_id
-    FROM
-        @cohort_table c
-    LEFT JOIN
-        @cdm_database_schema.measurement T
-	ON T.person_id = c.subject_id
-    {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+        all_measurement.subject_id,
+        all_measurement.measurement_concept_id,
+        all_measurement.measurement_start,
+        all_measurement.measurement_unit_concept_id,
+        all_measurement.measurement_vac,
+        all_measurement.measurement_van,
+        all_measurement.measurement_operator_concept_id
+    FROM (
+        SELECT
+            c.subject_id,
+            T.measurement_concept_id,
+            DATEDIFF(DAY, cohort_start_date, measurement_date) AS measurement_start,
+            T.unit_concept_id AS measurement_unit_concept_id,
+            T.value_as_concept_id AS measurement_vac,
+            T.value_as_number AS measurement_van,
+            T.operator_concept_id AS measurement_operator_concept_id,
+            ROW_NUMBER() OVER (PARTITION BY c.subject_id ORDER BY T.measurement_date, T.measurement_concept_id) AS rn
+        FROM
+            @cohort_table c
+        LEFT JOIN
+            @cdm_database_schema.measurement T
+            ON T.person_id = c.subject_id
+            AND (T.measurement_concept_id IN (@incl_measurement_concept_id) OR (@incl_measurement_concept_id) IS NULL)
+        {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+    ) AS all_measurement
+    WHERE rn = 1
 ),
 
 /* observation_concept_id, observation_start, observation_unit_concept_id, observation_vac,
 observation_van, observation_vas, observation_qualifier_concept_id
+   (the first observation of a subject is used)
 */
 observation_query AS (
     SELECT
-		c.subject_id,
-        T.observation_concept_id,
-		DATEDIFF(DAY, cohort_start_date, observation_date) AS observation_start,
-		T.unit_concept_id AS observation_unit_concept_id,
-		T.value_as_concept_id AS observation_vac,
-		T.value_as_number AS observation_van,
-		T.value_as_string AS observation_vas,
-		T.qualifier_concept_id AS observation_qualifier_concept_id
-    FROM
-        @cohort_table c
-    LEFT JOIN
-        @cdm_database_schema.observation T
-	ON T.person_id = c.subject_id
-    {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+        all_observation.subject_id,
+        all_observation.observation_concept_id,
+        all_observation.observation_start,
+        all_observation.observation_unit_concept_id,
+        all_observation.observation_vac,
+        all_observation.observation_van,
+        all_observation.observation_vas,
+        all_observation.observation_qualifier_concept_id
+    FROM (
+        SELECT
+            c.subject_id,
+            T.observation_concept_id,
+            DATEDIFF(DAY, cohort_start_date, observation_date) AS observation_start,
+            T.unit_concept_id AS observation_unit_concept_id,
+            T.value_as_concept_id AS observation_vac,
+            T.value_as_number AS observation_van,
+            T.value_as_string AS observation_vas,
+            T.qualifier_concept_id AS observation_qualifier_concept_id,
+            ROW_NUMBER() OVER (PARTITION BY c.subject_id ORDER BY T.observation_date, T.observation_concept_id) AS rn
+        FROM
+            @cohort_table c
+        LEFT JOIN
+            @cdm_database_schema.observation T
+            ON T.person_id = c.subject_id
+        {@cohort_id != -1} ? {WHERE cohort_definition_id = @cohort_id}
+    ) AS all_observation
+    WHERE rn = 1
 )
 
 
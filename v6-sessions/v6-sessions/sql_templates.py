@@ -0,0 +1,240 @@
+"""
+This file contains the pre-translation of the feature SQL templates.
+
+The feature SQL is written in the OHDSI SQL dialect and is translated to the dialect of
+the database by SqlRender, which runs in Java. As the target dialect is (nearly)
+always PostgreSQL, the templates are translated once when the image is built:
+
+    python -c "import importlib; importlib.import_module('v6-sessions.sql_templates').build_pretranslated()"
+
+The templates are rendered with sentinel values for the parameters that are only known
+at runtime (schemas, cohort table and cohort ID) and then translated. The sentinels
+are replaced by `@parameter` placeholders, which are bound at runtime by plain string
+substitution. When the template, the dialect or the constant parameters do not match
+the pre-translated version, the caller falls back to live translation.
+"""
+import re
+import json
+import hashlib
+
+from pathlib import Path
+
+from vantage6.algorithm.tools.util import info, warn
+
+# Dialect of the OMOP databases this algorithm is used with
+TARGET_DIALECT = "postgresql"
+
+# Dialect for which the templates are translated when the image is built
+PRETRANSLATED_DIALECT = TARGET_DIALECT
+
+# Templates in the `sql` directory of this package that are pre-translated
+TEMPLATES = (
+    "sarcoma_features.sql",
+    "standard_features.sql",
+    "person_versions.sql",
+    "cdm_snapshot.sql",
+)
+
+# Parameters that are bound at runtime, and the sentinel values that are used to
+# render the templates. The sentinels should not occur anywhere else in the SQL.
+RUNTIME_PARAMETERS = {
+    "cohort_table": "v6_param_cohort_table",
+    "cohort_id": 918273645,
+    "results_schema": "v6_param_results_schema",
+    "cdm_schema": "v6_param_cdm_schema",
+    "vocabulary_schema": "v6_param_vocabulary_schema",
+    "cdm_database_schema": "v6_param_cdm_database_schema",
+}
+
+# Parameters that have a fixed value in this algorithm. They are rendered into the
+# pre-translated SQL.
+CONSTANT_PARAMETERS = {
+    "incl_condition_concept_id": ["NULL"],
+    "incl_procedure_concept_id": ["NULL"],
+    "incl_measurement_concept_id": ["NULL"],
+    "incl_drug_concept_id": ["NULL"],
+}
+
+# The templates contain `{@cohort_id != -1} ? {...}` blocks, so the SQL for a single
+# cohort differs from the SQL for all cohorts (cohort ID -1).
+VARIANTS = {"single": RUNTIME_PARAMETERS["cohort_id"], "all": -1}
+
+MANIFEST = "manifest.json"
+
+
+def build_pretranslated(
+    sql_dir: str | Path | None = None, dialect: str = PRETRANSLATED_DIALECT
+) -> None:
+    """
+    Translate the feature SQL templates and store them next to the templates in a
+    directory named after the dialect.
+
+    Parameters
+    ----------
+    sql_dir : str | Path | None
+        Directory that contains the templates. Defaults to the `sql` directory of
+        this package.
+    dialect : str
+        The dialect to translate to.
+    """
+    from ohdsi import sqlrender
+
+    sql_dir = Path(sql_dir) if sql_dir else Path(__file__).parent / "sql"
+    target_dir = sql_dir / dialect
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest = {"dialect": dialect, "templates": {}}
+    for template in TEMPLATES:
+        sql = (sql_dir / template).read_text(encoding="utf-8")
+        variants = {}
+        for variant, cohort_id in VARIANTS.items():
+            info(f"Translating {template} ({variant}) to {dialect}")
+            parameters = {
+                **RUNTIME_PARAMETERS,
+                **CONSTANT_PARAMETERS,
+                "cohort_id": cohort_id,
+            }
+            rendered_sql = sqlrender.render(sql, **parameters)
+            translated_sql = str(
+                sqlrender.translate(rendered_sql, target_dialect=dialect)[0]
+            )
+            for name, sentinel in RUNTIME_PARAMETERS.items():
+                translated_sql = translated_sql.replace(str(sentinel), f"@{name}")
+
+            file_name = f"{Path(template).stem}.{variant}.sql"
+            (target_dir / file_name).write_text(translated_sql, encoding="utf-8")
+            variants[variant] = file_name
+
+        manifest["templates"][template] = {
+            "sha256": _sha256(sql),
+            "constants": CONSTANT_PARAMETERS,
+            "variants": variants,
+        }
+
+    (target_dir / MANIFEST).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    info(f"Pre-translated SQL written to {target_dir}")
+
+
+def render_pretranslated(
+    template_path: str | Path, sql: str, parameters: dict, dialect: str
+) -> str | None:
+    """
+    Obtain the pre-translated SQL of a template with the parameters bound.
+
+    Parameters
+    ----------
+    template_path : str | Path
+        Location of the (untranslated) template.
+    sql : str
+        Content of the template, used to check that the pre-translated version is
+        up to date.
+    parameters : dict
+        The parameters to render the template with.
+    dialect : str
+        The target dialect.
+
+    Returns
+    -------
+    str | None
+        The translated SQL, or None when no matching pre-translated SQL is
+        available.
+    """
+    template_path = Path(template_path)
+    manifest_path = template_path.parent / dialect / MANIFEST
+    if not manifest_path.exists():
+        return None
+
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        entry = manifest["templates"][template_path.name]
+    except Exception as e:
+        warn(f"Failed to read pre-translated SQL manifest {manifest_path}: {e}")
+        return None
+
+    if entry["sha256"] != _sha256(sql):
+        warn(f"Pre-translated SQL of {template_path.name} is outdated, not using it")
+        return None
+
+    constants = {name: parameters.get(name) for name in entry["constants"]}
+    runtime = {
+        name: value for name, value in parameters.items() if name not in constants
+    }
+    if constants != entry["constants"] or set(runtime) - set(RUNTIME_PARAMETERS):
+        return None
+
+    variant = "all" if parameters.get("cohort_id") == -1 else "single"
+    path = template_path.parent / dialect / entry["variants"][variant]
+    translated_sql = path.read_text(encoding="utf-8")
+    if set(re.findall(r"@(\w+)", translated_sql)) - set(runtime):
+        return None
+
+    info(f"Using pre-translated SQL {path.name}")
+    return re.sub(
+        r"@(\w+)",
+        lambda match: _format_value(runtime[match.group(1)]),
+        translated_sql,
+    )
+
+
+def with_sentinels(parameters: dict) -> dict:
+    """
+    Replace the values of the runtime parameters by their sentinels, so that the
+    template can be rendered and translated independent of the task (e.g. to cache
+    the result). A cohort ID of -1 (all cohorts) is kept, as it changes the SQL.
+
+    Parameters
+    ----------
+    parameters : dict
+        The parameters to render the template with.
+
+    Returns
+    -------
+    dict
+        The parameters with the sentinels, see `bind_sentinels` to bind the values.
+    """
+    return {
+        name: (
+            RUNTIME_PARAMETERS[name]
+            if name in RUNTIME_PARAMETERS and not (name == "cohort_id" and value == -1)
+            else value
+        )
+        for name, value in parameters.items()
+    }
+
+
+def bind_sentinels(translated_sql: str, parameters: dict) -> str:
+    """
+    Bind the runtime parameters in SQL that is rendered with the parameters of
+    `with_sentinels`.
+
+    Parameters
+    ----------
+    translated_sql : str
+        The rendered (and translated) SQL.
+    parameters : dict
+        The parameters with their actual values.
+
+    Returns
+    -------
+    str
+        The SQL with the sentinels replaced by the values.
+    """
+    for name, sentinel in RUNTIME_PARAMETERS.items():
+        if name in parameters:
+            translated_sql = translated_sql.replace(
+                str(sentinel), _format_value(parameters[name])
+            )
+    return translated_sql
+
+
+def _format_value(value) -> str:
+    """
+    Format a parameter value the same way as SqlRender does.
+    """
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
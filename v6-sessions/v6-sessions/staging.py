@@ -0,0 +1,210 @@
+"""
+This file contains the staged execution of the feature query.
+
+The feature query is a single chain of CTEs. Several CTEs join the cohort table and
+the vocabulary again, and PostgreSQL often can not push the predicates of the final
+select through them. In the staged execution every CTE is materialized as a
+temporary table of the session, with indexes on `person_id` and `episode_id` (when
+present) and fresh statistics. The final select then runs against these tables.
+
+The CTEs are taken from the translated (PostgreSQL) SQL. A temporary table has the
+same name as its CTE, so the later CTEs and the final select refer to the temporary
+tables without any rewriting. Tables in other schemas are always schema-qualified in
+the feature queries, so they are not shadowed by the temporary tables.
+
+The time spent on every stage is recorded, so that slow feature blocks can be found.
+"""
+import time
+
+from rpy2.robjects import RS4
+
+from vantage6.algorithm.tools.util import info, warn
+
+from ohdsi import database_connector
+
+from . import instrumentation
+
+# Columns of the staged tables that are indexed, when present
+INDEX_COLUMNS = ("person_id", "episode_id")
+
+
+class StagedQuery:
+    """
+    Materialize the CTEs of a query as temporary tables.
+
+    Use as context manager, the temporary tables are dropped when the context is
+    exited:
+
+        with StagedQuery(connection, sql) as staged:
+            data_r = database_connector.query_sql(connection, staged.sql)
+
+    Parameters
+    ----------
+    connection : RS4
+        Connection to the database. The temporary tables are only visible to this
+        connection.
+    sql : str
+        The rendered and translated query, starting with a `WITH` clause.
+
+    Attributes
+    ----------
+    sql : str
+        The final select of the query, which refers to the temporary tables.
+    timings : dict[str, float]
+        The duration in seconds of every stage.
+    """
+
+    def __init__(self, connection: RS4, sql: str):
+        self.connection = connection
+        self.stages, self.sql = split_ctes(sql)
+        self.timings = {}
+        self._tables = []
+
+    def __enter__(self) -> "StagedQuery":
+        try:
+            for name, body in self.stages:
+                self._create_stage(name, body)
+        except Exception:
+            self.drop()
+            raise
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.drop()
+
+    def _create_stage(self, name: str, body: str) -> None:
+        start = time.perf_counter()
+        with instrumentation.stage("materialize", table=name):
+            _execute(self.connection, f"DROP TABLE IF EXISTS pg_temp.{name}")
+            _execute(self.connection, f"CREATE TEMP TABLE {name} AS {body}")
+            self._tables.append(name)
+
+            columns = _get_columns(self.connection, name)
+            for column in INDEX_COLUMNS:
+                if column in columns:
+                    _execute(
+                        self.connection, f"CREATE INDEX ON pg_temp.{name} ({column})"
+                    )
+            _execute(self.connection, f"ANALYZE pg_temp.{name}")
+
+        self.timings[name] = time.perf_counter() - start
+        info(f"Stage {name} materialized in {self.timings[name]:.2f}s")
+
+    def drop(self) -> None:
+        """
+        Drop the temporary tables. Failures are logged, as the tables are dropped
+        anyway when the session ends.
+        """
+        while self._tables:
+            name = self._tables.pop()
+            try:
+                _execute(self.connection, f"DROP TABLE IF EXISTS pg_temp.{name}")
+            except Exception as e:
+                warn(f"Failed to drop temporary table {name}: {e}")
+
+
+def split_ctes(sql: str) -> tuple[list[tuple[str, str]], str]:
+    """
+    Split a query into its CTEs and the final select.
+
+    Parameters
+    ----------
+    sql : str
+        The query, starting with a `WITH` clause.
+
+    Returns
+    -------
+    tuple[list[tuple[str, str]], str]
+        The name and body of every CTE, in order, and the final select.
+
+    Raises
+    ------
+    ValueError
+        When the query does not start with a `WITH` clause.
+    """
+    pos = _skip_space(sql, 0)
+    if sql[pos : pos + 4].upper() != "WITH":
+        raise ValueError("Query does not start with a WITH clause")
+    pos += 4
+
+    stages = []
+    while True:
+        pos = _skip_space(sql, pos)
+        name_start = pos
+        while pos < len(sql) and (sql[pos].isalnum() or sql[pos] == "_"):
+            pos += 1
+        name = sql[name_start:pos]
+
+        pos = _skip_space(sql, pos)
+        if not name or sql[pos : pos + 2].upper() != "AS":
+            raise ValueError(f"Unexpected SQL at position {name_start}")
+        pos = _skip_space(sql, pos + 2)
+        if sql[pos] != "(":
+            raise ValueError(f"Unexpected SQL at position {pos}")
+
+        body_end = _find_closing_parenthesis(sql, pos)
+        stages.append((name.lower(), sql[pos + 1 : body_end].strip()))
+
+        pos = _skip_space(sql, body_end + 1)
+        if sql[pos] != ",":
+            break
+        pos += 1
+
+    return stages, sql[pos:].strip().rstrip(";")
+
+
+def _skip_space(sql: str, pos: int) -> int:
+    """
+    Position of the first character at or after `pos` that is not whitespace or
+    part of a comment.
+    """
+    while pos < len(sql):
+        if sql[pos].isspace():
+            pos += 1
+        elif sql.startswith("--", pos):
+            end = sql.find("\n", pos)
+            pos = len(sql) if end == -1 else end + 1
+        elif sql.startswith("/*", pos):
+            end = sql.find("*/", pos + 2)
+            pos = len(sql) if end == -1 else end + 2
+        else:
+            break
+    return pos
+
+
+def _find_closing_parenthesis(sql: str, pos: int) -> int:
+    """
+    Position of the parenthesis that closes the one at `pos`, ignoring parentheses
+    in comments, string literals and quoted identifiers.
+    """
+    depth = 0
+    while pos < len(sql):
+        next_pos = _skip_space(sql, pos)
+        if next_pos != pos:
+            pos = next_pos
+            continue
+        char = sql[pos]
+        if char in ("'", '"'):
+            end = sql.find(char, pos + 1)
+            # Escaped quotes ('') are read as two consecutive literals
+            pos = len(sql) if end == -1 else end + 1
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return pos
+        pos += 1
+    raise ValueError("Unbalanced parentheses in SQL")
+
+
+def _execute(connection: RS4, sql: str) -> None:
+    database_connector.execute_sql(connection, sql)
+
+
+def _get_columns(connection: RS4, table: str) -> set[str]:
+    data_r = database_connector.query_sql(
+        connection, f"SELECT * FROM pg_temp.{table} LIMIT 0"
+    )
+    return {str(name).lower() for name in data_r.names}